@@ -10,6 +10,9 @@ from data.config_manager import load_config, save_config, load_ratings, save_rat
 # 导入工具函数
 from utils.file_utils import SUPPORTED_FORMATS
 from utils.image_processor import pregenerate_images
+from utils.catalog_scanner import start_catalog_scanner
+from utils.directory_watcher import start_directory_watcher
+from utils.derivative_cache import start_derivative_cache_sweeper
 
 # 导入路由模块
 from routes.directory_routes import directory_bp
@@ -43,6 +46,16 @@ def test():
     return "服务器运行正常!"
 
 if __name__ == '__main__':
+    # 启动目录库后台扫描线程
+    start_catalog_scanner()
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 目录库扫描线程已启动")
+    
+    # 启动目录监控线程（文件变化时精确失效缓存）
+    start_directory_watcher()
+    
+    # 启动派生图片缓存清理线程（孤立文件清理、配额淘汰）
+    start_derivative_cache_sweeper()
+    
     # 启动预生成图片的线程
     if config.get('photo_directories', []):
         pregen_thread = threading.Thread(target=pregenerate_images)
@@ -0,0 +1,77 @@
+import copy
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# 添加项目根目录到Python路径，以便导入模块
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT_DIR)
+
+# 不由pytest收集的脚本：
+# 需要先启动服务器（localhost:5000）手动运行的接口测试脚本，
+# 以及从 app 导入已经移到 utils 中的函数、无法导入的旧脚本
+collect_ignore = [
+    "test_api.py",
+    "test_large_directory.py",
+    "test_route.py",
+    "test_real_image.py",
+    "test_thumbnail_api.py",
+    "test_thumbnail_api2.py",
+    "test_directory_filter.py",
+    "test_folder_penetration.py",
+]
+
+_session_dir = None
+
+
+def pytest_configure(config):
+    """导入模块时会在当前目录创建配置文件、评分数据库和派生图片目录，整个测试过程在临时目录中运行"""
+    global _session_dir
+    _session_dir = tempfile.mkdtemp(prefix="photo_viewer_tests_")
+    os.chdir(_session_dir)
+
+
+def pytest_unconfigure(config):
+    os.chdir(config.invocation_params.dir)
+    if _session_dir:
+        shutil.rmtree(_session_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def isolated_root(tmp_path, monkeypatch):
+    """每个测试使用独立的工作目录、目录库、评分数据库和配置
+
+    派生图片目录（thumbnails、viewer_images、deep_zoom）是相对路径，切换工作目录后写在临时目录中；
+    目录库和评分数据库的文件路径在导入时确定，这里改为临时目录中的文件，测试结束后恢复。
+    """
+    from data import config_manager, photo_catalog
+
+    monkeypatch.chdir(tmp_path)
+
+    saved_config = copy.deepcopy(config_manager.config)
+    monkeypatch.setattr(photo_catalog, "CATALOG_FILE", str(tmp_path / "photo_catalog.db"))
+
+    ratings = config_manager.photo_ratings
+    with ratings._lock:
+        monkeypatch.setattr(ratings, "db_file", str(tmp_path / "ratings.db"))
+        monkeypatch.setattr(ratings, "_ratings", None)
+        monkeypatch.setattr(ratings, "_conn", None)
+        monkeypatch.setattr(ratings, "_pending", {})
+
+    with config_manager.cache_lock:
+        config_manager.cache.clear()
+
+    yield tmp_path
+
+    with ratings._lock:
+        if ratings._conn is not None:
+            ratings.flush()
+            ratings._conn.close()
+    photo_catalog.close_connection()
+    with config_manager.cache_lock:
+        config_manager.cache.clear()
+    config_manager.config.clear()
+    config_manager.config.update(saved_config)
@@ -1,19 +1,52 @@
 import json
 import os
 import threading
+from data.ratings_store import RatingsStore
 
 # 配置文件路径
 CONFIG_FILE = 'config.json'
+# 评分数据库（第一次打开时导入旧版本的JSON评分文件）
+RATINGS_DB_FILE = 'ratings.db'
 RATING_FILE = 'ratings.json'
+LEGACY_RATING_FILES = ['photo_ratings.json', RATING_FILE]
 
 # 默认配置
 default_config = {
     "photo_directories": [],
     "thumbnail_size": (200, 200),
+    "thumbnail_mode": "full",  # 缩略图生成方式：full 解码原图；embedded 优先使用内嵌预览图
+    "thumbnail_storage": "files",  # 缩略图存储方式：files 每张一个文件；pack 按目录追加写入打包文件（内存映射读取）
+    "thumbnail_pack_compact_ratio": 0.3,  # 打包文件中已失效数据超过该比例时压缩
+    "thumbnail_memory_cache_mb": 64,  # 内存中缓存的热门缩略图数据上限（MB，0表示不缓存）
+    "derivative_cache_quota_mb": 0,  # 缩略图和浏览用大图占用磁盘空间上限（MB，0表示不限制），超过时淘汰最久未访问的
+    "derivative_cache_min_free_mb": 1024,  # 磁盘剩余空间低于该值（MB）时淘汰最久未访问的派生图片
+    "derivative_cache_sweep_interval": 3600,  # 派生图片缓存后台清理间隔（秒）
     "viewer_image_max_size": 1024,
+    "derivative_size_ladder": [400, 800, 1600, 2560],  # 按需生成的其他尺寸（像素），请求按宽度或DPR选择最接近的尺寸
+    "deep_zoom_min_pixels": 40 * 1000 * 1000,  # 超过该像素数的图片放大查看时按瓦片（DZI金字塔）加载，而不是下载整张原图
+    "max_image_pixels": 1000 * 1000 * 1000,  # 解码图片的像素数上限（照片是本地可信文件，超过Pillow默认阈值的超大照片也正常处理；0表示不限制）
+    "derivative_formats": [],  # 除JPEG外额外生成的派生图片格式：webp / avif（按浏览器Accept头选择发送）
     "viewer_image_max_file_size": 1024 * 1024,  # 1MB
     "supported_formats": ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'],
-    "cache_expiry": 300  # 缓存过期时间（秒）
+    "cache_expiry": 300,  # 缓存过期时间（秒）
+    "catalog_file": "photo_catalog.db",  # 照片目录库文件
+    "ratings_commit_delay": 0.5,  # 评分修改后等待该时间（秒）再提交，期间的修改合并为一个事务
+    "rating_writeback_mode": "exif",  # 评分写回文件的方式：exif 写入原图EXIF；xmp 写入同名XMP附属文件（不改写原图）；none 不写回
+    "metadata_cache_entries": 2000,  # 内存中缓存的照片元数据（EXIF解析结果）条数上限，文件大小或修改时间变化时重新解析
+    "rating_writeback_delay": 5,  # 评分修改后等待该时间（秒）没有再次修改才写回文件
+    "catalog_rescan_interval": 600,  # 目录库后台重新扫描间隔（秒）
+    "catalog_watch_rescan_interval": 86400,  # inotify目录监控运行时完整重新扫描的间隔（秒），只用于发现监控遗漏的变化
+    "watch_directories": True,  # 监控照片目录的文件变化，按变化精确失效缓存
+    "watch_poll_interval": 30,  # 无法使用inotify时轮询检查目录修改时间的间隔（秒），只重新同步修改时间变化的目录（原地修改的文件由定期完整扫描发现）
+    "pregeneration_workers": 0,  # 预生成工作进程数（0表示使用CPU核心数）
+    "pregeneration_queue_size": 256,  # 预生成工作队列长度上限
+    "thumbnail_cache_control": "private, max-age=3600",  # 缩略图的浏览器缓存策略
+    "viewer_image_cache_control": "private, max-age=3600",  # 浏览用大图的浏览器缓存策略
+    "deep_zoom_cache_control": "private, max-age=3600",  # 瓦片金字塔的浏览器缓存策略
+    "photo_cache_control": "private, no-cache",  # 原图的浏览器缓存策略（每次使用前向服务器校验）
+    "versioned_cache_control": "private, max-age=31536000, immutable",  # 带版本号URL的缓存策略（内容变化后URL随之变化）
+    "photo_offload": "none",  # 原图交给反向代理发送：none / x-accel-redirect（nginx）/ x-sendfile（Apache、lighttpd）
+    "photo_offload_prefix": "/protected_photos"  # x-accel-redirect模式下nginx内部location的前缀
 }
 
 def load_config():
@@ -43,31 +76,61 @@ def save_config(config):
         print(f"[错误] 保存配置文件失败: {str(e)}")
 
 def load_ratings():
-    """加载照片星级评分数据"""
-    if os.path.exists(RATING_FILE):
-        try:
-            with open(RATING_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"[错误] 加载星级评分数据失败: {str(e)}")
-    return {}
+    """加载照片星级评分数据（评分数据库，用法与字典相同）"""
+    return RatingsStore(RATINGS_DB_FILE, LEGACY_RATING_FILES, config.get("ratings_commit_delay", 0.5))
 
 def save_ratings(ratings):
-    """保存照片星级评分数据到文件"""
+    """保存照片星级评分数据（写入评分数据库并立即提交）"""
     try:
-        with open(RATING_FILE, 'w', encoding='utf-8') as f:
-            json.dump(ratings, f, ensure_ascii=False, indent=2)
+        if ratings is not photo_ratings:
+            photo_ratings.update(ratings)
+        photo_ratings.flush()
     except Exception as e:
         print(f"[错误] 保存星级评分数据失败: {str(e)}")
 
 # 缓存和锁机制
 cache = {}
 cache_lock = threading.Lock()
+# 文件监控状态（inotify监控运行时缓存由文件变化事件失效，不再按过期时间失效）
+cache_watch_state = {"active": False}
 
 # 全局配置和评分数据
 config = load_config()
 photo_ratings = load_ratings()
 
 def save_ratings_to_file():
-    """保存当前的星级评分数据到文件（兼容metadata_routes.py中的调用）"""
-    save_ratings(photo_ratings)
\ No newline at end of file
+    """立即提交未写入的星级评分修改（兼容metadata_routes.py中的调用，平时由后台线程合并提交）"""
+    photo_ratings.flush()
+
+def is_cache_entry_fresh(entry, current_time):
+    """检查缓存项是否仍然有效"""
+    if cache_watch_state["active"]:
+        return True
+    # 使用自定义缓存过期时间（如果有），否则使用默认值
+    expiry_time = entry.get('custom_expiry', config['cache_expiry'])
+    return current_time - entry['timestamp'] < expiry_time
+
+def invalidate_cache_for_paths(file_paths):
+    """清除包含指定文件的照片列表缓存和搜索缓存，返回清除的缓存项数量"""
+    changed_dirs = {os.path.normpath(os.path.dirname(file_path)) for file_path in file_paths}
+    if not changed_dirs:
+        return 0
+    
+    with cache_lock:
+        to_remove = []
+        for key, entry in cache.items():
+            if not (key.startswith('photos:') or key.startswith('search:')):
+                continue
+            cached_dir = entry['data'].get('directory', '')
+            # 未指定目录的搜索覆盖所有配置目录
+            if not cached_dir:
+                to_remove.append(key)
+                continue
+            norm_dir = os.path.normpath(cached_dir)
+            prefix = norm_dir.rstrip(os.path.sep) + os.path.sep
+            if any(d == norm_dir or d.startswith(prefix) for d in changed_dirs):
+                to_remove.append(key)
+        
+        for key in to_remove:
+            del cache[key]
+    return len(to_remove)
\ No newline at end of file
@@ -0,0 +1,406 @@
+import os
+import sqlite3
+import threading
+import time
+from data.config_manager import config
+
+# 照片目录库（SQLite）文件路径
+CATALOG_FILE = config.get('catalog_file', 'photo_catalog.db')
+
+# 数据库结构版本，结构变更时递增（目录库只是文件系统的索引，版本不一致时直接重建）
+SCHEMA_VERSION = 2
+
+# 每个线程使用独立的数据库连接
+_local = threading.local()
+# 写操作锁（SQLite同一时间只允许一个写事务）
+_write_lock = threading.Lock()
+
+
+def _create_schema(conn):
+    """创建目录库表结构"""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS photos (
+            path TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            directory TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            rating INTEGER NOT NULL DEFAULT 0,
+            width INTEGER,
+            height INTEGER,
+            capture_date TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_photos_directory ON photos (directory);
+        CREATE INDEX IF NOT EXISTS idx_photos_mtime ON photos (mtime);
+
+        CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            raw_path TEXT NOT NULL,
+            has_images INTEGER NOT NULL,
+            has_subdirectories INTEGER NOT NULL,
+            mtime REAL
+        );
+
+        CREATE TABLE IF NOT EXISTS scanned_roots (
+            path TEXT PRIMARY KEY,
+            scanned_at REAL NOT NULL
+        );
+    """)
+
+
+def _open_connection():
+    """打开数据库连接并确保表结构为最新版本"""
+    conn = sqlite3.connect(CATALOG_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # SQLite内置的lower()只处理ASCII字符，搜索时使用Python的小写转换
+    conn.create_function('py_lower', 1, lambda value: value.lower() if value else value, deterministic=True)
+    # WAL模式允许扫描写入时并发读取
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version != SCHEMA_VERSION:
+        with _write_lock:
+            print(f"[目录库] 表结构版本 {version} 与当前版本 {SCHEMA_VERSION} 不一致，重建目录库")
+            conn.executescript("""
+                DROP TABLE IF EXISTS photos;
+                DROP TABLE IF EXISTS directories;
+                DROP TABLE IF EXISTS scanned_roots;
+            """)
+            _create_schema(conn)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+    return conn
+
+
+def get_connection():
+    """获取当前线程的数据库连接（目录库文件路径改变后重新打开）"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.catalog_file != CATALOG_FILE:
+        close_connection()
+        conn = None
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.catalog_file = CATALOG_FILE
+    return conn
+
+
+def close_connection():
+    """关闭当前线程的数据库连接"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def normalize_directory(directory):
+    """规范化目录路径，作为目录库中的查询键"""
+    return os.path.normpath(directory)
+
+
+def _subtree_range(directory):
+    """返回目录子树在目录库中的路径范围（用于索引范围查询）"""
+    prefix = normalize_directory(directory)
+    if not prefix.endswith(os.path.sep):
+        prefix += os.path.sep
+    # 分隔符的下一个字符作为上界，范围内的路径都以 prefix 开头
+    upper = prefix[:-1] + chr(ord(os.path.sep) + 1)
+    return prefix, upper
+
+
+def is_in_directory(path, root):
+    """检查路径是否是根目录本身或在其子树中（按路径分隔符比较，/photos2 不在 /photos 中）"""
+    norm_path = normalize_directory(path)
+    norm_root = normalize_directory(root)
+    return norm_path == norm_root or norm_path.startswith(norm_root.rstrip(os.path.sep) + os.path.sep)
+
+
+def is_directory_scanned(directory):
+    """检查目录是否已被某个扫描过的根目录覆盖"""
+    conn = get_connection()
+    for row in conn.execute('SELECT path FROM scanned_roots'):
+        if is_in_directory(directory, row['path']):
+            return True
+    return False
+
+
+def get_known_files(directory):
+    """获取目录库中目录子树下已记录的文件及其大小和修改时间"""
+    norm_dir = normalize_directory(directory)
+    lower, upper = _subtree_range(directory)
+    conn = get_connection()
+    rows = conn.execute(
+        'SELECT path, size, mtime FROM photos WHERE directory = ? OR (directory >= ? AND directory < ?)',
+        (norm_dir, lower, upper)
+    )
+    return {row['path']: (row['size'], row['mtime']) for row in rows}
+
+
+def get_directory_files(directory):
+    """获取目录库中目录下（不含子目录）已记录的文件及其大小和修改时间"""
+    conn = get_connection()
+    rows = conn.execute('SELECT path, size, mtime FROM photos WHERE directory = ?', (normalize_directory(directory),))
+    return {row['path']: (row['size'], row['mtime']) for row in rows}
+
+
+def get_directory_mtimes(root):
+    """获取根目录子树下（包括根目录本身）每个目录在扫描时的修改时间：目录路径 -> 修改时间"""
+    norm_root = normalize_directory(root)
+    lower, upper = _subtree_range(root)
+    conn = get_connection()
+    rows = conn.execute(
+        'SELECT raw_path, mtime FROM directories WHERE path = ? OR (path >= ? AND path < ?)',
+        (norm_root, lower, upper)
+    )
+    return {row['raw_path']: row['mtime'] for row in rows}
+
+
+def upsert_photos(photos):
+    """批量写入或更新照片记录"""
+    if not photos:
+        return
+    rows = [(
+        photo['path'],
+        photo['name'],
+        normalize_directory(os.path.dirname(photo['path'])),
+        photo['size'],
+        photo['mtime'],
+        photo.get('rating', 0),
+        photo.get('width'),
+        photo.get('height'),
+        photo.get('capture_date')
+    ) for photo in photos]
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.executemany("""
+            INSERT INTO photos (path, name, directory, size, mtime, rating, width, height, capture_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                name = excluded.name,
+                directory = excluded.directory,
+                size = excluded.size,
+                mtime = excluded.mtime,
+                rating = excluded.rating,
+                width = excluded.width,
+                height = excluded.height,
+                capture_date = excluded.capture_date
+        """, rows)
+
+
+def get_photo_stat(file_path):
+    """获取目录库中记录的照片大小和修改时间，未记录时返回None"""
+    conn = get_connection()
+    row = conn.execute('SELECT size, mtime FROM photos WHERE path = ?', (file_path,)).fetchone()
+    return (row['size'], row['mtime']) if row else None
+
+
+def remove_photos(paths):
+    """批量删除照片记录"""
+    if not paths:
+        return
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.executemany('DELETE FROM photos WHERE path = ?', [(path,) for path in paths])
+
+
+def replace_directories(root, directories):
+    """替换根目录子树下的全部目录记录"""
+    norm_root = normalize_directory(root)
+    lower, upper = _subtree_range(root)
+    rows = [(
+        normalize_directory(d['path']),
+        d['name'],
+        d['path'],
+        1 if d['has_images'] else 0,
+        1 if d['has_subdirectories'] else 0,
+        d.get('mtime')
+    ) for d in directories]
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute(
+            'DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)',
+            (norm_root, lower, upper)
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO directories (path, name, raw_path, has_images, has_subdirectories, mtime) VALUES (?, ?, ?, ?, ?, ?)',
+            rows
+        )
+
+
+def upsert_directory(directory):
+    """写入或更新单个目录记录"""
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO directories (path, name, raw_path, has_images, has_subdirectories, mtime) VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                normalize_directory(directory['path']),
+                directory['name'],
+                directory['path'],
+                1 if directory['has_images'] else 0,
+                1 if directory['has_subdirectories'] else 0,
+                directory.get('mtime')
+            )
+        )
+
+
+def has_directory(directory):
+    """检查目录是否在目录库中有记录"""
+    conn = get_connection()
+    row = conn.execute('SELECT 1 FROM directories WHERE path = ?', (normalize_directory(directory),)).fetchone()
+    return row is not None
+
+
+def mark_directory_scanned(root):
+    """记录根目录已完成扫描"""
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO scanned_roots (path, scanned_at) VALUES (?, ?)',
+            (normalize_directory(root), time.time())
+        )
+
+
+def remove_directory_tree(root):
+    """从目录库中删除根目录子树下的所有记录"""
+    norm_root = normalize_directory(root)
+    lower, upper = _subtree_range(root)
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute(
+            'DELETE FROM photos WHERE directory = ? OR (directory >= ? AND directory < ?)',
+            (norm_root, lower, upper)
+        )
+        conn.execute(
+            'DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)',
+            (norm_root, lower, upper)
+        )
+        conn.execute(
+            'DELETE FROM scanned_roots WHERE path = ? OR (path >= ? AND path < ?)',
+            (norm_root, lower, upper)
+        )
+
+
+def get_all_photo_paths():
+    """获取目录库中所有照片的路径"""
+    conn = get_connection()
+    return [row['path'] for row in conn.execute('SELECT path FROM photos')]
+
+
+def get_photo_directories():
+    """获取目录库中包含照片的所有目录"""
+    conn = get_connection()
+    return [row['directory'] for row in conn.execute('SELECT DISTINCT directory FROM photos')]
+
+
+# 照片列表支持的排序字段及对应的SQL表达式（空值统一按空字符串/0排序，保证游标比较稳定）
+PHOTO_SORT_EXPRESSIONS = {
+    'mtime': 'mtime',
+    'name': 'py_lower(name)',
+    'size': 'size',
+    'rating': 'rating',
+    'capture_date': "COALESCE(capture_date, '')"
+}
+
+
+def query_photos(directory, sort='mtime', descending=True, limit=None, after=None):
+    """查询目录及其所有子目录中的照片
+    
+    按 sort 字段排序，路径作为次要排序键保证顺序稳定；after 为上一页最后一项的
+    (排序值, 路径)，用于游标分页。每一项额外包含 sort_value 字段。
+    """
+    sort_expression = PHOTO_SORT_EXPRESSIONS[sort]
+    direction = 'DESC' if descending else 'ASC'
+    comparison = '<' if descending else '>'
+    norm_dir = normalize_directory(directory)
+    lower, upper = _subtree_range(directory)
+    
+    sql = f"""
+        SELECT *, {sort_expression} AS sort_value FROM photos
+        WHERE (directory = ? OR (directory >= ? AND directory < ?))
+    """
+    params = [norm_dir, lower, upper]
+    if after is not None:
+        sql += f" AND ({sort_expression} {comparison} ? OR ({sort_expression} = ? AND path {comparison} ?))"
+        params += [after[0], after[0], after[1]]
+    sql += f" ORDER BY sort_value {direction}, path {direction}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    
+    conn = get_connection()
+    return [dict(row) for row in conn.execute(sql, params)]
+
+
+def count_photos(directory):
+    """统计目录及其所有子目录中的照片数量"""
+    norm_dir = normalize_directory(directory)
+    lower, upper = _subtree_range(directory)
+    conn = get_connection()
+    row = conn.execute(
+        'SELECT COUNT(*) FROM photos WHERE directory = ? OR (directory >= ? AND directory < ?)',
+        (norm_dir, lower, upper)
+    ).fetchone()
+    return row[0]
+
+
+def query_subdirectories(directory):
+    """查询目录下的所有子目录（不包括目录本身）"""
+    lower, upper = _subtree_range(directory)
+    conn = get_connection()
+    rows = conn.execute(
+        'SELECT * FROM directories WHERE path >= ? AND path < ? ORDER BY path',
+        (lower, upper)
+    )
+    return [{
+        'path': row['raw_path'],
+        'name': row['name'],
+        'has_images': bool(row['has_images']),
+        'has_subdirectories': bool(row['has_subdirectories'])
+    } for row in rows]
+
+
+def search_photos(query, directory):
+    """在目录子树中按文件名搜索照片（不区分大小写，按修改时间倒序）"""
+    norm_dir = normalize_directory(directory)
+    lower, upper = _subtree_range(directory)
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT * FROM photos
+        WHERE (directory = ? OR (directory >= ? AND directory < ?))
+          AND instr(py_lower(name), ?) > 0
+        ORDER BY mtime DESC
+    """, (norm_dir, lower, upper, query.lower()))
+    return [dict(row) for row in rows]
+
+
+def update_rating(file_path, rating):
+    """更新目录库中照片的星级"""
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute('UPDATE photos SET rating = ? WHERE path = ?', (rating, file_path))
+
+
+def update_ratings(ratings):
+    """在一个事务中批量更新目录库中照片的星级（ratings为 路径 -> 星级）"""
+    if not ratings:
+        return
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.executemany('UPDATE photos SET rating = ? WHERE path = ?',
+                         [(rating, file_path) for file_path, rating in ratings.items()])
+
+
+def get_existing_paths(paths):
+    """返回目录库中已记录的照片路径集合（分批查询，避免超过SQLite的参数数量限制）"""
+    conn = get_connection()
+    paths = list(paths)
+    existing = set()
+    for start in range(0, len(paths), 500):
+        chunk = paths[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f'SELECT path FROM photos WHERE path IN ({placeholders})', chunk)
+        existing.update(row['path'] for row in rows)
+    return existing
@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+
+
+class RatingsStore(MutableMapping):
+    """照片星级评分存储（SQLite事务写入，读取使用内存中的字典）
+
+    用法与字典相同：读取直接访问内存字典；写入先更新内存，再由后台线程把一段时间内的修改合并为一个事务提交，
+    不再每次评分都重写整个JSON文件。评分为0表示未评分，不保存记录。
+    第一次打开时导入旧版本保存的JSON评分文件（每个文件只导入一次）。
+    """
+
+    def __init__(self, db_file, legacy_files=(), commit_delay=0.5):
+        self.db_file = db_file
+        self.legacy_files = list(legacy_files)
+        # 修改后等待该时间（秒）再提交，期间的其他修改合并到同一个事务中
+        self.commit_delay = commit_delay
+        self._ratings = None
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._pending_event = threading.Event()
+        self._writer_thread = None
+        self._conn = None
+
+    # ---- 数据库 ----
+
+    def _open_connection(self):
+        conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ratings (
+                path TEXT PRIMARY KEY,
+                rating INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS imported_files (
+                name TEXT PRIMARY KEY,
+                imported_at REAL NOT NULL
+            );
+        """)
+        conn.commit()
+        return conn
+
+    def _import_legacy_files(self, conn):
+        """导入旧版本的JSON评分文件（列表中靠后的文件优先），整个导入在一个事务中完成"""
+        imported = {row[0] for row in conn.execute('SELECT name FROM imported_files')}
+        merged = {}
+        names = []
+        for legacy_file in self.legacy_files:
+            name = os.path.basename(legacy_file)
+            if name in imported or not os.path.exists(legacy_file):
+                continue
+            try:
+                with open(legacy_file, 'r', encoding='utf-8') as f:
+                    ratings = json.load(f)
+            except Exception as e:
+                print(f"[错误] 读取旧评分文件 {legacy_file} 失败: {str(e)}")
+                continue
+            for path, rating in ratings.items():
+                if isinstance(rating, int) and 0 <= rating <= 5:
+                    merged[path] = rating
+            names.append(name)
+        if not names:
+            return
+        # 已经在数据库中的评分是之后修改的，不被旧文件覆盖
+        existing = {row[0] for row in conn.execute('SELECT path FROM ratings')}
+        rows = [(path, rating) for path, rating in merged.items() if rating > 0 and path not in existing]
+        with conn:
+            conn.executemany('INSERT INTO ratings (path, rating) VALUES (?, ?)', rows)
+            conn.executemany('INSERT OR REPLACE INTO imported_files (name, imported_at) VALUES (?, ?)',
+                             [(name, time.time()) for name in names])
+        print(f"[评分] 已从 {', '.join(names)} 导入 {len(rows)} 条评分")
+
+    def _ensure_loaded(self):
+        """第一次访问时打开数据库并把全部评分读入内存（预生成工作进程导入模块时不打开数据库）
+
+        打开失败时抛出异常，不把空字典当作评分数据（否则之后的修改无法保存），下次访问时重试。
+        """
+        if self._ratings is not None:
+            return self._ratings
+        with self._lock:
+            if self._ratings is None:
+                conn = None
+                try:
+                    conn = self._open_connection()
+                    self._import_legacy_files(conn)
+                    ratings = dict(conn.execute('SELECT path, rating FROM ratings'))
+                except Exception as e:
+                    print(f"[错误] 打开评分数据库 {self.db_file} 失败: {str(e)}")
+                    if conn is not None:
+                        conn.close()
+                    raise
+                self._conn = conn
+                self._ratings = ratings
+        return self._ratings
+
+    def _commit(self, changes):
+        """在一个事务中写入一批修改，失败时整个批次回滚"""
+        with self._conn:
+            self._conn.executemany('DELETE FROM ratings WHERE path = ?',
+                                   [(path,) for path, rating in changes.items() if not rating])
+            self._conn.executemany('INSERT OR REPLACE INTO ratings (path, rating) VALUES (?, ?)',
+                                   [(path, rating) for path, rating in changes.items() if rating])
+
+    def flush(self):
+        """立即提交所有未写入的修改，返回提交的数量"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            if self._conn is None:
+                raise sqlite3.OperationalError(f"评分数据库 {self.db_file} 未打开，{len(self._pending)} 条修改未保存")
+            changes = self._pending
+            self._pending = {}
+            try:
+                self._commit(changes)
+            except Exception:
+                # 提交失败的修改放回队列，下次重试（期间的新修改优先）
+                changes.update(self._pending)
+                self._pending = changes
+                raise
+            return len(changes)
+
+    def _writer_loop(self):
+        """后台写入线程：收到修改后等待一小段时间，把期间的修改合并为一个事务提交"""
+        while True:
+            self._pending_event.wait()
+            time.sleep(self.commit_delay)
+            self._pending_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[错误] 保存星级评分数据失败: {str(e)}")
+                time.sleep(5)
+                self._pending_event.set()
+
+    def _schedule_commit(self):
+        if self._writer_thread is None:
+            self._writer_thread = threading.Thread(target=self._writer_loop)
+            self._writer_thread.daemon = True
+            self._writer_thread.start()
+            # 进程退出时提交剩余的修改
+            atexit.register(self.flush)
+        self._pending_event.set()
+
+    # ---- 字典接口 ----
+
+    def __getitem__(self, path):
+        return self._ensure_loaded()[path]
+
+    def get(self, path, default=None):
+        return self._ensure_loaded().get(path, default)
+
+    def __contains__(self, path):
+        return path in self._ensure_loaded()
+
+    def __iter__(self):
+        return iter(list(self._ensure_loaded()))
+
+    def __len__(self):
+        return len(self._ensure_loaded())
+
+    def __setitem__(self, path, rating):
+        self.update({path: rating})
+
+    def __delitem__(self, path):
+        with self._lock:
+            if path not in self._ensure_loaded():
+                raise KeyError(path)
+            self.update({path: 0})
+
+    def update(self, ratings=(), **kwargs):
+        """批量修改评分（一次加锁，合并到同一次提交）"""
+        changes = dict(ratings, **kwargs)
+        if not changes:
+            return
+        with self._lock:
+            current = self._ensure_loaded()
+            for path, rating in changes.items():
+                if rating:
+                    current[path] = rating
+                else:
+                    current.pop(path, None)
+                self._pending[path] = rating
+            self._schedule_commit()
+
+    def copy(self):
+        return dict(self._ensure_loaded())
@@ -2,6 +2,9 @@ from flask import Blueprint, jsonify, request
 import os
 import threading
 from data.config_manager import config, save_config, cache, cache_lock
+from utils.catalog_scanner import scan_directory, remove_directory_from_catalog
+from utils.directory_watcher import watch_directory, unwatch_directory
+from utils.derivative_cache import sweep_in_background
 from utils.file_utils import get_subdirectories_without_images
 from utils.test_utils import pregenerate_images_for_directory
 
@@ -55,6 +58,13 @@ def add_directory():
         # 清空缓存
         with cache_lock:
             cache.clear()
+        
+        # 在独立线程中扫描新目录并写入目录库
+        scan_thread = threading.Thread(target=scan_directory, args=(directory,))
+        scan_thread.daemon = True
+        scan_thread.start()
+        # 开始监控新目录的文件变化
+        watch_directory(directory)
             
         # 在独立线程中预生成该目录的图片，避免阻塞API响应
         pregen_thread = threading.Thread(target=pregenerate_images_for_directory, args=(directory,))
@@ -67,12 +77,17 @@ def add_directory():
 def remove_directory(index):
     """删除照片目录"""
     if 0 <= index < len(config["photo_directories"]):
-        config["photo_directories"].pop(index)
+        removed_directory = config["photo_directories"].pop(index)
         # 保存配置
         save_config(config)
+        # 停止监控并从目录库中移除该目录的记录
+        unwatch_directory(removed_directory)
+        remove_directory_from_catalog(removed_directory)
         # 清空缓存
         with cache_lock:
             cache.clear()
+        # 后台删除该目录下照片的缩略图和浏览用大图
+        sweep_in_background()
         return jsonify({"success": True, "directories": config["photo_directories"]})
     
     return jsonify({"error": "目录索引无效"}), 400
\ No newline at end of file
@@ -1,14 +1,21 @@
 from flask import Blueprint, jsonify, request
 import os
+import stat
 import time
 from datetime import datetime
-import piexif
-from data.config_manager import config, photo_ratings, save_ratings_to_file, cache, cache_lock
-from utils.file_utils import get_all_images_recursive, is_file_accessible
+from data import photo_catalog
+from data.config_manager import config, photo_ratings, cache, cache_lock, is_cache_entry_fresh, invalidate_cache_for_paths
+from utils.catalog_scanner import ensure_directory_scanned
+from utils.file_utils import is_file_accessible
+from utils.rating_writeback import queue_rating_writeback, get_writeback_status
+from utils.metadata_cache import get_cached_metadata, get_metadata_cache_status
 
 # 创建蓝图
 metadata_bp = Blueprint('metadata', __name__)
 
+# 批量获取元数据时一次最多的照片数量
+MAX_METADATA_BATCH = 100
+
 @metadata_bp.route('/photo_metadata/<path:file_path>')
 def get_photo_metadata(file_path):
     """获取照片元数据"""
@@ -21,106 +28,80 @@ def get_photo_metadata(file_path):
     
     print(f"[调试] 获取照片元数据请求: {file_path}")
     
-    # 检查文件是否在配置的目录中（容错处理）
-    is_allowed = False
-    for dir_path in config["photo_directories"]:
-        # 规范化目录路径，确保正确处理编码
-        norm_dir = os.path.normpath(dir_path)
-        norm_file = os.path.normpath(file_path)
-        print(f"[调试] 比较目录 {norm_dir} 和文件路径 {norm_file}")
-        if norm_file.startswith(norm_dir):
-            is_allowed = True
-            print(f"[调试] 文件路径在允许的目录中")
-            break
+    file_stats, error = _check_metadata_path(file_path)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    
+    metadata = _build_metadata_response(file_path, file_stats)
+    print(f"[调试] 元数据获取完成")
+    return jsonify(metadata)
+
+def _check_metadata_path(file_path):
+    """检查文件是否在配置的目录中且是支持的图片文件，返回 (文件状态, 错误)
     
-    if not is_allowed:
+    允许访问时错误为None；否则文件状态为None，错误为 (错误信息, 状态码)。
+    文件只stat一次，文件状态传给元数据缓存用于校验缓存是否有效。
+    """
+    norm_file = os.path.normpath(file_path)
+    if not any(norm_file.startswith(os.path.normpath(dir_path)) for dir_path in config["photo_directories"]):
         print(f"[错误] 访问受限: {file_path}")
-        return jsonify({"error": "访问受限"}), 403
+        return None, ("访问受限", 403)
     
     # 检查文件是否存在
-    if not os.path.isfile(file_path) or os.path.splitext(file_path)[1].lower() not in config['supported_formats']:
-        error_msg = "文件不存在" if not os.path.isfile(file_path) else f"不支持的文件格式: {os.path.splitext(file_path)[1].lower()}"
-        print(f"[错误] 无效的图片文件: {error_msg}")
-        return jsonify({"error": f"无效的图片文件: {error_msg}"}), 400
-    
-    # 构建基础元数据
-    file_stats = os.stat(file_path)
-    metadata = {
-        "basic": {
-            "name": os.path.basename(file_path),
-            "path": file_path,
-            "size": file_stats.st_size,
-            "created": datetime.fromtimestamp(file_stats.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
-            "modified": datetime.fromtimestamp(file_stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
-            "accessed": datetime.fromtimestamp(file_stats.st_atime).strftime('%Y-%m-%d %H:%M:%S')
-        },
-        "exif": {},
-        "custom": {
-            "star_rating": photo_ratings.get(file_path, 0)
-        }
-    }
-    
-    # 尝试获取EXIF数据
     try:
-        # 先检查文件是否为JPEG或TIFF格式，只有这些格式支持EXIF
-        file_ext = os.path.splitext(file_path)[1].lower()
-        if file_ext in ['.jpg', '.jpeg', '.tiff', '.tif']:
-            print(f"[调试] 尝试读取EXIF数据，文件类型: {file_ext}")
-            exif_data = piexif.load(file_path)
-            
-            # 格式化EXIF数据
-            formatted_exif = {}
-            
-            # 处理Image (0th) IFD
-            if piexif.ImageIFD in exif_data and exif_data[piexif.ImageIFD]:
-                formatted_exif['image'] = {}
-                for tag, value in exif_data[piexif.ImageIFD].items():
-                    tag_name = piexif.TAGS['Image'][tag]['name'] if tag in piexif.TAGS['Image'] else str(tag)
-                    # 转换字节类型的值为字符串
-                    if isinstance(value, bytes):
-                        try:
-                            value = value.decode('utf-8', errors='replace')
-                        except:
-                            value = str(value)
-                    formatted_exif['image'][tag_name] = value
-            
-            # 处理Exif (Exif) IFD
-            if piexif.ExifIFD in exif_data and exif_data[piexif.ExifIFD]:
-                formatted_exif['exif'] = {}
-                for tag, value in exif_data[piexif.ExifIFD].items():
-                    tag_name = piexif.TAGS['Exif'][tag]['name'] if tag in piexif.TAGS['Exif'] else str(tag)
-                    # 转换字节类型的值为字符串
-                    if isinstance(value, bytes):
-                        try:
-                            value = value.decode('utf-8', errors='replace')
-                        except:
-                            value = str(value)
-                    formatted_exif['exif'][tag_name] = value
-            
-            # 处理GPS (GPS) IFD
-            if piexif.GPSIFD in exif_data and exif_data[piexif.GPSIFD]:
-                formatted_exif['gps'] = {}
-                for tag, value in exif_data[piexif.GPSIFD].items():
-                    tag_name = piexif.TAGS['GPS'][tag]['name'] if tag in piexif.TAGS['GPS'] else str(tag)
-                    # 转换字节类型的值为字符串
-                    if isinstance(value, bytes):
-                        try:
-                            value = value.decode('utf-8', errors='replace')
-                        except:
-                            value = str(value)
-                    formatted_exif['gps'][tag_name] = value
-            
-            # 添加格式化后的EXIF数据
-            metadata['exif'] = formatted_exif
-            print(f"[调试] 成功读取EXIF数据")
-        else:
-            print(f"[调试] 文件类型不支持EXIF数据: {file_ext}")
-    except Exception as e:
-        print(f"[错误] 读取EXIF数据时出错: {str(e)}")
-        metadata['exif_error'] = str(e)
+        file_stats = os.stat(file_path)
+    except OSError:
+        file_stats = None
+    extension = os.path.splitext(file_path)[1].lower()
+    if file_stats is None or not stat.S_ISREG(file_stats.st_mode):
+        error_msg = "文件不存在"
+    elif extension not in config['supported_formats']:
+        error_msg = f"不支持的文件格式: {extension}"
+    else:
+        return file_stats, None
+    print(f"[错误] 无效的图片文件: {error_msg}")
+    return None, (f"无效的图片文件: {error_msg}", 400)
+
+def _build_metadata_response(file_path, file_stats):
+    """缓存的文件信息和EXIF数据，加上当前的星级"""
+    metadata = dict(get_cached_metadata(file_path, file_stats))
+    metadata["custom"] = {
+        "star_rating": photo_ratings.get(file_path, 0)
+    }
+    return metadata
+
+@metadata_bp.route('/photo_metadata_batch', methods=['POST'])
+def get_photo_metadata_batch():
+    """批量获取照片元数据（查看器预取前后几张照片的元数据）
+
+    请求体: {"paths": [...]}，返回 {"metadata": {路径: 元数据或 {"error": ...}}}
+    """
+    data = request.get_json(silent=True) or {}
+    paths = data.get('paths')
+    if not isinstance(paths, list) or not paths:
+        return jsonify({"error": "缺少必要参数"}), 400
+    if len(paths) > MAX_METADATA_BATCH:
+        return jsonify({"error": f"一次最多获取 {MAX_METADATA_BATCH} 张照片的元数据"}), 400
     
-    print(f"[调试] 元数据获取完成")
-    return jsonify(metadata)
+    results = {}
+    for file_path in paths:
+        if not isinstance(file_path, str) or file_path in results:
+            continue
+        file_stats, error = _check_metadata_path(file_path)
+        if error:
+            results[file_path] = {"error": error[0]}
+            continue
+        try:
+            results[file_path] = _build_metadata_response(file_path, file_stats)
+        except Exception as e:
+            print(f"[错误] 获取 {file_path} 的元数据时出错: {str(e)}")
+            results[file_path] = {"error": str(e)}
+    return jsonify({"metadata": results})
+
+@metadata_bp.route('/metadata_cache_status')
+def metadata_cache_status():
+    """获取元数据缓存的命中统计"""
+    return jsonify(get_metadata_cache_status())
 
 @metadata_bp.route('/search', methods=['GET'])
 def search_photos():
@@ -164,36 +145,34 @@ def search_photos():
     current_time = time.time()
     
     with cache_lock:
-        if cache_key in cache and current_time - cache[cache_key]['timestamp'] < config['cache_expiry']:
+        if cache_key in cache and is_cache_entry_fresh(cache[cache_key], current_time):
             print(f"[调试] 从缓存获取搜索结果")
             return jsonify(cache[cache_key]['data'])
     
     # 执行搜索
     search_results = []
-    query_lower = query.lower()
+    seen_paths = set()
     
     try:
         print(f"[调试] 开始搜索...")
         for search_dir in search_dirs:
             print(f"[调试] 搜索目录: {search_dir}")
-            # 递归获取所有图片文件
-            all_images = get_all_images_recursive(search_dir)
-            
-            # 对每个图片进行搜索匹配
-            for file_path in all_images:
-                # 文件名匹配（不区分大小写）
-                filename = os.path.basename(file_path).lower()
-                if query_lower in filename:
-                    # 创建照片信息
-                    photo_info = {
-                        "name": os.path.basename(file_path),
-                        "path": file_path,
-                        "size": os.path.getsize(file_path),
-                        "modified": datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S'),
-                        "star_rating": photo_ratings.get(file_path, 0)
-                    }
-                    search_results.append(photo_info)
-                    print(f"[调试] 找到匹配项: {file_path}")
+            # 在目录库中按文件名匹配（不区分大小写）
+            ensure_directory_scanned(search_dir)
+            for row in photo_catalog.search_photos(query, search_dir):
+                # 配置目录互相嵌套时避免重复结果
+                if row['path'] in seen_paths:
+                    continue
+                seen_paths.add(row['path'])
+                # 创建照片信息
+                photo_info = {
+                    "name": row['name'],
+                    "path": row['path'],
+                    "size": row['size'],
+                    "modified": datetime.fromtimestamp(row['mtime']).strftime('%Y-%m-%d %H:%M:%S'),
+                    "star_rating": row['rating']
+                }
+                search_results.append(photo_info)
         
         # 按修改时间排序（最新的在前）
         search_results.sort(key=lambda x: x['modified'], reverse=True)
@@ -245,59 +224,88 @@ def update_photo_rating():
             print(f"[错误] 文件访问受限或不存在: {file_path}")
             return jsonify({"error": "文件访问受限或不存在"}), 403
         
-        # 更新评分
+        # 更新评分（评分数据库在后台合并提交）
         photo_ratings[file_path] = rating
+        photo_catalog.update_rating(file_path, rating)
         print(f"[调试] 更新评分成功: {file_path} -> {rating}")
         
-        # 尝试将评分保存到EXIF数据中（如果文件格式支持）
-        try:
-            file_ext = os.path.splitext(file_path)[1].lower()
-            if file_ext in ['.jpg', '.jpeg', '.tiff', '.tif']:
-                print(f"[调试] 尝试将评分保存到EXIF数据中")
-                # 读取当前EXIF数据
-                exif_dict = piexif.load(file_path)
-                
-                # 设置星级评分（使用EXIF中的Rating标签）
-                # Rating是0-5的整数值，直接对应我们的评分系统
-                exif_dict['Exif'][piexif.ExifIFD.Rating] = rating
-                
-                # 将更新后的EXIF数据写入文件
-                exif_bytes = piexif.dump(exif_dict)
-                piexif.insert(exif_bytes, file_path)
-                print(f"[调试] EXIF评分更新成功")
-            else:
-                print(f"[调试] 文件类型不支持EXIF评分更新: {file_ext}")
-        except Exception as exif_error:
-            print(f"[警告] 更新EXIF评分时出错: {str(exif_error)}")
-            # 即使EXIF更新失败，仍然继续更新JSON文件中的评分
-        
-        # 保存评分到JSON文件
-        try:
-            save_ratings_to_file()
-            print(f"[调试] 评分已保存到JSON文件")
-        except Exception as save_error:
-            print(f"[错误] 保存评分到JSON文件时出错: {str(save_error)}")
-            return jsonify({"error": "评分更新成功，但保存失败"}), 500
+        # 评分写回文件（EXIF或XMP附属文件）在后台进行，连续修改同一张照片时只写回最后一次
+        if queue_rating_writeback({file_path: rating}):
+            print(f"[调试] 评分已加入写回队列")
         
         # 清除相关缓存，确保下次请求能获取最新数据
-        with cache_lock:
-            # 查找并清除与该文件相关的缓存
-            to_remove = []
-            for key in cache:
-                # 清除包含该照片的目录缓存
-                if key.startswith('photos:') and os.path.dirname(file_path).startswith(key[7:]):
-                    to_remove.append(key)
-                # 清除搜索缓存
-                elif key.startswith('search:'):
-                    to_remove.append(key)
-            
-            for key in to_remove:
-                if key in cache:
-                    del cache[key]
-            
-            print(f"[调试] 清除了 {len(to_remove)} 个相关缓存项")
+        removed_count = invalidate_cache_for_paths([file_path])
+        print(f"[调试] 清除了 {removed_count} 个相关缓存项")
         
         return jsonify({"success": True, "file_path": file_path, "rating": rating})
     except Exception as e:
         print(f"[错误] 更新评分过程中出错: {str(e)}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+def _is_valid_rating(rating):
+    return isinstance(rating, int) and not isinstance(rating, bool) and 0 <= rating <= 5
+
+@metadata_bp.route('/photo_ratings', methods=['POST'])
+def update_photo_ratings():
+    """批量更新照片星级评分（用于筛选照片）
+
+    请求体: {"ratings": [{"file_path": ..., "rating": 0-5}, ...]}
+    全部评分一起校验，有任何无效项时都不更新；校验通过后在一个事务中保存，相关缓存只清除一次，
+    评分写回文件在后台排队进行。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        entries = data.get('ratings')
+        if not isinstance(entries, list) or not entries:
+            return jsonify({"error": "缺少必要参数"}), 400
+
+        # 同一文件出现多次时以最后一次为准
+        ratings = {}
+        invalid = []
+        for entry in entries:
+            file_path = entry.get('file_path') if isinstance(entry, dict) else None
+            rating = entry.get('rating') if isinstance(entry, dict) else None
+            if not isinstance(file_path, str) or not file_path:
+                invalid.append({"file_path": file_path, "error": "文件路径必须是非空字符串"})
+                continue
+            if not _is_valid_rating(rating):
+                invalid.append({"file_path": file_path, "error": "评分值必须是0-5之间的整数"})
+                continue
+            ratings[file_path] = rating
+        if invalid:
+            print(f"[错误] 批量评分中有 {len(invalid)} 项参数无效")
+            return jsonify({"error": "文件路径或评分值无效", "invalid": invalid}), 400
+
+        # 验证文件路径：目录只规范化一次，文件是否存在优先查询目录库，未入库的才访问文件系统
+        root_prefixes = [os.path.normpath(dir_path).rstrip(os.path.sep) + os.path.sep
+                         for dir_path in config["photo_directories"]]
+        supported_formats = config['supported_formats']
+        cataloged = photo_catalog.get_existing_paths(ratings.keys())
+        for file_path in ratings:
+            norm_file = os.path.normpath(file_path)
+            if not any(norm_file.startswith(prefix) for prefix in root_prefixes) \
+                    or os.path.splitext(file_path)[1].lower() not in supported_formats \
+                    or (file_path not in cataloged and not os.path.isfile(file_path)):
+                invalid.append({"file_path": file_path, "error": "文件访问受限或不存在"})
+        if invalid:
+            print(f"[错误] 批量评分中有 {len(invalid)} 个文件访问受限或不存在")
+            return jsonify({"error": "文件访问受限或不存在", "invalid": invalid}), 403
+
+        # 在一个事务中保存评分
+        photo_ratings.update(ratings)
+        photo_ratings.flush()
+        photo_catalog.update_ratings(ratings)
+
+        writeback_queued = queue_rating_writeback(ratings)
+        removed_count = invalidate_cache_for_paths(ratings.keys())
+        print(f"[调试] 批量更新评分成功: {len(ratings)} 张照片，写回排队 {writeback_queued} 张，清除了 {removed_count} 个相关缓存项")
+
+        return jsonify({"success": True, "updated": len(ratings), "writeback_queued": writeback_queued})
+    except Exception as e:
+        print(f"[错误] 批量更新评分过程中出错: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@metadata_bp.route('/rating_writeback_status')
+def rating_writeback_status():
+    """获取评分写回状态（写回方式、等待写回的数量、已写回和失败的数量、最近的错误）"""
+    return jsonify(get_writeback_status())
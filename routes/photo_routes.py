@@ -1,14 +1,127 @@
-from flask import Blueprint, jsonify, request, send_file
+from flask import Blueprint, Response, jsonify, request, send_file
+from werkzeug.exceptions import HTTPException
+from collections import namedtuple
+import base64
+import json
 import os
+import threading
 import time
 from datetime import datetime
-from data.config_manager import config, cache, cache_lock, photo_ratings
-from utils.file_utils import get_all_images_recursive, get_all_subdirectories, is_file_accessible
-from utils.image_processor import generate_and_save_thumbnail, generate_and_save_viewer_image, get_thumbnail_path, get_viewer_image_path
+from data import photo_catalog
+from data.config_manager import config, cache, cache_lock, is_cache_entry_fresh
+from utils.catalog_scanner import ensure_directory_scanned
+from utils.file_utils import walk_directory_tree, is_file_accessible
+from utils.pregeneration import get_pregeneration_engine
+from utils.http_cache import (build_etag, get_last_modified, get_photo_version, get_versioned_urls,
+                              get_response_cache_control, not_modified_response, apply_cache_headers,
+                              send_photo_file, negotiate_image_format, vary_on_accept, get_requested_size_step,
+                              get_deep_zoom_url)
+from utils.thumbnail_store import (is_packed_format, is_thumbnail_fresh, read_thumbnail, get_memory_thumbnail,
+                                   put_memory_thumbnail, get_memory_cache_status)
+from utils.derivative_cache import record_derivative_access, last_sweep_report, sweep_in_background
+from utils.image_processor import (generate_and_save_thumbnail, generate_and_save_viewer_image, get_thumbnail_path,
+                                   get_viewer_image_path, get_derivative_signature, get_derivative_kind)
+from utils.file_utils import DERIVATIVE_FORMATS
+from utils.deep_zoom import (is_deep_zoom_candidate, build_dzi_descriptor, ensure_level, get_tile_path, get_image_size,
+                             is_pyramid_fresh, is_tile_in_range, TILE_SIZE, TILE_MIMETYPE)
 
 # 创建蓝图
 photo_bp = Blueprint('photo', __name__)
 
+# 照片列表每页最大数量
+MAX_PAGE_SIZE = 1000
+
+# 照片列表中提前生成派生图片的照片数量（完整列表请求只处理前几屏）
+VIEWPORT_PRIORITIZE_COUNT = 200
+# 同一页面在该时间（秒）内重复请求时不再检查缺少的派生图片
+VIEWPORT_PRIORITIZE_INTERVAL = 300
+
+# 最近已检查过缺少派生图片的页面：(目录, 排序字段, 排序方向, 游标) -> 检查时间
+_prioritized_views = {}
+_prioritized_views_lock = threading.Lock()
+
+# 目录库中记录的原图大小和修改时间（与os.stat结果的对应字段同名）
+SourceStat = namedtuple('SourceStat', ['st_size', 'st_mtime'])
+
+def _photo_info_from_row(row):
+    """根据目录库记录构建照片信息（包含内容版本号和带版本号的图片URL）"""
+    version = get_photo_version(row['path'], row['size'], row['mtime'])
+    photo_info = {
+        "name": row['name'],
+        "path": row['path'],
+        "size": row['size'],
+        "modified": datetime.fromtimestamp(row['mtime']).strftime('%Y-%m-%d %H:%M:%S'),
+        "capture_date": row['capture_date'],
+        "width": row['width'],
+        "height": row['height'],
+        "metadata": {"星级": row['rating']},
+        "version": version,
+        **get_versioned_urls(row['path'], version)
+    }
+    # 超大图片放大查看时按瓦片加载
+    if is_deep_zoom_candidate(row['width'], row['height']):
+        photo_info["deep_zoom"] = get_deep_zoom_url(row['path'], version)
+    return photo_info
+
+def _get_source_stat(file_path):
+    """原图的大小和修改时间：优先使用目录库中的记录（由目录监控和后台扫描保持更新），未入库时读取文件，文件不存在时返回None"""
+    catalog_stat = photo_catalog.get_photo_stat(file_path)
+    if catalog_stat is not None:
+        return SourceStat(*catalog_stat)
+    try:
+        return os.stat(file_path)
+    except OSError:
+        return None
+
+def _get_allowed_photo_path(file_path):
+    """解码URL中的照片路径，检查是否在配置的目录中且为支持的图片格式，返回 (照片路径, 错误响应)"""
+    import urllib.parse
+    file_path = urllib.parse.unquote(file_path).replace('/', os.path.sep)
+    norm_file = os.path.normpath(file_path)
+    if not any(norm_file.startswith(os.path.normpath(dir_path)) for dir_path in config["photo_directories"]):
+        return file_path, (jsonify({"error": "访问受限"}), 403)
+    if os.path.splitext(file_path)[1].lower() not in config['supported_formats']:
+        return file_path, (jsonify({"error": "无效的图片文件"}), 400)
+    return file_path, None
+
+def _prioritize_missing_derivatives(view_key, photos):
+    """在后台线程中将当前页面照片缺少的派生图片提到预生成队列前面，不阻塞列表请求
+
+    只检查当前页面（完整列表只检查前几屏）；同一页面最近检查过时直接跳过（例如命中缓存的重复请求）。
+    """
+    photos = photos[:VIEWPORT_PRIORITIZE_COUNT]
+    if not photos:
+        return
+    current_time = time.time()
+    with _prioritized_views_lock:
+        last_time = _prioritized_views.get(view_key)
+        if last_time is not None and current_time - last_time < VIEWPORT_PRIORITIZE_INTERVAL:
+            return
+        _prioritized_views[view_key] = current_time
+        # 清理过期的记录
+        if len(_prioritized_views) > 1000:
+            for key, checked_time in list(_prioritized_views.items()):
+                if current_time - checked_time >= VIEWPORT_PRIORITIZE_INTERVAL:
+                    del _prioritized_views[key]
+    prioritize_thread = threading.Thread(target=get_pregeneration_engine().prioritize_photos, args=(photos,))
+    prioritize_thread.daemon = True
+    prioritize_thread.start()
+
+def _encode_cursor(sort, order, sort_value, path):
+    """将分页位置编码为不透明的游标字符串"""
+    payload = json.dumps([sort, order, sort_value, path], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor, sort, order):
+    """解析分页游标，排序方式与游标不一致或游标无效时返回None"""
+    try:
+        cursor_sort, cursor_order, sort_value, path = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if cursor_sort != sort or cursor_order != order:
+        return None
+    return sort_value, path
+
 @photo_bp.route('/photos', methods=['GET'])
 def get_photos():
     """获取指定目录下的照片列表，包括所有子目录中的图片"""
@@ -34,83 +147,92 @@ def get_photos():
             print(f"[调试] 目录验证失败: {directory}")
             return jsonify({"error": "无效的目录"}), 400
     
-    # 检查缓存
-    cache_key = f"photos:{directory}"
+    # 只扫描配置目录中的目录，其他目录不写入目录库
+    if not any(photo_catalog.is_in_directory(directory, configured_dir) for configured_dir in config["photo_directories"]):
+        print(f"[错误] 目录访问受限: {directory}")
+        return jsonify({"error": "目录访问受限"}), 403
+    
+    # 解析排序和分页参数
+    sort = request.args.get('sort', 'mtime')
+    order = request.args.get('order', 'desc')
+    if sort not in photo_catalog.PHOTO_SORT_EXPRESSIONS or order not in ('asc', 'desc'):
+        return jsonify({"error": f"无效的排序方式: {sort} {order}"}), 400
+    
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return jsonify({"error": f"limit必须是1-{MAX_PAGE_SIZE}之间的整数"}), 400
+    
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor, sort, order)
+        if after is None:
+            return jsonify({"error": "无效的分页游标"}), 400
+    
+    # 分页请求直接查询目录库，完整列表请求使用缓存
+    paginated = limit is not None or cursor
+    cache_key = f"photos:{directory}" if sort == 'mtime' and order == 'desc' else f"photos:{directory}:{sort}:{order}"
     current_time = time.time()
     
-    with cache_lock:
-        if cache_key in cache:
-            # 使用自定义缓存过期时间（如果有），否则使用默认值
-            expiry_time = cache[cache_key].get('custom_expiry', config['cache_expiry'])
-            if current_time - cache[cache_key]['timestamp'] < expiry_time:
+    if not paginated:
+        with cache_lock:
+            # 文件监控运行时缓存一直有效（由文件变化事件失效），否则按过期时间失效
+            if cache_key in cache and is_cache_entry_fresh(cache[cache_key], current_time):
                 print(f"[调试] 从缓存获取照片列表，目录: {directory}")
                 cache_data = cache[cache_key]['data']
                 print(f"[调试] 缓存中的照片数量: {len(cache_data.get('photos', []))}, 子目录数量: {len(cache_data.get('subdirectories', []))}")
-                print(f"[调试] 缓存过期时间: {expiry_time}秒")
-                return jsonify(cache_data)
+                _prioritize_missing_derivatives((directory, sort, order, cursor), cache_data['photos'])
+                response = jsonify(cache_data)
+                response.headers['X-Total-Count'] = str(cache_data['total'])
+                return response
     
-    # 获取照片列表（递归获取所有子目录中的图片）
-    photos = []
+    # 获取照片列表（从目录库查询目录及所有子目录中的图片）
     try:
-        # 递归获取所有图片文件
-        print(f"[调试] 开始递归获取目录 {directory} 及其子目录中的图片")
-        all_image_files = get_all_images_recursive(directory)
-        print(f"[调试] 递归获取完成，共找到 {len(all_image_files)} 张图片")
-        
-        # 为每个图片文件创建信息
-        # 优化：对于大量文件，只获取基本信息，减少日志输出
-        for i, file_path in enumerate(all_image_files):
-            filename = os.path.basename(file_path)
-            # 创建照片基本信息
-            photo_info = {
-                "name": filename,
-                "path": file_path,
-                "size": os.path.getsize(file_path),
-                "modified": datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S'),
-                "capture_date": None,  # 初始化拍摄日期为空
-                "metadata": {}
-            }
-            
-            # 优化：只获取基础信息，延迟获取EXIF信息（在需要时由前端请求）
-            # 仅从photo_ratings中获取星级，避免重复打开图片文件
-            star_rating = photo_ratings.get(file_path, 0)
-            photo_info["metadata"] = {"星级": star_rating}
-            
-            photos.append(photo_info)
+        # 首次访问的目录先扫描入库，之后由后台扫描线程和文件监控保持同步
+        ensure_directory_scanned(directory)
+        rows = photo_catalog.query_photos(directory, sort=sort, descending=(order == 'desc'), limit=limit, after=after)
+        print(f"[调试] 目录库查询完成，返回 {len(rows)} 张图片")
+        # 当前浏览的照片优先生成缩略图和浏览用大图
+        _prioritize_missing_derivatives((directory, sort, order, cursor), rows)
         
-        # 按修改时间排序（最新的在前）
-        photos.sort(key=lambda x: x['modified'], reverse=True)
-        print(f"[调试] 照片排序完成，共 {len(photos)} 张照片")
+        # 优化：只返回基础信息，EXIF信息在需要时由前端请求
+        photos = [_photo_info_from_row(row) for row in rows]
+        total = photo_catalog.count_photos(directory) if paginated else len(photos)
         
-        # 获取所有子目录列表
-        print(f"[调试] 开始获取目录 {directory} 下的所有子目录")
-        subdirectories = get_all_subdirectories(directory)
-        print(f"[调试] 找到 {len(subdirectories)} 个子目录")
-        # 输出找到的子目录详情
-        for subdir in subdirectories:
-            status = "包含图片" if subdir['has_images'] else "不含图片"
-            print(f"[调试] 子目录: {subdir['name']} ({subdir['path']}) - {status}")
+        result = {"photos": photos, "directory": directory, "total": total, "next_cursor": None}
+        if limit is not None and len(rows) == limit:
+            last_row = rows[-1]
+            result["next_cursor"] = _encode_cursor(sort, order, last_row['sort_value'], last_row['path'])
         
-        # 缓存结果
-        result = {"photos": photos, "directory": directory, "subdirectories": subdirectories}
-        print(f"[调试] 准备返回结果 - 照片数: {len(photos)}, 子目录数: {len(subdirectories)}")
+        # 子目录列表只在第一页返回
+        if not cursor:
+            result["subdirectories"] = photo_catalog.query_subdirectories(directory)
+            print(f"[调试] 找到 {len(result['subdirectories'])} 个子目录")
         
-        # 增强缓存：对于大目录，增加缓存过期时间
-        cache_expiry = config['cache_expiry']
-        if len(photos) > 500:  # 对于超过500张图片的大目录，延长缓存时间
-            cache_expiry = cache_expiry * 2  # 缓存时间翻倍
-            print(f"[调试] 检测到大目录，延长缓存时间至 {cache_expiry} 秒")
-        
-        with cache_lock:
-            cache[cache_key] = {
-                'timestamp': current_time,
-                'data': result,
-                'custom_expiry': cache_expiry  # 存储自定义缓存过期时间
-            }
+        if not paginated:
+            # 增强缓存：对于大目录，增加缓存过期时间
+            cache_expiry = config['cache_expiry']
+            if len(photos) > 500:  # 对于超过500张图片的大目录，延长缓存时间
+                cache_expiry = cache_expiry * 2  # 缓存时间翻倍
+                print(f"[调试] 检测到大目录，延长缓存时间至 {cache_expiry} 秒")
+            
+            with cache_lock:
+                cache[cache_key] = {
+                    'timestamp': current_time,
+                    'data': result,
+                    'custom_expiry': cache_expiry  # 存储自定义缓存过期时间
+                }
         
         # 记录请求完成日志
         print(f"[调试] get_photos请求完成，耗时: {time.time() - current_time:.2f}秒")
-        return jsonify(result)
+        response = jsonify(result)
+        response.headers['X-Total-Count'] = str(total)
+        return response
     except Exception as e:
         print(f"[错误] 获取照片列表时出错: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -145,8 +267,9 @@ def get_thumbnail(file_path):
         print(f"[错误] 访问受限: {file_path}")
         return jsonify({"error": "访问受限"}), 403
     
-    # 检查文件是否存在
-    file_exists = os.path.isfile(file_path)
+    # 检查文件是否存在（优先使用目录库记录的大小和修改时间，热门缩略图不需要访问文件系统）
+    source_stat = _get_source_stat(file_path)
+    file_exists = source_stat is not None
     file_ext = os.path.splitext(file_path)[1].lower()
     is_supported_format = file_ext in config['supported_formats']
     
@@ -159,19 +282,49 @@ def get_thumbnail(file_path):
         print(f"[错误] 无效的图片文件: {error_msg}")
         return jsonify({"error": f"无效的图片文件: {error_msg}"}), 400
     
-    # 获取缩略图存储路径
-    thumbnail_path = get_thumbnail_path(file_path)
+    # 按浏览器支持的格式选择缩略图编码（WebP/AVIF/JPEG），按请求的宽度或DPR选择尺寸，不同格式和尺寸的ETag不同
+    fmt = negotiate_image_format()
+    size = get_requested_size_step("thumbnail")
+    kind = get_derivative_kind("thumbnail", fmt, size)
+    signature = get_derivative_signature(kind)
     
-    # 检查本地是否存在缩略图
-    if not os.path.exists(thumbnail_path) or os.path.getmtime(thumbnail_path) < os.path.getmtime(file_path):
-        # 缩略图不存在或已过期，生成新的
-        generate_and_save_thumbnail(file_path)
+    # 浏览器缓存的版本仍然有效时直接返回304，不生成也不读取缩略图
+    etag = build_etag(file_path, source_stat.st_size, source_stat.st_mtime, signature)
+    last_modified = get_last_modified(source_stat)
+    cache_control = get_response_cache_control("thumbnail", file_path, source_stat)
+    not_modified = not_modified_response(etag, last_modified, cache_control)
+    if not_modified is not None:
+        return vary_on_accept(not_modified)
     
-    # 直接发送本地缩略图文件
-    try:
-        return send_file(thumbnail_path, mimetype='image/jpeg')
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    # 内存中缓存的缩略图
+    thumbnail_data = get_memory_thumbnail(file_path, source_stat.st_mtime, signature, kind)
+    if thumbnail_data is None:
+        # 未命中时以文件系统的实际状态为准（目录库可能尚未更新）
+        try:
+            source_stat = os.stat(file_path)
+        except OSError:
+            return jsonify({"error": "无效的图片文件: 文件不存在"}), 400
+        etag = build_etag(file_path, source_stat.st_size, source_stat.st_mtime, signature)
+        last_modified = get_last_modified(source_stat)
+        cache_control = get_response_cache_control("thumbnail", file_path, source_stat)
+        
+        # 检查本地是否存在缩略图
+        if not is_thumbnail_fresh(file_path, source_stat.st_mtime, fmt, size):
+            # 缩略图不存在或已过期，生成新的
+            # 页面请求生成期间，后台预生成任务暂停
+            with get_pregeneration_engine().interactive():
+                generate_and_save_thumbnail(file_path, fmt, size)
+        
+        # 读取本地缩略图（打包存储时从内存映射的打包文件中读取）并加入内存缓存
+        thumbnail_data = read_thumbnail(file_path, fmt, size)
+        if thumbnail_data is None:
+            return jsonify({"error": "缩略图生成失败"}), 500
+        put_memory_thumbnail(file_path, source_stat.st_mtime, signature, thumbnail_data, kind)
+    
+    if not is_packed_format(fmt, size):
+        record_derivative_access(get_thumbnail_path(file_path, create_dir=False, fmt=fmt, size=size))
+    response = Response(thumbnail_data, mimetype=DERIVATIVE_FORMATS[fmt][1])
+    return vary_on_accept(apply_cache_headers(response, etag, last_modified, cache_control))
 
 @photo_bp.route('/viewer_image/<path:file_path>')
 def get_viewer_image(file_path):
@@ -200,17 +353,97 @@ def get_viewer_image(file_path):
     if not os.path.isfile(file_path) or os.path.splitext(file_path)[1].lower() not in config['supported_formats']:
         return jsonify({"error": "无效的图片文件"}), 400
     
-    # 获取浏览用大图存储路径
-    viewer_image_path = get_viewer_image_path(file_path)
+    # 按浏览器支持的格式选择编码（WebP/AVIF/JPEG），按请求的宽度或DPR选择尺寸，不同格式和尺寸的ETag不同
+    fmt = negotiate_image_format()
+    size = get_requested_size_step("viewer_image")
+    
+    # 浏览器缓存的版本仍然有效时直接返回304，不生成也不读取浏览用大图
+    source_stat = os.stat(file_path)
+    etag = build_etag(file_path, source_stat.st_size, source_stat.st_mtime,
+                      get_derivative_signature(get_derivative_kind("viewer_image", fmt, size)))
+    last_modified = get_last_modified(source_stat)
+    cache_control = get_response_cache_control("viewer_image", file_path, source_stat)
+    not_modified = not_modified_response(etag, last_modified, cache_control)
+    if not_modified is not None:
+        return vary_on_accept(not_modified)
+    
+    # 获取浏览用大图存储路径（不创建目录，需要生成时由生成过程创建）
+    viewer_image_path = get_viewer_image_path(file_path, create_dir=False, fmt=fmt, size=size)
     
     # 检查本地是否存在浏览用大图
-    if not os.path.exists(viewer_image_path) or os.path.getmtime(viewer_image_path) < os.path.getmtime(file_path):
+    if not os.path.exists(viewer_image_path) or os.path.getmtime(viewer_image_path) < source_stat.st_mtime:
         # 浏览用大图不存在或已过期，生成新的
-        generate_and_save_viewer_image(file_path)
+        with get_pregeneration_engine().interactive():
+            generate_and_save_viewer_image(file_path, fmt, size)
     
     # 直接发送本地浏览用大图文件
     try:
-        return send_file(viewer_image_path, mimetype='image/jpeg')
+        record_derivative_access(viewer_image_path)
+        response = send_file(viewer_image_path, mimetype=DERIVATIVE_FORMATS[fmt][1], etag=etag, last_modified=last_modified)
+        return vary_on_accept(apply_cache_headers(response, etag, last_modified, cache_control))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@photo_bp.route('/deep_zoom/<path:file_path>.dzi')
+def get_deep_zoom_descriptor(file_path):
+    """获取超大图片的瓦片金字塔描述（DZI），各层级的瓦片在第一次请求时生成"""
+    file_path, error = _get_allowed_photo_path(file_path)
+    if error is not None:
+        return error
+    source_stat = _get_source_stat(file_path)
+    if source_stat is None:
+        return jsonify({"error": "无效的图片文件: 文件不存在"}), 400
+    
+    etag = build_etag(file_path, source_stat.st_size, source_stat.st_mtime, f"deep_zoom:{TILE_SIZE}")
+    last_modified = get_last_modified(source_stat)
+    cache_control = get_response_cache_control("deep_zoom", file_path, source_stat)
+    not_modified = not_modified_response(etag, last_modified, cache_control)
+    if not_modified is not None:
+        return not_modified
+    
+    try:
+        width, height = get_image_size(file_path)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if not is_deep_zoom_candidate(width, height):
+        return jsonify({"error": "图片尺寸未达到瓦片加载的阈值"}), 404
+    response = Response(build_dzi_descriptor(width, height), mimetype='application/xml')
+    return apply_cache_headers(response, etag, last_modified, cache_control)
+
+@photo_bp.route('/deep_zoom/<path:file_path>_files/<int:level>/<int:col>_<int:row>.jpg')
+def get_deep_zoom_tile(file_path, level, col, row):
+    """获取瓦片金字塔中的一个瓦片，所在层级不存在或已过期时先生成（按层级尺寸解码原图，缓存到磁盘）"""
+    file_path, error = _get_allowed_photo_path(file_path)
+    if error is not None:
+        return error
+    source_stat = _get_source_stat(file_path)
+    if source_stat is None:
+        return jsonify({"error": "无效的图片文件: 文件不存在"}), 400
+    
+    etag = build_etag(file_path, source_stat.st_size, source_stat.st_mtime, f"deep_zoom:{TILE_SIZE}:{level}/{col}_{row}")
+    last_modified = get_last_modified(source_stat)
+    cache_control = get_response_cache_control("deep_zoom", file_path, source_stat)
+    not_modified = not_modified_response(etag, last_modified, cache_control)
+    if not_modified is not None:
+        return not_modified
+    
+    tile_path = get_tile_path(file_path, level, col, row)
+    if not (is_pyramid_fresh(file_path, source_stat.st_mtime) and os.path.exists(tile_path)):
+        try:
+            width, height = get_image_size(file_path)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        if not is_deep_zoom_candidate(width, height) or not is_tile_in_range(width, height, level, col, row):
+            return jsonify({"error": "瓦片不存在"}), 404
+        # 只生成请求的层级（瓦片缺失时重新生成该层级）；页面请求生成期间，后台预生成任务暂停
+        with get_pregeneration_engine().interactive():
+            if not ensure_level(file_path, source_stat.st_mtime, level):
+                return jsonify({"error": "瓦片生成失败"}), 500
+    
+    try:
+        record_derivative_access(tile_path)
+        response = send_file(tile_path, mimetype=TILE_MIMETYPE, etag=etag, last_modified=last_modified)
+        return apply_cache_headers(response, etag, last_modified, cache_control)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -241,11 +474,43 @@ def get_photo(file_path):
     if not os.path.isfile(file_path) or os.path.splitext(file_path)[1].lower() not in config['supported_formats']:
         return jsonify({"error": "无效的图片文件"}), 400
     
+    source_stat = os.stat(file_path)
+    etag = build_etag(file_path, source_stat.st_size, source_stat.st_mtime)
+    last_modified = get_last_modified(source_stat)
+    cache_control = get_response_cache_control("photo", file_path, source_stat)
+    not_modified = not_modified_response(etag, last_modified, cache_control)
+    if not_modified is not None:
+        return not_modified
+    
     try:
-        return send_file(file_path)
+        return send_photo_file(file_path, etag, last_modified, cache_control)
+    except HTTPException:
+        # 例如Range超出文件范围（416），交给Flask返回对应的状态码
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@photo_bp.route('/pregeneration_status', methods=['GET'])
+def get_pregeneration_status():
+    """获取预生成引擎的状态和统计数据"""
+    return jsonify(get_pregeneration_engine().get_status())
+
+@photo_bp.route('/thumbnail_cache_status', methods=['GET'])
+def get_thumbnail_cache_status():
+    """获取内存缩略图缓存的命中统计"""
+    return jsonify(get_memory_cache_status())
+
+@photo_bp.route('/derivative_cache_status', methods=['GET'])
+def get_derivative_cache_status():
+    """获取最近一次派生图片缓存清理的结果"""
+    return jsonify(last_sweep_report)
+
+@photo_bp.route('/derivative_cache_sweep', methods=['POST'])
+def trigger_derivative_cache_sweep():
+    """立即在后台清理派生图片缓存（删除孤立文件，超过配额时淘汰最久未访问的）"""
+    sweep_in_background()
+    return jsonify({"success": True})
+
 @photo_bp.route('/test_photos', methods=['GET'])
 def test_photos():
     """测试路由，用于调试get_photos函数的执行情况"""
@@ -265,15 +530,12 @@ def test_photos():
     
     # 尝试获取该目录下的照片
     try:
-        # 直接调用get_all_images_recursive函数
-        print(f"[测试] 调用get_all_images_recursive函数")
-        all_images = get_all_images_recursive(test_dir)
-        print(f"[测试] get_all_images_recursive返回 {len(all_images)} 张图片")
-        
-        # 尝试获取子目录
-        print(f"[测试] 调用get_all_subdirectories函数")
-        subdirs = get_all_subdirectories(test_dir)
-        print(f"[测试] get_all_subdirectories返回 {len(subdirs)} 个子目录")
+        # 单次遍历目录树，同时获取图片和子目录
+        print(f"[测试] 调用walk_directory_tree函数")
+        tree = walk_directory_tree(test_dir)
+        all_images = [image['path'] for image in tree['images']]
+        subdirs = tree['directories'][1:]
+        print(f"[测试] walk_directory_tree返回 {len(all_images)} 张图片, {len(subdirs)} 个子目录")
         
         # 构建测试结果
         result = {
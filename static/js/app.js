@@ -246,8 +246,10 @@ function setupEventListeners() {
     
     // 排序选项
     addSafeEventListener(elements.sortSelect, 'change', () => {
-        sortPhotos();
-        renderPhotos();
+        // 排序由服务端完成，重新加载当前目录
+        if (state.currentDirectory) {
+            loadPhotos(state.currentDirectory);
+        }
     });
     
     // 搜索
@@ -184,127 +184,103 @@ function renderPhotos() {
     
     // 渲染照片
     state.photos.forEach((photo, index) => {
-        try {
-            // 创建照片容器
-            const photoContainer = document.createElement('div');
-            photoContainer.className = 'photo-container bg-white rounded-lg shadow-sm overflow-hidden hover:shadow-md transition-all duration-300 card-hover';
-            
-            // 创建照片包装器
-            const photoWrapper = document.createElement('div');
-            photoWrapper.className = 'photo-wrapper aspect-square';
-            
-            // 创建图片元素
-            const img = document.createElement('img');
-            
-            // 设置图片源（使用缩略图或原图）
-            if (photo.thumbnail) {
-                img.src = photo.thumbnail;
-            } else if (photo.path) {
-                img.src = `/api/thumbnail/${encodeURIComponent(photo.path)}`;
-            } else if (photo.url) {
-                img.src = photo.url;
-            } else {
-                // 如果没有有效的图片源，使用占位图
-                img.src = 'data:image/svg+xml;charset=utf-8,%3Csvg%20xmlns%3D%22http%3A%2F%2Fwww.w3.org%2F2000%2Fsvg%22%20width%3D%22200%22%20height%3D%22150%22%20viewBox%3D%220%200%20200%20150%22%3E%3Crect%20width%3D%22200%22%20height%3D%22150%22%20fill%3D%22%23f3f4f6%22%2F%3E%3Ctext%20x%3D%22100%22%20y%3D%2285%22%20font-family%3D%22Arial%22%20font-size%3D%2216%22%20text-anchor%3D%22middle%22%20fill%3D%22%239ca3af%22%3E照片%3C%2Ftext%3E%3C%2Fsvg%3E';
-            }
-            
-            // 设置图片属性
-            img.alt = photo.name || `照片${index + 1}`;
-            img.className = 'object-cover w-full h-full';
-            img.loading = 'lazy'; // 使用懒加载
-            
-            // 添加点击事件以打开大图查看器
-            photoContainer.addEventListener('click', () => {
-                openLightbox(index);
-            });
-            
-            // 将图片添加到包装器
-            photoWrapper.appendChild(img);
-            
-            // 将包装器添加到容器
-            photoContainer.appendChild(photoWrapper);
-            
-            // 将照片容器添加到画廊
-            elements.gallery.appendChild(photoContainer);
-            
-        } catch (error) {
-            console.error(`渲染照片[${index}]失败:`, error);
-            // 创建错误占位符
-            const errorElement = document.createElement('div');
-            errorElement.className = 'bg-gray-100 rounded-lg p-4 flex items-center justify-center aspect-video';
-            errorElement.innerHTML = '<i class="fa fa-exclamation-circle text-red-500 text-2xl"></i>';
-            elements.gallery.appendChild(errorElement);
-        }
+        elements.gallery.appendChild(createPhotoElement(photo, index));
     });
     
     console.log(`=== 照片渲染完成，共渲染 ${state.photos.length} 张照片 ===`);
 }
 
-// 排序照片
-function sortPhotos() {
-    console.log('=== 开始排序照片 ===');
-    
-    if (!state.photos || state.photos.length <= 1) {
-        console.log('无需排序，照片数量不足');
+// 追加渲染后续分页加载的照片
+function appendPhotos(photos) {
+    if (!elements.gallery || !photos || photos.length === 0) {
         return;
     }
     
-    // 获取排序方式
-    const sortMethod = elements.sortSelect ? elements.sortSelect.value : 'newest';
-    console.log('排序方式:', sortMethod);
-    
-    // 根据选择的排序方式对照片进行排序
-    switch (sortMethod) {
-        case 'newest':
-            // 按修改时间倒序排序（最新优先）
-            state.photos.sort((a, b) => {
-                const dateA = new Date(a.modified || 0).getTime();
-                const dateB = new Date(b.modified || 0).getTime();
-                return dateB - dateA;
-            });
-            break;
+    const startIndex = state.photos.length;
+    state.photos = state.photos.concat(photos);
+    
+    const fragment = document.createDocumentFragment();
+    photos.forEach((photo, offset) => {
+        fragment.appendChild(createPhotoElement(photo, startIndex + offset));
+    });
+    elements.gallery.appendChild(fragment);
+}
+
+// 创建单张照片的画廊元素
+function createPhotoElement(photo, index) {
+    try {
+        // 创建照片容器
+        const photoContainer = document.createElement('div');
+        photoContainer.className = 'photo-container bg-white rounded-lg shadow-sm overflow-hidden hover:shadow-md transition-all duration-300 card-hover';
         
-        case 'oldest':
-            // 按修改时间正序排序（最旧优先）
-            state.photos.sort((a, b) => {
-                const dateA = new Date(a.modified || 0).getTime();
-                const dateB = new Date(b.modified || 0).getTime();
-                return dateA - dateB;
-            });
-            break;
+        // 创建照片包装器
+        const photoWrapper = document.createElement('div');
+        photoWrapper.className = 'photo-wrapper aspect-square';
         
-        case 'name-asc':
-            // 按名称字母顺序升序排序（A-Z）
-            state.photos.sort((a, b) => {
-                const nameA = (a.name || '').toLowerCase();
-                const nameB = (b.name || '').toLowerCase();
-                return nameA.localeCompare(nameB);
-            });
-            break;
+        // 创建图片元素
+        const img = document.createElement('img');
         
-        case 'name-desc':
-            // 按名称字母顺序降序排序（Z-A）
-            state.photos.sort((a, b) => {
-                const nameA = (a.name || '').toLowerCase();
-                const nameB = (b.name || '').toLowerCase();
-                return nameB.localeCompare(nameA);
-            });
-            break;
+        // 设置图片源（使用缩略图或原图）
+        if (photo.thumbnail) {
+            img.src = photo.thumbnail;
+            // 高分辨率屏幕按设备像素比选择更大尺寸的缩略图
+            if (photo.thumbnail_srcset) {
+                img.srcset = photo.thumbnail_srcset;
+            }
+        } else if (photo.path) {
+            img.src = `/api/thumbnail/${encodeURIComponent(photo.path)}`;
+        } else if (photo.url) {
+            img.src = photo.url;
+        } else {
+            // 如果没有有效的图片源，使用占位图
+            img.src = 'data:image/svg+xml;charset=utf-8,%3Csvg%20xmlns%3D%22http%3A%2F%2Fwww.w3.org%2F2000%2Fsvg%22%20width%3D%22200%22%20height%3D%22150%22%20viewBox%3D%220%200%20200%20150%22%3E%3Crect%20width%3D%22200%22%20height%3D%22150%22%20fill%3D%22%23f3f4f6%22%2F%3E%3Ctext%20x%3D%22100%22%20y%3D%2285%22%20font-family%3D%22Arial%22%20font-size%3D%2216%22%20text-anchor%3D%22middle%22%20fill%3D%22%239ca3af%22%3E照片%3C%2Ftext%3E%3C%2Fsvg%3E';
+        }
         
-        case 'rating-desc':
-            // 按星级降序排序
-            state.photos.sort((a, b) => {
-                const ratingA = a.rating || 0;
-                const ratingB = b.rating || 0;
-                return ratingB - ratingA;
-            });
-            break;
+        // 设置图片属性
+        img.alt = photo.name || `照片${index + 1}`;
+        img.className = 'object-cover w-full h-full';
+        img.loading = 'lazy'; // 使用懒加载
+        
+        // 添加点击事件以打开大图查看器
+        photoContainer.addEventListener('click', () => {
+            openLightbox(index);
+        });
+        
+        // 将图片添加到包装器
+        photoWrapper.appendChild(img);
         
-        default:
-            console.warn('未知的排序方式:', sortMethod);
+        // 将包装器添加到容器
+        photoContainer.appendChild(photoWrapper);
+        
+        return photoContainer;
+    } catch (error) {
+        console.error(`渲染照片[${index}]失败:`, error);
+        // 创建错误占位符
+        const errorElement = document.createElement('div');
+        errorElement.className = 'bg-gray-100 rounded-lg p-4 flex items-center justify-center aspect-video';
+        errorElement.innerHTML = '<i class="fa fa-exclamation-circle text-red-500 text-2xl"></i>';
+        return errorElement;
     }
-    
-    console.log('=== 照片排序完成 ===');
+}
+
+// 排序方式与服务端排序参数的对应关系
+const PHOTO_SORT_PARAMS = {
+    'newest': { sort: 'mtime', order: 'desc' },
+    'oldest': { sort: 'mtime', order: 'asc' },
+    'name-asc': { sort: 'name', order: 'asc' },
+    'name-desc': { sort: 'name', order: 'desc' },
+    'rating-desc': { sort: 'rating', order: 'desc' },
+    'capture-desc': { sort: 'capture_date', order: 'desc' },
+    'size-desc': { sort: 'size', order: 'desc' }
+};
+
+// 每页加载的照片数量
+const PHOTO_PAGE_SIZE = 200;
+
+// 获取当前选择的排序参数（排序由服务端完成）
+function getPhotoSortParams() {
+    const sortMethod = elements.sortSelect ? elements.sortSelect.value : 'newest';
+    return PHOTO_SORT_PARAMS[sortMethod] || PHOTO_SORT_PARAMS['newest'];
 }
 
 // 渲染子目录
@@ -718,11 +694,16 @@ function updateBreadcrumb() {
     });
 }
 
-// 加载照片
+// 加载照片（分页加载：第一页到达后立即渲染，后续页面在后台继续加载并追加）
 function loadPhotos(directory) {
     console.log('=== 开始加载照片 ===');
     console.log('当前选择的目录:', directory);
     
+    // 每次加载生成新的标识，切换目录或排序后丢弃旧请求的后续分页
+    const loadToken = {};
+    state.photosLoadToken = loadToken;
+    state.photos = [];
+    
     // 显示加载状态
     elements.gallery.innerHTML = '';
     const loading = document.createElement('div');
@@ -730,13 +711,23 @@ function loadPhotos(directory) {
     loading.innerHTML = '<i class="fa fa-spinner fa-spin text-4xl text-primary mb-4"></i><p class="text-gray-500">正在加载照片...</p>';
     elements.gallery.appendChild(loading);
     
-    const apiUrl = `/api/photos?dir=${encodeURIComponent(directory)}`;
+    loadPhotoPage(directory, null, loadToken);
+}
+
+// 加载一页照片
+function loadPhotoPage(directory, cursor, loadToken) {
+    const { sort, order } = getPhotoSortParams();
+    let apiUrl = `/api/photos?dir=${encodeURIComponent(directory)}&sort=${sort}&order=${order}&limit=${PHOTO_PAGE_SIZE}`;
+    if (cursor) {
+        apiUrl += `&cursor=${encodeURIComponent(cursor)}`;
+    }
     console.log('准备请求照片API:', apiUrl);
     
+    let totalCount = null;
     fetch(apiUrl)
         .then(response => {
             console.log('照片API响应状态:', response.status);
-            console.log('照片API响应头部:', response.headers.get('content-type'));
+            totalCount = parseInt(response.headers.get('X-Total-Count'), 10);
             return response.json().catch(error => {
                 console.error('解析JSON失败:', error);
                 // 尝试查看原始响应内容
@@ -747,58 +738,65 @@ function loadPhotos(directory) {
             });
         })
         .then(data => {
-            console.log('照片API返回数据:', data);
-            
-            // 详细检查返回数据结构
-            console.log('数据类型:', typeof data);
-            console.log('数据包含photos属性:', 'photos' in data);
-            console.log('photos是否为数组:', Array.isArray(data.photos));
-            console.log('photos数量:', data.photos ? data.photos.length : 0);
+            // 已切换到其他目录或排序方式，丢弃本次结果
+            if (state.photosLoadToken !== loadToken) {
+                return;
+            }
             
             if (data.error) {
                 console.error('加载照片API错误:', data.error);
                 showToast('加载照片失败：' + data.error);
-                elements.gallery.innerHTML = '';
-                elements.gallery.appendChild(elements.emptyState);
-                
-                // 隐藏子目录容器
-                if (elements.subdirectoriesContainer) {
-                    elements.subdirectoriesContainer.classList.add('hidden');
+                if (!cursor) {
+                    elements.gallery.innerHTML = '';
+                    elements.gallery.appendChild(elements.emptyState);
+                    
+                    // 隐藏子目录容器
+                    if (elements.subdirectoriesContainer) {
+                        elements.subdirectoriesContainer.classList.add('hidden');
+                    }
                 }
-                
                 return;
             }
             
-            state.photos = data.photos || [];
-            console.log('获取到的照片数量:', state.photos.length);
+            const photos = data.photos || [];
+            console.log('获取到的照片数量:', photos.length);
             
-            // 处理并渲染子目录
-            if (data.subdirectories && Array.isArray(data.subdirectories)) {
-                console.log('获取到的子目录数量:', data.subdirectories.length);
-                renderSubdirectories(data.subdirectories);
-            } else {
-                console.log('没有子目录或子目录格式错误');
-                // 如果没有子目录或子目录格式错误，隐藏子目录容器
-                if (elements.subdirectoriesContainer) {
+            if (!cursor) {
+                // 第一页：处理子目录并重新渲染画廊
+                if (data.subdirectories && Array.isArray(data.subdirectories)) {
+                    console.log('获取到的子目录数量:', data.subdirectories.length);
+                    renderSubdirectories(data.subdirectories);
+                } else if (elements.subdirectoriesContainer) {
+                    // 如果没有子目录或子目录格式错误，隐藏子目录容器
                     elements.subdirectoriesContainer.classList.add('hidden');
                 }
+                
+                state.photos = photos;
+                renderPhotos();
+            } else {
+                appendPhotos(photos);
             }
             
-            sortPhotos();
-            console.log('准备渲染照片');
-            renderPhotos();
-            elements.photosCount.textContent = `${state.photos.length} 张照片`;
+            const total = Number.isNaN(totalCount) ? state.photos.length : totalCount;
+            elements.photosCount.textContent = `${total} 张照片`;
+            
+            // 继续加载下一页
+            if (data.next_cursor) {
+                loadPhotoPage(directory, data.next_cursor, loadToken);
+            }
         })
         .catch(error => {
             console.error('加载照片失败:', error);
             console.error('错误堆栈:', error.stack);
             showToast('加载照片失败，请重试');
-            elements.gallery.innerHTML = '';
-            elements.gallery.appendChild(elements.emptyState);
-            
-            // 隐藏子目录容器
-            if (elements.subdirectoriesContainer) {
-                elements.subdirectoriesContainer.classList.add('hidden');
+            if (!cursor) {
+                elements.gallery.innerHTML = '';
+                elements.gallery.appendChild(elements.emptyState);
+                
+                // 隐藏子目录容器
+                if (elements.subdirectoriesContainer) {
+                    elements.subdirectoriesContainer.classList.add('hidden');
+                }
             }
         });
-}
\ No newline at end of file
+}
@@ -1,5 +1,163 @@
 // 大图查看器相关功能
 
+// 浏览用大图URL（照片列表返回带版本号的URL，内容不变时浏览器直接使用缓存）
+// 按屏幕实际像素请求对应尺寸（服务器对应到尺寸阶梯中的一级，4K屏幕不再放大1024像素的图片）
+function getViewerImageUrl(photo) {
+    const url = photo.viewer_image || `/api/viewer_image/${encodeURIComponent(photo.path)}`;
+    const width = Math.ceil(Math.max(window.innerWidth, window.innerHeight) * (window.devicePixelRatio || 1));
+    return `${url}${url.includes('?') ? '&' : '?'}w=${width}`;
+}
+
+// 原图URL
+function getOriginalPhotoUrl(photo) {
+    return photo.url || `/api/photo/${encodeURIComponent(photo.path)}`;
+}
+
+// 查看原图：超大图片（照片信息带有deep_zoom）不下载整张原图，
+// 以浏览用大图为底图，放大时按当前缩放级别只加载视口内的瓦片
+function loadOriginalImage(imageElement, photo) {
+    removeDeepZoomLayer();
+    if (photo.deep_zoom) {
+        imageElement.src = getViewerImageUrl(photo);
+        attachDeepZoomLayer(imageElement, photo);
+    } else {
+        imageElement.src = getOriginalPhotoUrl(photo);
+    }
+}
+
+// 创建瓦片层（覆盖在图片上，与图片使用相同的变换）
+function attachDeepZoomLayer(imageElement, photo) {
+    const [descriptorPath, query] = photo.deep_zoom.split('?');
+    const deepZoom = {
+        photo,
+        imageElement,
+        baseUrl: descriptorPath.replace(/\.dzi$/, ''),
+        query: query ? `?${query}` : '',
+        layer: document.createElement('div'),
+        tiles: new Map(),
+        level: -1
+    };
+    deepZoom.layer.className = 'deep-zoom-layer';
+    deepZoom.layer.style.cssText = 'position:absolute;pointer-events:none;overflow:hidden;';
+    window.state.deepZoom = deepZoom;
+    
+    fetch(photo.deep_zoom)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`获取瓦片描述失败: ${response.status}`);
+            }
+            return response.text();
+        })
+        .then(text => {
+            // 加载期间已切换照片或关闭原图
+            if (window.state.deepZoom !== deepZoom) return;
+            const descriptor = new DOMParser().parseFromString(text, 'application/xml');
+            const image = descriptor.getElementsByTagName('Image')[0];
+            const size = descriptor.getElementsByTagName('Size')[0];
+            deepZoom.tileSize = parseInt(image.getAttribute('TileSize'), 10);
+            deepZoom.format = image.getAttribute('Format');
+            deepZoom.width = parseInt(size.getAttribute('Width'), 10);
+            deepZoom.height = parseInt(size.getAttribute('Height'), 10);
+            deepZoom.maxLevel = Math.ceil(Math.log2(Math.max(deepZoom.width, deepZoom.height)));
+            
+            const parent = imageElement.parentElement;
+            if (getComputedStyle(parent).position === 'static') {
+                parent.style.position = 'relative';
+            }
+            parent.appendChild(deepZoom.layer);
+            if (imageElement.complete) {
+                updateDeepZoomLayer();
+            } else {
+                imageElement.addEventListener('load', updateDeepZoomLayer, { once: true });
+            }
+        })
+        .catch(error => {
+            // 瓦片不可用时退回下载整张原图
+            console.error(error);
+            if (window.state.deepZoom === deepZoom) {
+                removeDeepZoomLayer();
+                imageElement.src = getOriginalPhotoUrl(photo);
+            }
+        });
+}
+
+// 移除瓦片层
+function removeDeepZoomLayer() {
+    const deepZoom = window.state.deepZoom;
+    if (deepZoom) {
+        deepZoom.layer.remove();
+        window.state.deepZoom = null;
+    }
+}
+
+// 按图片当前的显示大小和位置，加载视口内所需层级的瓦片
+function updateDeepZoomLayer() {
+    const deepZoom = window.state.deepZoom;
+    if (!deepZoom || !deepZoom.width) return;
+    const imageElement = deepZoom.imageElement;
+    const layer = deepZoom.layer;
+    
+    // 瓦片层与图片占据相同的位置并使用相同的变换
+    layer.style.left = `${imageElement.offsetLeft}px`;
+    layer.style.top = `${imageElement.offsetTop}px`;
+    layer.style.width = `${imageElement.offsetWidth}px`;
+    layer.style.height = `${imageElement.offsetHeight}px`;
+    layer.style.transform = imageElement.style.transform;
+    layer.style.transformOrigin = imageElement.style.transformOrigin || 'center center';
+    
+    // 选择不低于屏幕实际像素的最小层级；浏览用大图已足够清晰时不加载瓦片
+    const rect = imageElement.getBoundingClientRect();
+    const displayWidth = rect.width * (window.devicePixelRatio || 1);
+    if (!rect.width || displayWidth <= imageElement.naturalWidth) {
+        layer.replaceChildren();
+        deepZoom.tiles.clear();
+        deepZoom.level = -1;
+        return;
+    }
+    const level = Math.min(deepZoom.maxLevel,
+        Math.max(0, deepZoom.maxLevel - Math.floor(Math.log2(deepZoom.width / displayWidth))));
+    const scale = Math.pow(2, deepZoom.maxLevel - level);
+    const levelWidth = Math.ceil(deepZoom.width / scale);
+    const levelHeight = Math.ceil(deepZoom.height / scale);
+    const tileSize = deepZoom.tileSize;
+    
+    // 切换层级时移除旧层级的瓦片（底图仍在下面显示）
+    if (level !== deepZoom.level) {
+        layer.replaceChildren();
+        deepZoom.tiles.clear();
+        deepZoom.level = level;
+    }
+    
+    // 图片在视口内的可见部分（占图片宽高的比例）
+    const left = (Math.max(rect.left, 0) - rect.left) / rect.width;
+    const right = (Math.min(rect.right, window.innerWidth) - rect.left) / rect.width;
+    const top = (Math.max(rect.top, 0) - rect.top) / rect.height;
+    const bottom = (Math.min(rect.bottom, window.innerHeight) - rect.top) / rect.height;
+    if (right <= left || bottom <= top) return;
+    
+    const firstCol = Math.floor(left * levelWidth / tileSize);
+    const lastCol = Math.min(Math.ceil(levelWidth / tileSize), Math.ceil(right * levelWidth / tileSize)) - 1;
+    const firstRow = Math.floor(top * levelHeight / tileSize);
+    const lastRow = Math.min(Math.ceil(levelHeight / tileSize), Math.ceil(bottom * levelHeight / tileSize)) - 1;
+    for (let col = firstCol; col <= lastCol; col++) {
+        for (let row = firstRow; row <= lastRow; row++) {
+            const key = `${col}_${row}`;
+            if (deepZoom.tiles.has(key)) continue;
+            const tile = document.createElement('img');
+            tile.style.cssText = [
+                'position:absolute',
+                `left:${col * tileSize / levelWidth * 100}%`,
+                `top:${row * tileSize / levelHeight * 100}%`,
+                `width:${Math.min(tileSize, levelWidth - col * tileSize) / levelWidth * 100}%`,
+                `height:${Math.min(tileSize, levelHeight - row * tileSize) / levelHeight * 100}%`
+            ].join(';');
+            tile.src = `${deepZoom.baseUrl}_files/${level}/${key}.${deepZoom.format}${deepZoom.query}`;
+            deepZoom.tiles.set(key, tile);
+            layer.appendChild(tile);
+        }
+    }
+}
+
 // 渲染星级评分
 function renderRating(element, rating) {
     element.innerHTML = '';
@@ -23,7 +181,7 @@ function renderRating(element, rating) {
 function updatePhotoRating(photoPath, rating) {
     showImageLoadingIndicator('更新星级中...');
     
-    fetch(`/photo_rating`, {
+    fetch('/api/photo_rating', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -40,6 +198,12 @@ function updatePhotoRating(photoPath, rating) {
             renderRating(window.elements.metaRating, rating);
             renderRating(window.elements.mobileMetaRating, rating);
             
+            // 更新缓存的元数据中的星级
+            const cachedMetadata = metadataCache.get(photoPath);
+            if (cachedMetadata) {
+                cachedMetadata.custom = { ...cachedMetadata.custom, star_rating: rating };
+            }
+            
             // 更新当前照片对象的星级信息
             const currentPhoto = window.state.currentPhoto;
             if (currentPhoto && currentPhoto.metadata) {
@@ -60,44 +224,144 @@ function updatePhotoRating(photoPath, rating) {
     });
 }
 
-// 获取并显示照片元数据
+// 照片元数据缓存（路径 -> 服务器返回的元数据），打开查看器和切换照片时批量预取前后几张
+const METADATA_CACHE_SIZE = 200;
+const METADATA_PREFETCH_COUNT = 2;
+const metadataCache = new Map();
+// 正在请求中的元数据（路径 -> Promise），避免重复请求
+const pendingMetadata = new Map();
+
+function cacheMetadata(path, metadata) {
+    metadataCache.delete(path);
+    metadataCache.set(path, metadata);
+    if (metadataCache.size > METADATA_CACHE_SIZE) {
+        metadataCache.delete(metadataCache.keys().next().value);
+    }
+}
+
+// 一次请求获取多张照片的元数据（已缓存或正在请求的不再重复请求）
+function fetchMetadataBatch(paths) {
+    const missing = paths.filter(path => !metadataCache.has(path) && !pendingMetadata.has(path));
+    if (missing.length > 0) {
+        const request = fetch('/api/photo_metadata_batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ paths: missing })
+        })
+            .then(response => response.json())
+            .then(data => {
+                const results = data.metadata || {};
+                missing.forEach(path => {
+                    if (results[path] && !results[path].error) {
+                        cacheMetadata(path, results[path]);
+                    }
+                });
+            })
+            .catch(error => {
+                console.error('批量加载元数据失败:', error);
+            })
+            .finally(() => {
+                missing.forEach(path => pendingMetadata.delete(path));
+            });
+        missing.forEach(path => pendingMetadata.set(path, request));
+    }
+    return Promise.all(paths.map(path => pendingMetadata.get(path))).then(() => paths.map(path => metadataCache.get(path)));
+}
+
+// 当前照片及前后几张照片的路径
+function getNeighbourPhotoPaths(photoPath) {
+    const photos = window.state.photos || [];
+    const index = photos.findIndex(photo => photo.path === photoPath);
+    const paths = [photoPath];
+    if (index < 0) return paths;
+    for (let i = 1; i <= METADATA_PREFETCH_COUNT; i++) {
+        [index + i, index - i].forEach(neighbourIndex => {
+            if (neighbourIndex >= 0 && neighbourIndex < photos.length) {
+                paths.push(photos[neighbourIndex].path);
+            }
+        });
+    }
+    return paths;
+}
+
+// 将服务器返回的元数据转换为面板显示的字段
+function getDisplayMetadata(metadata) {
+    const basic = metadata.basic || {};
+    const image = (metadata.exif && metadata.exif.image) || {};
+    const exif = (metadata.exif && metadata.exif.exif) || {};
+    // EXIF中的分数以 [分子, 分母] 表示
+    const toNumber = value => Array.isArray(value) ? (value[1] ? value[0] / value[1] : null) : value;
+    const fNumber = toNumber(exif.FNumber);
+    const exposure = exif.ExposureTime;
+    const focalLength = toNumber(exif.FocalLength);
+    return {
+        name: basic.name,
+        modified: basic.modified,
+        size: basic.size,
+        rating: (metadata.custom && metadata.custom.star_rating) || 0,
+        date: exif.DateTimeOriginal || image.DateTime,
+        camera: [image.Make, image.Model].filter(Boolean).join(' ').trim(),
+        aperture: fNumber ? `f/${Math.round(fNumber * 10) / 10}` : null,
+        exposure: Array.isArray(exposure) && exposure[1]
+            ? (exposure[0] < exposure[1] ? `1/${Math.round(exposure[1] / exposure[0])}s` : `${exposure[0] / exposure[1]}s`)
+            : null,
+        iso: exif.ISOSpeedRatings,
+        focal: focalLength ? `${Math.round(focalLength)}mm` : null
+    };
+}
+
+// 显示照片元数据
+function displayMetadata(metadata) {
+    const info = getDisplayMetadata(metadata);
+    
+    // 更新桌面端元数据
+    window.elements.metaName.textContent = info.name;
+    
+    // 显示拍摄日期或修改日期
+    window.elements.metaDate.textContent = info.date || info.modified || '未知';
+    
+    // 拍摄参数
+    window.elements.metaCamera.textContent = info.camera || '未知';
+    window.elements.metaAperture.textContent = info.aperture || '未知';
+    window.elements.metaExposure.textContent = info.exposure || '未知';
+    window.elements.metaIso.textContent = info.iso || '未知';
+    window.elements.metaFocal.textContent = info.focal || '未知';
+    
+    // 文件信息
+    window.elements.metaModified.textContent = info.modified || '未知';
+    window.elements.metaSize.textContent = formatFileSize(info.size);
+    
+    // 渲染星级
+    renderRating(window.elements.metaRating, info.rating);
+    
+    // 更新移动端元数据
+    window.elements.mobileMetaName.textContent = info.name;
+    window.elements.mobileMetaDate.textContent = info.date || info.modified || '未知';
+    window.elements.mobileMetaCamera.textContent = info.camera || '未知';
+    window.elements.mobileMetaAperture.textContent = info.aperture || '未知';
+    window.elements.mobileMetaExposure.textContent = info.exposure || '未知';
+    window.elements.mobileMetaIso.textContent = info.iso || '未知';
+    window.elements.mobileMetaFocal.textContent = info.focal || '未知';
+    
+    // 渲染移动端星级
+    renderRating(window.elements.mobileMetaRating, info.rating);
+}
+
+// 获取并显示照片元数据（同时预取前后几张照片的元数据，切换照片时直接使用缓存）
 function loadAndDisplayMetadata(photoPath) {
-    fetch(`/photo_metadata/${encodeURIComponent(photoPath)}`)
-        .then(response => response.json())
-        .then(metadata => {
-            // 更新桌面端元数据
-            window.elements.metaName.textContent = metadata.name;
-            
-            // 显示拍摄日期或修改日期
-            const exif = metadata.exif || {};
-            window.elements.metaDate.textContent = exif['拍摄日期'] || metadata.modified || '未知';
-            
-            // 拍摄参数
-            const camera = [exif['相机厂商'], exif['相机型号']].filter(Boolean).join(' ');
-            window.elements.metaCamera.textContent = camera || '未知';
-            window.elements.metaAperture.textContent = exif['光圈'] || '未知';
-            window.elements.metaExposure.textContent = exif['曝光时间'] || '未知';
-            window.elements.metaIso.textContent = exif['ISO'] || '未知';
-            window.elements.metaFocal.textContent = exif['焦距'] || '未知';
-            
-            // 文件信息
-            window.elements.metaModified.textContent = metadata.modified || '未知';
-            window.elements.metaSize.textContent = formatFileSize(metadata.size);
-            
-            // 渲染星级
-            renderRating(window.elements.metaRating, metadata['星级'] || 0);
-            
-            // 更新移动端元数据
-            window.elements.mobileMetaName.textContent = metadata.name;
-            window.elements.mobileMetaDate.textContent = exif['拍摄日期'] || metadata.modified || '未知';
-            window.elements.mobileMetaCamera.textContent = camera || '未知';
-            window.elements.mobileMetaAperture.textContent = exif['光圈'] || '未知';
-            window.elements.mobileMetaExposure.textContent = exif['曝光时间'] || '未知';
-            window.elements.mobileMetaIso.textContent = exif['ISO'] || '未知';
-            window.elements.mobileMetaFocal.textContent = exif['焦距'] || '未知';
-            
-            // 渲染移动端星级
-            renderRating(window.elements.mobileMetaRating, metadata['星级'] || 0);
+    const cached = metadataCache.get(photoPath);
+    if (cached) {
+        displayMetadata(cached);
+    }
+    fetchMetadataBatch(getNeighbourPhotoPaths(photoPath))
+        .then(([metadata]) => {
+            // 请求返回时可能已经切换到其他照片
+            const currentPhoto = window.state.currentPhoto;
+            if (!cached && metadata && currentPhoto && currentPhoto.path === photoPath) {
+                displayMetadata(metadata);
+            }
         })
         .catch(error => {
             console.error('加载元数据失败:', error);
@@ -193,13 +457,11 @@ function toggleOriginalImage() {
             }
         };
         
-        // 添加随机参数防止缓存问题
-        const timestamp = new Date().getTime();
-        
         if (window.state.isOriginalImage) {
-            imageElement.src = `/photo/${encodeURIComponent(currentPhoto.path)}?t=${timestamp}`;
+            loadOriginalImage(imageElement, currentPhoto);
         } else {
-            imageElement.src = `/viewer_image/${encodeURIComponent(currentPhoto.path)}?t=${timestamp}`;
+            removeDeepZoomLayer();
+            imageElement.src = getViewerImageUrl(currentPhoto);
             // 在浏览图模式下重置缩放
             imageElement.style.transform = 'scale(1)';
             window.state.scale = 1;
@@ -248,14 +510,11 @@ function showPreviousPhoto() {
         window.state.scale = 1;
         imageElement.style.transform = 'scale(1)';
         
-        // 添加随机参数防止缓存问题
-        const timestamp = new Date().getTime();
-        
         // 更新图片
         if (window.state.isOriginalImage) {
-            imageElement.src = `/photo/${encodeURIComponent(currentPhoto.path)}?t=${timestamp}`;
+            loadOriginalImage(imageElement, currentPhoto);
         } else {
-            imageElement.src = `/viewer_image/${encodeURIComponent(currentPhoto.path)}?t=${timestamp}`;
+            imageElement.src = getViewerImageUrl(currentPhoto);
         }
         
         // 更新标题（如果存在）
@@ -312,14 +571,11 @@ function showNextPhoto() {
         // 显示加载指示器
         showImageLoadingIndicator('加载下一张照片...');
         
-        // 添加随机参数防止缓存问题
-        const timestamp = new Date().getTime();
-        
         // 更新图片
         if (window.state.isOriginalImage) {
-            imageElement.src = `/api/photo/${encodeURIComponent(currentPhoto.path)}?t=${timestamp}`;
+            loadOriginalImage(imageElement, currentPhoto);
         } else {
-            imageElement.src = `/api/viewer_image/${encodeURIComponent(currentPhoto.path)}?t=${timestamp}`;
+            imageElement.src = getViewerImageUrl(currentPhoto);
         }
         
         // 更新标题（如果存在）
@@ -360,6 +616,7 @@ function openLightbox(index) {
     // 清空内容容器
     const contentContainer = document.getElementById('lightbox-content');
     if (!contentContainer) return;
+    removeDeepZoomLayer();
     contentContainer.innerHTML = '';
     
     // 获取当前照片
@@ -373,7 +630,7 @@ function openLightbox(index) {
     const photoDisplay = document.createElement('div');
     photoDisplay.className = 'flex flex-col items-center justify-center';
     photoDisplay.innerHTML = `
-        <img src="/api/viewer_image/${encodeURIComponent(currentPhoto.path)}" alt="${currentPhoto.name}" class="max-w-full max-h-[95vh] object-contain shadow-2xl rounded-lg">
+        <img src="${getViewerImageUrl(currentPhoto)}" alt="${currentPhoto.name}" class="max-w-full max-h-[95vh] object-contain shadow-2xl rounded-lg">
     `;
     contentContainer.appendChild(photoDisplay);
     
@@ -719,6 +976,8 @@ function setupImageDragging(imageElement) {
 // 更新图片变换
 function updateImageTransform(imageElement) {
     imageElement.style.transform = `translate(${window.state.position.x}px, ${window.state.position.y}px) scale(${window.state.scale})`;
+    // 瓦片层跟随图片变换，并加载新进入视口的瓦片
+    updateDeepZoomLayer();
 }
 
 // 添加点击左右区域切换功能
@@ -780,6 +1039,7 @@ function addTouchAreaNavigation() {
 // 关闭大图查看器
 function closeLightbox() {
     window.elements.lightbox.classList.remove('opacity-100');
+    removeDeepZoomLayer();
     
     const content = document.getElementById('lightbox-content');
     content.classList.remove('opacity-100', 'translate-x-0');
@@ -857,7 +1117,7 @@ function downloadCurrentPhoto() {
     if (window.state.photos.length === 0 || window.state.currentPhotoIndex === -1) return;
     
     const photo = window.state.photos[window.state.currentPhotoIndex];
-    const downloadUrl = `/api/photo/${encodeURIComponent(photo.path)}`;
+    const downloadUrl = getOriginalPhotoUrl(photo);
     
     // 创建一个临时的下载链接
     const a = document.createElement('a');
@@ -35,15 +35,17 @@ function initImageLazyLoading() {
 }
 
 // 批量图片请求优化 - 实现图片请求合并功能
+// 每张缩略图单独请求带版本号的URL，浏览器可以按 immutable 长期缓存，再次浏览时无需请求服务器
 const BatchImageLoader = {
     batchSize: 10, // 每批次请求的图片数量
     delay: 50, // 批次间的延迟（毫秒）
     queue: [],
     processing: false,
+    errorImageSrc: 'data:image/svg+xml;charset=UTF-8,%3Csvg%20width%3D%22100%25%22%20height%3D%22100%25%22%20xmlns%3D%22http%3A%2F%2Fwww.w3.org%2F2000%2Fsvg%22%3E%3Crect%20width%3D%22100%25%22%20height%3D%22100%25%22%20fill%3D%22%23f0f0f0%22%2F%3E%3Ctext%20x%3D%2250%25%22%20y%3D%2250%25%22%20text-anchor%3D%22middle%22%20dominant-baseline%3D%22middle%22%20font-family%3D%22Arial%22%20font-size%3D%2224%22%20fill%3D%22%23999%22%3E%E2%98%BC%3C%2Ftext%3E%3C%2Fsvg%3E',
     
-    // 添加图片到队列
-    add(imagePath, callback) {
-        this.queue.push({ path: imagePath, callback });
+    // 添加图片到队列（url 为照片列表返回的带版本号的缩略图地址，没有时使用不带版本号的地址）
+    add(imagePath, callback, url) {
+        this.queue.push({ path: imagePath, callback, url });
         if (!this.processing) {
             this.processNextBatch();
         }
@@ -60,40 +62,29 @@ const BatchImageLoader = {
         
         // 获取当前批次的图片
         const batch = this.queue.splice(0, this.batchSize);
-        const batchPromises = [];
         
         // 并行请求当前批次的图片
-        batch.forEach((item, index) => {
+        const batchPromises = batch.map((item, index) => new Promise((resolve) => {
             // 添加小延迟以避免请求过于集中
-            const promise = new Promise((resolve) => {
-                setTimeout(() => {
-                    const img = new Image();
-                    img.onload = () => {
-                        resolve({ success: true, path: item.path, img, index });
-                    };
-                    img.onerror = () => {
-                        resolve({ success: false, path: item.path, index });
-                    };
-                    img.src = `/api/thumbnail/${encodeURIComponent(item.path)}`;
-                }, this.delay * index);
-            });
-            batchPromises.push(promise);
-        });
+            setTimeout(() => {
+                const img = new Image();
+                img.onload = () => {
+                    item.callback(img);
+                    resolve();
+                };
+                img.onerror = () => {
+                    // 处理加载失败的情况
+                    img.onerror = null;
+                    img.src = this.errorImageSrc;
+                    item.callback(img);
+                    resolve();
+                };
+                img.src = item.url || `/api/thumbnail/${encodeURIComponent(item.path)}`;
+            }, this.delay * index);
+        }));
         
         // 处理当前批次的所有请求完成后的回调
-        Promise.all(batchPromises).then(results => {
-            results.forEach(result => {
-                const item = batch[result.index];
-                if (result.success) {
-                    item.callback(result.img);
-                } else {
-                    // 处理加载失败的情况
-                    const errorImg = new Image();
-                    errorImg.src = 'data:image/svg+xml;charset=UTF-8,%3Csvg%20width%3D%22100%25%22%20height%3D%22100%25%22%20xmlns%3D%22http%3A%2F%2Fwww.w3.org%2F2000%2Fsvg%22%3E%3Crect%20width%3D%22100%25%22%20height%3D%22100%25%22%20fill%3D%22%23f0f0f0%22%2F%3E%3Ctext%20x%3D%2250%25%22%20y%3D%2250%25%22%20text-anchor%3D%22middle%22%20dominant-baseline%3D%22middle%22%20font-family%3D%22Arial%22%20font-size%3D%2224%22%20fill%3D%22%23999%22%3E%E2%98%BC%3C%2Ftext%3E%3C%2Fsvg%3E';
-                    item.callback(errorImg);
-                }
-            });
-            
+        Promise.all(batchPromises).then(() => {
             // 处理下一批
             setTimeout(() => {
                 this.processNextBatch();
@@ -114,7 +105,7 @@ function preloadNearbyImages(currentIndex, photoCount) {
     for (let i = 1; i <= preloadCount; i++) {
         const nextIndex = (currentIndex + i) % photoCount;
         if (nextIndex >= 0 && nextIndex < state.photos.length) {
-            preloadQueue.push(state.photos[nextIndex].path);
+            preloadQueue.push(state.photos[nextIndex]);
         }
     }
     
@@ -122,19 +113,21 @@ function preloadNearbyImages(currentIndex, photoCount) {
     for (let i = 1; i <= preloadCount; i++) {
         const prevIndex = (currentIndex - i + photoCount) % photoCount;
         if (prevIndex >= 0 && prevIndex < state.photos.length) {
-            preloadQueue.push(state.photos[prevIndex].path);
+            preloadQueue.push(state.photos[prevIndex]);
         }
     }
     
     // 执行预加载
-    preloadQueue.forEach(path => {
-        // 创建预加载图片对象
+    preloadQueue.forEach(photo => {
+        // 创建预加载图片对象（使用带版本号的URL，与画廊和查看器共用浏览器缓存）
         const preloadImg = new Image();
-        preloadImg.src = `/api/thumbnail/${encodeURIComponent(path)}`;
+        preloadImg.src = photo.thumbnail || `/api/thumbnail/${encodeURIComponent(photo.path)}`;
         
         // 同时预加载查看器图片
         const viewerImg = new Image();
-        viewerImg.src = `/api/viewer_image/${encodeURIComponent(path)}`;
+        viewerImg.src = typeof getViewerImageUrl === 'function'
+            ? getViewerImageUrl(photo)
+            : (photo.viewer_image || `/api/viewer_image/${encodeURIComponent(photo.path)}`);
     });
 }
 
@@ -0,0 +1,86 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+from PIL import Image
+from data import photo_catalog
+from data.config_manager import config, photo_ratings
+from routes.metadata_routes import metadata_bp
+from utils.catalog_scanner import scan_directory
+
+def get_catalog_ratings(directory):
+    return {row['path']: row['rating'] for row in photo_catalog.query_photos(directory)}
+
+def test_bulk_rating(isolated_root):
+    print("===== 开始测试 批量评分接口 =====")
+    test_root = str(isolated_root)
+    photos = os.path.join(test_root, "photos")
+    outside = os.path.join(test_root, "outside")
+    os.makedirs(photos)
+    os.makedirs(outside)
+    paths = [os.path.join(photos, f"{i}.jpg") for i in range(3)]
+    for path in paths + [os.path.join(outside, "x.jpg")]:
+        Image.new('RGB', (8, 8), 'red').save(path, 'JPEG')
+    with open(os.path.join(photos, "notes.txt"), 'w') as f:
+        f.write("not a photo")
+    config["photo_directories"] = [photos]
+    # 只检查评分保存，不写回文件
+    config["rating_writeback_mode"] = "none"
+    scan_directory(photos)
+
+    app = Flask(__name__)
+    app.register_blueprint(metadata_bp, url_prefix='/api')
+    client = app.test_client()
+
+    def post(entries):
+        return client.post('/api/photo_ratings', json={"ratings": entries})
+
+    # 测试1：一次请求更新多张照片，评分数据库和目录库都已保存；同一文件出现多次时以最后一次为准
+    response = post([{"file_path": paths[0], "rating": 3}, {"file_path": paths[1], "rating": 5},
+                     {"file_path": paths[0], "rating": 4}])
+    assert response.status_code == 200 and response.get_json()["updated"] == 2
+    assert photo_ratings.get(paths[0]) == 4 and photo_ratings.get(paths[1]) == 5
+    catalog_ratings = get_catalog_ratings(photos)
+    assert catalog_ratings[paths[0]] == 4 and catalog_ratings[paths[1]] == 5
+    print("测试1: 通过")
+
+    before = (photo_ratings.copy(), get_catalog_ratings(photos))
+
+    # 测试2：任何一项评分无效时整批都不更新，并列出无效的项
+    for bad_rating in (6, -1, "3", True, None, 2.5):
+        response = post([{"file_path": paths[2], "rating": 1}, {"file_path": paths[0], "rating": bad_rating}])
+        assert response.status_code == 400, bad_rating
+        assert [item["file_path"] for item in response.get_json()["invalid"]] == [paths[0]]
+    assert (photo_ratings.copy(), get_catalog_ratings(photos)) == before
+    print("测试2: 通过")
+
+    # 测试3：任何一个文件访问受限、不存在或不是支持的图片格式时整批都不更新
+    for bad_path in (os.path.join(outside, "x.jpg"), os.path.join(photos, "missing.jpg"),
+                     os.path.join(photos, "notes.txt")):
+        response = post([{"file_path": paths[2], "rating": 1}, {"file_path": bad_path, "rating": 2}])
+        assert response.status_code == 403, bad_path
+        assert [item["file_path"] for item in response.get_json()["invalid"]] == [bad_path]
+    assert (photo_ratings.copy(), get_catalog_ratings(photos)) == before
+    print("测试3: 通过")
+
+    # 测试4：缺少参数或格式错误时返回400
+    for body in ({}, {"ratings": []}, {"ratings": "x"}, {"ratings": [{"rating": 3}]}, {"ratings": ["x"]}):
+        assert client.post('/api/photo_ratings', json=body).status_code == 400, body
+    # 文件路径不是字符串时同样整批不更新，列出无效的项
+    for bad_path in (5, ["x"], {"a": 1}):
+        response = post([{"file_path": paths[2], "rating": 1}, {"file_path": bad_path, "rating": 2}])
+        assert response.status_code == 400, bad_path
+        assert [item["file_path"] for item in response.get_json()["invalid"]] == [bad_path]
+    assert (photo_ratings.copy(), get_catalog_ratings(photos)) == before
+    print("测试4: 通过")
+
+    # 测试5：0分清除评分
+    assert post([{"file_path": paths[1], "rating": 0}]).status_code == 200
+    assert paths[1] not in photo_ratings and get_catalog_ratings(photos)[paths[1]] == 0
+    print("测试5: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", "-s", __file__]))
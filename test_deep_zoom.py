@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+
+import pytest
+from flask import Flask
+from PIL import Image
+from werkzeug.exceptions import HTTPException
+from data.config_manager import config
+from routes.photo_routes import photo_bp, get_deep_zoom_tile
+from utils.catalog_scanner import scan_directory
+from utils.deep_zoom import get_max_level, get_level_size, get_tile_path, TILE_SIZE
+from utils.file_utils import apply_image_pixel_limit, get_deep_zoom_paths
+
+def call_tile(app, file_path, level, col, row):
+    """直接调用瓦片视图函数，返回 (状态码, 内容)"""
+    with app.test_request_context('/'):
+        try:
+            response = app.make_response(get_deep_zoom_tile(file_path, level, col, row))
+        except HTTPException as e:
+            response = e.get_response()
+        response.direct_passthrough = False
+        return response.status_code, response.get_data()
+
+def level_exists(photo, level):
+    _, tiles_dir = get_deep_zoom_paths(photo, create_dir=False)
+    return os.path.isdir(os.path.join(tiles_dir, str(level)))
+
+def test_deep_zoom(isolated_root, monkeypatch):
+    print("===== 开始测试 超大图片的瓦片按层级生成 =====")
+    test_root = str(isolated_root)
+    photos = os.path.join(test_root, "photos")
+    os.makedirs(photos)
+    photo = os.path.join(photos, "pano.jpg")
+    width, height = 1200, 800
+    Image.new('RGB', (width, height), 'red').save(photo, 'JPEG')
+    config["photo_directories"] = [photos]
+    config["deep_zoom_min_pixels"] = 100 * 1000
+    app = Flask(__name__, root_path=test_root)
+    app.register_blueprint(photo_bp, url_prefix='/api')
+    max_level = get_max_level(width, height)
+
+    # 测试1：按比例缩小Pillow的默认阈值，照片超过阈值的两倍时Pillow拒绝打开
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 200 * 1000)
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(photo)
+    print("测试1: 通过")
+
+    # 测试2：按配置的上限放宽阈值后，扫描能读取尺寸，瓦片正常生成
+    config["max_image_pixels"] = 2 * 1000 * 1000
+    apply_image_pixel_limit()
+    scan_directory(photos)
+    status, data = call_tile(app, photo, 3, 0, 0)
+    assert status == 200
+    with Image.open(io.BytesIO(data)) as tile:
+        assert tile.size == get_level_size(width, height, 3)
+    print("测试2: 通过")
+
+    # 测试3：只生成请求的层级和缺少的更低层级，放大查看到更高的层级时才生成
+    assert all(level_exists(photo, level) for level in range(4))
+    assert not any(level_exists(photo, level) for level in range(4, max_level + 1))
+    status, data = call_tile(app, photo, max_level, 1, 1)
+    assert status == 200
+    with Image.open(io.BytesIO(data)) as tile:
+        assert tile.size == (TILE_SIZE, TILE_SIZE)
+    assert all(level_exists(photo, level) for level in range(max_level + 1))
+    print("测试3: 通过")
+
+    # 测试4：瓦片被缓存清理淘汰后重新生成所在层级
+    os.remove(get_tile_path(photo, max_level, 0, 0))
+    assert call_tile(app, photo, max_level, 0, 0)[0] == 200
+    assert os.path.exists(get_tile_path(photo, max_level, 0, 0))
+    print("测试4: 通过")
+
+    # 测试5：超过配置的上限时拒绝解码，返回错误而不是卡住请求
+    config["max_image_pixels"] = 500 * 1000
+    apply_image_pixel_limit()
+    os.remove(get_tile_path(photo, max_level - 1, 0, 0))
+    assert call_tile(app, photo, max_level - 1, 0, 0)[0] == 500
+    print("测试5: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", "-s", __file__]))
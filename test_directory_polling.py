@@ -0,0 +1,89 @@
+import os
+import sys
+import shutil
+import time
+
+import pytest
+from PIL import Image
+from data import photo_catalog
+from data.config_manager import config, cache_watch_state, is_cache_entry_fresh
+from utils import catalog_scanner, directory_watcher
+from utils.catalog_scanner import scan_directory
+from utils.directory_watcher import PollingWatcher
+
+def make_image(path):
+    Image.new('RGB', (8, 8), 'red').save(path, 'JPEG')
+
+def bump_mtime(path):
+    # 部分文件系统的修改时间精度较低，手动推后确保能比较出变化
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+def test_directory_polling(isolated_root, monkeypatch):
+    print("===== 开始测试 PollingWatcher 目录修改时间轮询 =====")
+    test_root = str(isolated_root)
+    photos = os.path.join(test_root, "photos")
+    os.makedirs(os.path.join(photos, "a"))
+    os.makedirs(os.path.join(photos, "b"))
+    make_image(os.path.join(photos, "a", "1.jpg"))
+    make_image(os.path.join(photos, "b", "2.jpg"))
+    config["photo_directories"] = [photos]
+    scan_directory(photos)
+    watcher = PollingWatcher(30)
+
+    # 记录完整遍历目录树的次数
+    walks = []
+    original_walk = catalog_scanner.walk_directory_tree
+    monkeypatch.setattr(catalog_scanner, "walk_directory_tree",
+                        lambda directory: (walks.append(directory), original_walk(directory))[1])
+
+    # 测试1：没有变化时不同步任何目录
+    assert watcher.poll_root(photos) == 0
+    print("测试1: 通过")
+
+    # 测试2：新增文件只同步所在目录，不遍历目录树
+    make_image(os.path.join(photos, "a", "3.jpg"))
+    bump_mtime(os.path.join(photos, "a"))
+    assert watcher.poll_root(photos) == 1
+    assert photo_catalog.get_photo_stat(os.path.join(photos, "a", "3.jpg")) is not None
+    assert walks == []
+    assert watcher.poll_root(photos) == 0
+    print("测试2: 通过")
+
+    # 测试3：新增子目录时只扫描新目录
+    os.makedirs(os.path.join(photos, "c"))
+    make_image(os.path.join(photos, "c", "4.jpg"))
+    bump_mtime(photos)
+    watcher.poll_root(photos)
+    assert walks == [os.path.join(photos, "c")]
+    assert photo_catalog.get_photo_stat(os.path.join(photos, "c", "4.jpg")) is not None
+    print("测试3: 通过")
+
+    # 测试4：删除文件和子目录
+    os.remove(os.path.join(photos, "a", "1.jpg"))
+    bump_mtime(os.path.join(photos, "a"))
+    shutil.rmtree(os.path.join(photos, "b"))
+    bump_mtime(photos)
+    watcher.poll_root(photos)
+    assert photo_catalog.get_photo_stat(os.path.join(photos, "a", "1.jpg")) is None
+    assert photo_catalog.get_photo_stat(os.path.join(photos, "b", "2.jpg")) is None
+    assert not photo_catalog.has_directory(os.path.join(photos, "b"))
+    assert watcher.poll_root(photos) == 0
+    print("测试4: 通过")
+
+    # 测试5：轮询发现不了原地修改的文件，照片列表缓存仍按过期时间失效，目录库按普通间隔完整扫描
+    monkeypatch.setattr(directory_watcher, "_load_libc", lambda: None)
+    monkeypatch.setattr(directory_watcher, "_watcher", None)
+    monkeypatch.setattr(PollingWatcher, "run", lambda self: None)
+    monkeypatch.setitem(cache_watch_state, "active", False)
+    config["watch_directories"] = True
+    assert directory_watcher.start_directory_watcher().name == 'polling'
+    assert not cache_watch_state["active"]
+    assert not is_cache_entry_fresh({"timestamp": time.time() - config["cache_expiry"] - 1}, time.time())
+    assert catalog_scanner._get_rescan_interval() == config["catalog_rescan_interval"]
+    print("测试5: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", "-s", __file__]))
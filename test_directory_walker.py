@@ -0,0 +1,80 @@
+import os
+import sys
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径，以便导入模块
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.file_utils import walk_directory_tree, get_all_images_recursive, get_all_subdirectories
+
+# 创建测试目录结构
+def create_test_tree():
+    """创建测试目录结构：
+    - 测试根目录
+      - a.jpg
+      - notes.txt（非图片文件）
+      - sub: 包含图片的子目录
+        - b.png
+        - deep: 多层子目录
+          - c.jpeg
+          - loop -> 测试根目录（符号链接循环）
+      - empty_dir: 空目录
+    """
+    test_root = tempfile.mkdtemp(prefix="photo_walker_test_")
+    deep_dir = os.path.join(test_root, "sub", "deep")
+    os.makedirs(deep_dir)
+    os.makedirs(os.path.join(test_root, "empty_dir"))
+    for file_path in [
+        os.path.join(test_root, "a.jpg"),
+        os.path.join(test_root, "notes.txt"),
+        os.path.join(test_root, "sub", "b.png"),
+        os.path.join(deep_dir, "c.jpeg"),
+    ]:
+        with open(file_path, "w") as f:
+            f.write("This is a test file.")
+    if hasattr(os, "symlink"):
+        try:
+            os.symlink(test_root, os.path.join(deep_dir, "loop"))
+        except OSError:
+            pass
+    return test_root
+
+def test_walk_directory_tree():
+    print("===== 开始测试 walk_directory_tree 函数 =====")
+    test_root = create_test_tree()
+    try:
+        tree = walk_directory_tree(test_root)
+
+        # 测试1：所有图片只出现一次，非图片文件被忽略，符号链接循环不会重复遍历
+        names = sorted(image['name'] for image in tree['images'])
+        print(f"测试1: 找到图片 {names}")
+        assert names == ["a.jpg", "b.png", "c.jpeg"], f"预期结果：3张图片，实际结果：{names}"
+
+        # 测试2：图片信息中包含大小和修改时间
+        for image in tree['images']:
+            assert image['size'] == os.path.getsize(image['path'])
+            assert image['mtime'] == os.path.getmtime(image['path'])
+
+        # 测试3：目录树包含根目录本身，且每个目录的标记正确
+        flags = {os.path.relpath(d['path'], test_root): (d['has_images'], d['has_subdirectories']) for d in tree['directories']}
+        print(f"测试3: 目录标记 {flags}")
+        assert flags["."] == (True, True)
+        assert flags[os.path.join("sub")] == (True, True)
+        assert flags[os.path.join("sub", "deep")][0] is True
+        assert flags["empty_dir"] == (False, False)
+
+        # 测试4：兼容的辅助函数返回相同结果
+        assert sorted(get_all_images_recursive(test_root)) == sorted(image['path'] for image in tree['images'])
+        assert len(get_all_subdirectories(test_root)) == len(tree['directories']) - 1
+
+        # 测试5：不存在的目录返回空结果
+        missing = walk_directory_tree(os.path.join(test_root, "missing"))
+        assert missing == {'images': [], 'directories': []}
+
+        print("===== 所有测试通过 =====")
+    finally:
+        shutil.rmtree(test_root)
+
+if __name__ == "__main__":
+    test_walk_directory_tree()
@@ -0,0 +1,136 @@
+import os
+import shutil
+import sys
+
+import pytest
+from flask import Flask
+from PIL import Image
+from werkzeug.exceptions import HTTPException
+from data.config_manager import config
+from routes.photo_routes import photo_bp, get_thumbnail, get_viewer_image, get_photo
+from utils.catalog_scanner import scan_directory
+from utils.http_cache import get_photo_version
+
+def make_app(root):
+    # 派生图片使用相对路径，send_file 按应用根目录解析
+    app = Flask(__name__, root_path=root)
+    app.register_blueprint(photo_bp, url_prefix='/api')
+    return app
+
+def call(app, view, file_path, headers=None, query_string=None):
+    """直接调用视图函数（URL中的绝对路径会被路由规则去掉开头的分隔符），返回 (状态码, 响应头, 内容)"""
+    with app.test_request_context('/', headers=headers or {}, query_string=query_string or {}):
+        try:
+            response = app.make_response(view(file_path))
+        except HTTPException as e:
+            response = e.get_response()
+        response.direct_passthrough = False
+        return response.status_code, response.headers, response.get_data()
+
+def test_http_cache(isolated_root):
+    print("===== 开始测试 图片接口的HTTP缓存校验 =====")
+    test_root = str(isolated_root)
+    app = make_app(test_root)
+    photos = os.path.join(test_root, "photos")
+    os.makedirs(photos)
+    photo = os.path.join(photos, "a.jpg")
+    Image.new('RGB', (64, 48), 'red').save(photo, 'JPEG')
+    config["photo_directories"] = [photos]
+    scan_directory(photos)
+
+    # 测试1：缩略图、浏览用大图和原图返回ETag，If-None-Match一致时返回304且没有内容
+    for view in (get_thumbnail, get_viewer_image, get_photo):
+        status, headers, data = call(app, view, photo)
+        assert status == 200 and data and headers.get("ETag") and headers.get("Last-Modified")
+        etag = headers["ETag"]
+        status, headers, data = call(app, view, photo, {"If-None-Match": etag})
+        assert status == 304 and not data and headers["ETag"] == etag
+        status, _, _ = call(app, view, photo, {"If-None-Match": '"other"'})
+        assert status == 200
+    print("测试1: 通过")
+
+    # 测试2：If-Modified-Since 不早于原图修改时间时返回304
+    _, headers, _ = call(app, get_photo, photo)
+    status, _, _ = call(app, get_photo, photo, {"If-Modified-Since": headers["Last-Modified"]})
+    assert status == 304
+    print("测试2: 通过")
+
+    # 测试3：原图修改后ETag变化，旧的ETag不再返回304
+    _, headers, _ = call(app, get_viewer_image, photo)
+    old_etag = headers["ETag"]
+    Image.new('RGB', (64, 48), 'blue').save(photo, 'JPEG')
+    stat = os.stat(photo)
+    os.utime(photo, (stat.st_atime, stat.st_mtime + 10))
+    status, headers, _ = call(app, get_viewer_image, photo, {"If-None-Match": old_etag})
+    assert status == 200 and headers["ETag"] != old_etag
+    print("测试3: 通过")
+
+    # 测试4：URL中的版本号与当前内容一致时按不可变内容长期缓存，过期的版本号使用接口配置的缓存策略
+    # 照片列表中的版本号按目录库记录计算，原图修改后先同步目录库
+    scan_directory(photos)
+    stat = os.stat(photo)
+    version = get_photo_version(photo, stat.st_size, stat.st_mtime)
+    for view, endpoint in ((get_thumbnail, "thumbnail"), (get_viewer_image, "viewer_image"), (get_photo, "photo")):
+        _, headers, _ = call(app, view, photo, query_string={"v": version})
+        assert "immutable" in headers["Cache-Control"]
+        _, headers, _ = call(app, view, photo, query_string={"v": "stale"})
+        assert headers["Cache-Control"] == config.get(f"{endpoint}_cache_control")
+    print("测试4: 通过")
+
+    # 测试5：派生图片参数变化后版本号随之变化，旧版本号不再长期缓存
+    original_size = config["thumbnail_size"]
+    config["thumbnail_size"] = [original_size[0] + 10, original_size[1] + 10]
+    try:
+        assert get_photo_version(photo, stat.st_size, stat.st_mtime) != version
+        _, headers, _ = call(app, get_thumbnail, photo, query_string={"v": version})
+        assert "immutable" not in headers["Cache-Control"]
+    finally:
+        config["thumbnail_size"] = original_size
+    assert get_photo_version(photo, stat.st_size, stat.st_mtime) == version
+    print("测试5: 通过")
+
+    # 测试6：原图支持Range请求，超出文件范围时返回416
+    with open(photo, 'rb') as f:
+        content = f.read()
+    status, headers, data = call(app, get_photo, photo, {"Range": "bytes=0-9"})
+    assert status == 206 and data == content[:10]
+    assert headers["Content-Range"] == f"bytes 0-9/{len(content)}"
+    status, headers, data = call(app, get_photo, photo, {"Range": f"bytes={len(content) - 5}-"})
+    assert status == 206 and data == content[-5:]
+    status, headers, _ = call(app, get_photo, photo, {"Range": f"bytes={len(content) + 100}-"})
+    assert status == 416 and headers["Content-Range"] == f"bytes */{len(content)}"
+    # If-Range 与当前ETag不一致时返回完整文件
+    status, _, data = call(app, get_photo, photo, {"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert status == 200 and data == content
+    print("测试6: 通过")
+
+    # 测试7：交给反向代理发送时只返回内部路径响应头，不读取文件内容
+    config["photo_offload"] = "x-accel-redirect"
+    try:
+        status, headers, data = call(app, get_photo, photo)
+        assert status == 200 and not data
+        assert headers["X-Accel-Redirect"].startswith(config.get("photo_offload_prefix", "/protected_photos") + "/")
+        assert headers["X-Accel-Redirect"].endswith("/a.jpg") and headers.get("ETag")
+        # X-Sendfile 路径原样放在响应头中；包含中文的路径无法用latin-1编码，由Flask直接发送
+        config["photo_offload"] = "x-sendfile"
+        status, headers, data = call(app, get_photo, photo)
+        assert status == 200 and not data and headers["X-Sendfile"] == photo
+        chinese_dir = os.path.join(test_root, "照片")
+        os.makedirs(chinese_dir)
+        chinese_photo = os.path.join(chinese_dir, "测试.jpg")
+        shutil.copyfile(photo, chinese_photo)
+        config["photo_directories"] = [photos, chinese_dir]
+        scan_directory(chinese_dir)
+        status, headers, data = call(app, get_photo, chinese_photo)
+        assert status == 200 and data == content and "X-Sendfile" not in headers
+        # WSGI服务器按latin-1编码响应头
+        for _, value in headers.items():
+            value.encode('latin-1')
+    finally:
+        config["photo_offload"] = "none"
+    print("测试7: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", "-s", __file__]))
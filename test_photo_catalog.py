@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+from PIL import Image
+from data import photo_catalog
+from data.config_manager import config
+from routes import photo_routes
+from routes.photo_routes import photo_bp
+from utils.catalog_scanner import scan_directory, remove_directory_from_catalog
+
+def make_image(path):
+    Image.new('RGB', (8, 8), 'red').save(path, 'JPEG')
+
+def test_photo_catalog(isolated_root, monkeypatch):
+    print("===== 开始测试 目录库的配置目录范围 =====")
+    test_root = str(isolated_root)
+    photos = os.path.join(test_root, "photos")
+    photos2 = os.path.join(test_root, "photos2")
+    outside = os.path.join(test_root, "outside")
+    for directory in (photos, photos2, outside):
+        os.makedirs(directory)
+        make_image(os.path.join(directory, "a.jpg"))
+    config["photo_directories"] = [photos, photos2]
+    scan_directory(photos)
+    scan_directory(photos2)
+
+    # 测试1：按路径分隔符判断子目录，名称前缀相同的目录不算在内
+    assert photo_catalog.is_in_directory(os.path.join(photos, "sub"), photos)
+    assert photo_catalog.is_in_directory(photos, photos + os.sep)
+    assert not photo_catalog.is_in_directory(photos2, photos)
+    print("测试1: 通过")
+
+    # 测试2：移除配置目录时，名称以另一个配置目录开头的目录也从目录库删除
+    config["photo_directories"] = [photos]
+    remove_directory_from_catalog(photos2)
+    assert photo_catalog.get_photo_stat(os.path.join(photos2, "a.jpg")) is None
+    assert photo_catalog.get_photo_stat(os.path.join(photos, "a.jpg")) is not None
+    # 仍在配置目录中的目录保留
+    remove_directory_from_catalog(os.path.join(photos, "sub"))
+    assert photo_catalog.get_photo_stat(os.path.join(photos, "a.jpg")) is not None
+    print("测试2: 通过")
+
+    # 测试3：配置目录以外的目录不扫描入库
+    monkeypatch.setattr(photo_routes, "_prioritize_missing_derivatives", lambda view_key, rows: None)
+    app = Flask(__name__)
+    app.register_blueprint(photo_bp, url_prefix='/api')
+    client = app.test_client()
+    for directory in (outside, photos2):
+        assert client.get('/api/photos', query_string={"dir": directory}).status_code == 403
+        assert not photo_catalog.is_directory_scanned(directory)
+    response = client.get('/api/photos', query_string={"dir": photos})
+    assert response.status_code == 200 and response.get_json()["total"] == 1
+    print("测试3: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", "-s", __file__]))
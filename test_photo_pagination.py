@@ -0,0 +1,110 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+from PIL import Image
+from data.config_manager import config
+from routes import photo_routes
+from routes.photo_routes import photo_bp, _encode_cursor
+from utils.catalog_scanner import scan_directory
+
+def make_image(path, mtime):
+    Image.new('RGB', (8, 8), 'red').save(path, 'JPEG')
+    os.utime(path, (mtime, mtime))
+
+def fetch_all_pages(client, directory, sort, order, limit):
+    """按游标逐页获取，返回照片路径列表和请求的页数"""
+    paths = []
+    cursor = None
+    pages = 0
+    while True:
+        query = {"dir": directory, "sort": sort, "order": order, "limit": limit}
+        if cursor:
+            query["cursor"] = cursor
+        response = client.get('/api/photos', query_string=query)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert ("subdirectories" in data) == (cursor is None)
+        pages += 1
+        paths.extend(photo["path"] for photo in data["photos"])
+        cursor = data["next_cursor"]
+        if not cursor:
+            return paths, pages
+
+def fetch_all_pages_from(client, directory, cursor):
+    """从指定游标开始按默认排序获取剩余的页面"""
+    paths = []
+    while cursor:
+        data = client.get('/api/photos', query_string={"dir": directory, "limit": 3, "cursor": cursor}).get_json()
+        paths.extend(photo["path"] for photo in data["photos"])
+        cursor = data["next_cursor"]
+    return paths
+
+def test_photo_pagination(isolated_root, monkeypatch):
+    print("===== 开始测试 /api/photos 游标分页 =====")
+    test_root = str(isolated_root)
+    photos = os.path.join(test_root, "photos")
+    os.makedirs(os.path.join(photos, "sub"))
+    # 包含修改时间相同的照片，检查排序值相同时按路径继续分页
+    mtimes = {"a.jpg": 1000, "b.jpg": 2000, "c.jpg": 2000, "d.jpg": 3000, "sub/e.jpg": 2000, "sub/f.jpg": 500, "g.jpg": 4000}
+    for name, mtime in mtimes.items():
+        make_image(os.path.join(photos, name), mtime)
+    config["photo_directories"] = [photos]
+    scan_directory(photos)
+
+    # 测试只检查分页结果，不触发后台预生成
+    monkeypatch.setattr(photo_routes, "_prioritize_missing_derivatives", lambda view_key, rows: None)
+    app = Flask(__name__)
+    app.register_blueprint(photo_bp, url_prefix='/api')
+    client = app.test_client()
+
+    # 测试1：逐页获取的结果与完整列表一致，没有重复和遗漏
+    for sort, order in (("mtime", "desc"), ("mtime", "asc"), ("name", "asc"), ("size", "desc")):
+        full = client.get('/api/photos', query_string={"dir": photos, "sort": sort, "order": order}).get_json()
+        full_paths = [photo["path"] for photo in full["photos"]]
+        paged_paths, pages = fetch_all_pages(client, photos, sort, order, 3)
+        assert paged_paths == full_paths, (sort, order)
+        assert len(set(paged_paths)) == len(mtimes) and pages == 3
+    print("测试1: 通过")
+
+    # 测试2：排序正确，总数在每一页返回
+    response = client.get('/api/photos', query_string={"dir": photos, "limit": 2})
+    data = response.get_json()
+    assert [os.path.basename(photo["path"]) for photo in data["photos"]] == ["g.jpg", "d.jpg"]
+    assert data["total"] == len(mtimes) and response.headers["X-Total-Count"] == str(len(mtimes))
+    print("测试2: 通过")
+
+    # 测试3：翻页期间新增照片，后续页面不重复也不遗漏原有照片
+    first = client.get('/api/photos', query_string={"dir": photos, "limit": 3}).get_json()
+    make_image(os.path.join(photos, "new.jpg"), 5000)
+    scan_directory(photos)
+    rest = fetch_all_pages_from(client, photos, first["next_cursor"])
+    seen = [photo["path"] for photo in first["photos"]] + rest
+    assert len(seen) == len(set(seen)) == len(mtimes)
+    print("测试3: 通过")
+
+    # 测试4：无效的游标、与排序方式不一致的游标和无效的limit返回400
+    name_cursor = _encode_cursor("name", "asc", "a.jpg", os.path.join(photos, "a.jpg"))
+    invalid_queries = [
+        {"cursor": "not-a-cursor"},
+        {"cursor": "e30="},
+        {"cursor": name_cursor, "sort": "mtime", "order": "desc"},
+        {"cursor": name_cursor, "sort": "name", "order": "desc"},
+        {"limit": 0},
+        {"limit": "abc"},
+        {"limit": photo_routes.MAX_PAGE_SIZE + 1},
+        {"sort": "unknown"},
+        {"order": "sideways"}
+    ]
+    for query in invalid_queries:
+        response = client.get('/api/photos', query_string={"dir": photos, **query})
+        assert response.status_code == 400, query
+    assert client.get('/api/photos', query_string={"dir": photos, "sort": "name", "order": "asc",
+                                                    "cursor": name_cursor}).status_code == 200
+    print("测试4: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", "-s", __file__]))
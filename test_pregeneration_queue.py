@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+
+# 添加项目根目录到Python路径，以便导入模块
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.pregeneration import PregenerationEngine, PRIORITY_VIEWPORT, PRIORITY_SWEEP
+
+def make_engine(queue_size):
+    engine = PregenerationEngine(workers=1, queue_size=queue_size)
+    # 不启动分发线程，由测试直接取出任务检查顺序
+    engine.dispatcher = threading.current_thread()
+    return engine
+
+def take(engine, count):
+    return [engine._next_file() for _ in range(count)]
+
+def test_pregeneration_queue():
+    print("===== 开始测试 PregenerationEngine 优先级队列 =====")
+
+    # 测试1：按优先级取出，同优先级按提交顺序；已排队的文件提高优先级后提前处理
+    engine = make_engine(16)
+    engine.submit_files(["a", "b", "c"], PRIORITY_SWEEP)
+    engine.submit_files(["d"], PRIORITY_VIEWPORT)
+    engine.submit_files(["c"], PRIORITY_VIEWPORT)
+    assert take(engine, 4) == ["d", "c", "a", "b"]
+    print("测试1: 通过")
+
+    # 测试2：当前浏览的照片在队列已满时丢弃优先级最低的排队文件，队列长度不超过上限
+    engine = make_engine(4)
+    engine.submit_files(["s1", "s2", "s3", "s4"], PRIORITY_SWEEP)
+    assert engine.submit_files(["v1", "v2"], PRIORITY_VIEWPORT) == 2
+    assert engine._queued_count() == 4
+    assert "s4" not in engine.pending and "s3" not in engine.pending
+    # 没有更低优先级的文件时丢弃最早提交的同优先级文件
+    engine.submit_files(["v3", "v4", "v5", "v6"], PRIORITY_VIEWPORT)
+    assert engine._queued_count() == 4
+    assert sorted(engine.pending) == ["v3", "v4", "v5", "v6"]
+    # 大量提交后堆中作废的条目被清理
+    for i in range(100):
+        engine.submit_files([f"p{i}"], PRIORITY_VIEWPORT)
+    assert engine._queued_count() == 4 and len(engine.heap) <= 2 * 4
+    assert take(engine, 4) == ["p96", "p97", "p98", "p99"]
+    print("测试2: 通过")
+
+    # 测试3：后台任务在队列已满时阻塞，取出任务后继续提交
+    engine = make_engine(2)
+    engine.submit_files(["a", "b"], PRIORITY_SWEEP)
+    submitter = threading.Thread(target=engine.submit_files, args=(["c"], PRIORITY_SWEEP))
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive() and "c" not in engine.pending
+    take(engine, 1)
+    submitter.join(2)
+    assert not submitter.is_alive() and "c" in engine.pending
+    print("测试3: 通过")
+
+    # 测试4：被丢弃后重新提交的文件只处理一次
+    engine = make_engine(1)
+    engine.submit_files(["x"], PRIORITY_VIEWPORT)
+    engine.submit_files(["y"], PRIORITY_VIEWPORT)
+    engine.submit_files(["x"], PRIORITY_VIEWPORT)
+    assert take(engine, 1) == ["x"]
+    assert not [entry for entry in engine.heap if engine.pending.get(entry[2]) == entry[0] and entry[2] not in engine.running]
+    print("测试4: 通过")
+
+    # 测试5：只等待指定的文件，其他任务提交的文件未处理完时也返回
+    engine = make_engine(16)
+    engine.submit_files(["own1", "own2"], PRIORITY_VIEWPORT)
+    engine.submit_files(["other"], PRIORITY_SWEEP)
+    waiter = threading.Thread(target=engine.wait_until_idle, args=(["own1", "own2"],))
+    waiter.start()
+    for file_path in take(engine, 2):
+        engine.slots.acquire()
+        engine._finish(file_path, [], {"path": file_path}, None)
+    waiter.join(2)
+    assert not waiter.is_alive() and "other" in engine.pending
+    print("测试5: 通过")
+
+    # 测试6：停止后不再取出任务，等待和阻塞的提交立即返回
+    engine = make_engine(1)
+    engine.submit_files(["a"], PRIORITY_SWEEP)
+    submitter = threading.Thread(target=engine.submit_files, args=(["b"], PRIORITY_SWEEP))
+    waiter = threading.Thread(target=engine.wait_until_idle, args=(["a"],))
+    submitter.start()
+    waiter.start()
+    engine.shutdown()
+    submitter.join(2)
+    waiter.join(2)
+    assert not submitter.is_alive() and not waiter.is_alive()
+    assert engine._next_file() is None and engine.submit_files(["c"], PRIORITY_VIEWPORT) == 0
+    print("测试6: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    test_pregeneration_queue()
@@ -0,0 +1,67 @@
+import os
+import random
+import sys
+
+# 添加项目根目录到Python路径，以便导入模块
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+from utils import image_processor
+from utils.image_processor import encode_image_to_size, _encode_image, FORMAT_JPEG
+
+def make_noise_image(size):
+    # 随机噪点难以压缩，文件大小随质量明显变化
+    rng = random.Random(42)
+    img = Image.new('RGB', (size, size))
+    img.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(size * size)])
+    return img
+
+def get_hint(hint_key):
+    return image_processor._quality_hints.get((FORMAT_JPEG, hint_key))
+
+def test_quality_encoder():
+    print("===== 开始测试 encode_image_to_size 质量查找 =====")
+    noise = make_noise_image(128)
+    flat = Image.new('RGB', (128, 128), 'gray')
+
+    # 测试1：编码结果不超过大小限制，并采用满足限制的最高质量
+    max_bytes = len(_encode_image(noise, 70))
+    data = encode_image_to_size(noise, max_bytes, hint_key="noise")
+    assert len(data) <= max_bytes
+    quality = get_hint("noise")
+    assert data == _encode_image(noise, quality)
+    assert quality >= 70
+    assert quality == 90 or len(_encode_image(noise, quality + 1)) > max_bytes
+    print("测试1: 通过")
+
+    # 测试2：任何质量都超过限制时返回最低质量的编码结果
+    data = encode_image_to_size(noise, 100, hint_key="tiny")
+    assert data == _encode_image(noise, 50)
+    assert get_hint("tiny") == 50
+    print("测试2: 通过")
+
+    # 测试3：记录的质量偏低时（例如前一张照片难以压缩），后续容易压缩的照片把质量恢复到最高
+    image_processor._quality_hints[(FORMAT_JPEG, "camera")] = 55
+    data = encode_image_to_size(flat, 1024 * 1024, hint_key="camera")
+    assert get_hint("camera") == 90
+    assert data == _encode_image(flat, 90)
+    print("测试3: 通过")
+
+    # 测试4：记录的质量仍是最高可用质量时，只多尝试一次高一档的质量
+    image_processor._quality_hints[(FORMAT_JPEG, "steady")] = quality
+    calls = []
+    original_encode = image_processor._encode_image
+    image_processor._encode_image = lambda img, q, fmt=FORMAT_JPEG, **options: (calls.append(q), original_encode(img, q, fmt, **options))[1]
+    try:
+        encode_image_to_size(noise, max_bytes, hint_key="steady")
+    finally:
+        image_processor._encode_image = original_encode
+    assert calls[0] == quality
+    assert len(calls) <= 2
+    assert get_hint("steady") == quality
+    print("测试4: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    test_quality_encoder()
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+
+import pytest
+import piexif
+from xml.dom import minidom
+from PIL import Image
+from data.config_manager import config
+from utils.rating_writeback import (writeback_status, queue_rating_writeback, flush_rating_writeback, get_writeback_status,
+                                   get_xmp_sidecar_path, write_rating_to_xmp)
+
+def make_image(path):
+    Image.new('RGB', (8, 8), 'red').save(path, 'JPEG', exif=piexif.dump({'0th': {}, 'Exif': {}}))
+
+def read_exif_rating(path):
+    return piexif.load(path)['0th'].get(piexif.ImageIFD.Rating)
+
+def wait_for_writes(count, timeout=5):
+    deadline = time.time() + timeout
+    while get_writeback_status()["written"] < count and time.time() < deadline:
+        time.sleep(0.05)
+
+def test_rating_writeback(isolated_root, monkeypatch):
+    print("===== 开始测试 评分写回合并 =====")
+    test_root = str(isolated_root)
+    # 写回计数从0开始
+    for key in ("written", "coalesced", "failed"):
+        monkeypatch.setitem(writeback_status, key, 0)
+    photo = os.path.join(test_root, "a.jpg")
+    other = os.path.join(test_root, "b.jpg")
+    make_image(photo)
+    make_image(other)
+    config["rating_writeback_mode"] = "exif"
+    config["rating_writeback_delay"] = 0.3
+
+    # 测试1：等待期间连续修改同一张照片只写回最后一次
+    for rating in (3, 4, 5):
+        assert queue_rating_writeback({photo: rating}) == 1
+    status = get_writeback_status()
+    assert status["pending"] == 1 and status["coalesced"] == 2 and status["written"] == 0
+    wait_for_writes(1)
+    status = get_writeback_status()
+    assert status["written"] == 1 and status["pending"] == 0
+    assert read_exif_rating(photo) == 5
+    print("测试1: 通过")
+
+    # 测试2：XMP模式写入附属文件，不改写原图，已有附属文件只替换星级
+    config["rating_writeback_mode"] = "xmp"
+    original_mtime = os.path.getmtime(other)
+    sidecar = get_xmp_sidecar_path(other)
+    with open(sidecar, 'w', encoding='utf-8') as f:
+        f.write('<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF><rdf:Description rdf:about="">'
+                '<xmp:Rating>1</xmp:Rating><dc:title>t</dc:title></rdf:Description></rdf:RDF></x:xmpmeta>')
+    queue_rating_writeback({other: 4})
+    wait_for_writes(2)
+    with open(sidecar, 'r', encoding='utf-8') as f:
+        content = f.read()
+    assert '<xmp:Rating>4</xmp:Rating>' in content and '<dc:title>t</dc:title>' in content
+    assert os.path.getmtime(other) == original_mtime
+    print("测试2: 通过")
+
+    # 测试3：退出前立即写回等待中的评分
+    config["rating_writeback_delay"] = 60
+    queue_rating_writeback({other: 2})
+    assert flush_rating_writeback() == 1
+    assert get_writeback_status()["pending"] == 0
+    with open(sidecar, 'r', encoding='utf-8') as f:
+        assert '<xmp:Rating>2</xmp:Rating>' in f.read()
+    print("测试3: 通过")
+
+    # 测试4：写回失败记录在状态中，不影响其他照片
+    config["rating_writeback_mode"] = "exif"
+    broken = os.path.join(test_root, "broken.jpg")
+    with open(broken, 'wb') as f:
+        f.write(b'not a jpeg')
+    queue_rating_writeback({broken: 3, photo: 1})
+    flush_rating_writeback()
+    status = get_writeback_status()
+    assert status["failed"] == 1 and status["recent_errors"][-1]["file_path"] == broken
+    assert read_exif_rating(photo) == 1
+    print("测试4: 通过")
+
+    # 测试5：Lightroom写入的附属文件已在描述上声明xmp命名空间但没有星级，写入后仍是有效的XML；单引号的星级属性也能替换
+    lightroom = os.path.join(test_root, "c.jpg")
+    make_image(lightroom)
+    sidecar = get_xmp_sidecar_path(lightroom)
+    with open(sidecar, 'w', encoding='utf-8') as f:
+        f.write('<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="Adobe XMP Core 7.0">\n'
+                ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+                '  <rdf:Description rdf:about=""\n'
+                '    xmlns:xmp="http://ns.adobe.com/xap/1.0/"\n'
+                '    xmlns:crs="http://ns.adobe.com/camera-raw-settings/1.0/"\n'
+                '    xmp:CreatorTool="Adobe Photoshop Lightroom Classic"\n'
+                '    crs:Version="15.0">\n'
+                '  </rdf:Description>\n'
+                ' </rdf:RDF>\n'
+                '</x:xmpmeta>\n')
+    write_rating_to_xmp(lightroom, 3)
+    description = minidom.parse(sidecar).getElementsByTagName('rdf:Description')[0]
+    assert description.getAttribute('xmp:Rating') == '3' and description.getAttribute('crs:Version') == '15.0'
+    with open(sidecar, 'r', encoding='utf-8') as f:
+        content = f.read()
+    with open(sidecar, 'w', encoding='utf-8') as f:
+        f.write(content.replace('xmp:Rating="3"', "xmp:Rating='3'"))
+    write_rating_to_xmp(lightroom, 5)
+    with open(sidecar, 'r', encoding='utf-8') as f:
+        assert f.read().count('xmp:Rating') == 1
+    description = minidom.parse(sidecar).getElementsByTagName('rdf:Description')[0]
+    assert description.getAttribute('xmp:Rating') == '5'
+    print("测试5: 通过")
+
+    print("===== 所有测试通过 =====")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", "-s", __file__]))
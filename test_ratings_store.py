@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+# 添加项目根目录到Python路径，以便导入模块
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from data.ratings_store import RatingsStore
+
+def test_ratings_store():
+    print("===== 开始测试 RatingsStore 评分数据库 =====")
+    test_root = tempfile.mkdtemp(prefix="ratings_store_test_")
+    db_file = os.path.join(test_root, "ratings.db")
+    old_file = os.path.join(test_root, "photo_ratings.json")
+    new_file = os.path.join(test_root, "ratings.json")
+    try:
+        with open(old_file, 'w', encoding='utf-8') as f:
+            json.dump({"/photos/a.jpg": 3, "/photos/b.jpg": 2}, f)
+        with open(new_file, 'w', encoding='utf-8') as f:
+            json.dump({"/photos/a.jpg": 5, "/photos/c.jpg": 0, "/photos/d.jpg": 9}, f)
+
+        # 测试1：导入旧评分文件，靠后的文件优先，无效评分和0分不导入
+        store = RatingsStore(db_file, [old_file, new_file], commit_delay=0.05)
+        assert store.get("/photos/a.jpg") == 5
+        assert store.get("/photos/b.jpg") == 2
+        assert store.get("/photos/c.jpg", 0) == 0 and "/photos/d.jpg" not in store
+        print("测试1: 通过")
+
+        # 测试2：并发修改全部保存，0分删除记录
+        threads = [threading.Thread(target=store.__setitem__, args=(f"/photos/{i}.jpg", i % 5 + 1)) for i in range(50)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        store["/photos/b.jpg"] = 0
+        store.flush()
+        reopened = RatingsStore(db_file, [old_file, new_file])
+        assert len(reopened) == 51 and reopened.get("/photos/b.jpg", 0) == 0
+        assert reopened.get("/photos/7.jpg") == 3
+        print("测试2: 通过")
+
+        # 测试3：旧评分文件只导入一次，之后修改的评分不被覆盖
+        store["/photos/a.jpg"] = 1
+        store.flush()
+        again = RatingsStore(db_file, [old_file, new_file])
+        assert again.get("/photos/a.jpg") == 1
+        print("测试3: 通过")
+
+        # 测试4：数据库打开失败时抛出异常而不是返回空评分，之后访问时重试
+        missing_dir = os.path.join(test_root, "missing")
+        broken = RatingsStore(os.path.join(missing_dir, "ratings.db"))
+        for action in (lambda: broken.get("/photos/a.jpg"), lambda: broken.__setitem__("/photos/a.jpg", 4)):
+            try:
+                action()
+                assert False, "数据库打开失败时应抛出异常"
+            except sqlite3.Error:
+                pass
+        assert broken.flush() == 0
+        os.makedirs(missing_dir)
+        broken["/photos/a.jpg"] = 4
+        assert broken.flush() == 1
+        assert RatingsStore(os.path.join(missing_dir, "ratings.db")).get("/photos/a.jpg") == 4
+        print("测试4: 通过")
+
+        print("===== 所有测试通过 =====")
+    finally:
+        shutil.rmtree(test_root)
+
+if __name__ == "__main__":
+    test_ratings_store()
@@ -0,0 +1,89 @@
+import os
+import sys
+import shutil
+import tempfile
+import multiprocessing
+
+# 添加项目根目录到Python路径，以便导入模块
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.thumbnail_store import ThumbnailPack, _parse_records
+
+def append_records(pack_path, prefix, count):
+    """在独立进程中追加记录（模拟预生成工作进程），同一张原图反复覆盖"""
+    pack = ThumbnailPack(pack_path)
+    for i in range(count):
+        pack.append(f"/photos/{prefix}{i % 20}.jpg", f"{prefix}-{i}".encode() * 50, float(i))
+    pack.close()
+
+def test_thumbnail_pack():
+    print("===== 开始测试 ThumbnailPack 打包文件 =====")
+    test_root = tempfile.mkdtemp(prefix="thumbnail_pack_test_")
+    pack_path = os.path.join(test_root, "test.pack")
+    try:
+        pack = ThumbnailPack(pack_path)
+        pack.append("/photos/a.jpg", b"a-v1", 100.0)
+        pack.append("/photos/b.jpg", b"b-v1", 200.0)
+        pack.append("/photos/a.jpg", b"a-v2-longer", 150.0)
+        pack.append("/photos/b.jpg", b"", 0.0)
+
+        # 测试1：读取最新的记录，已删除的记录返回None
+        assert pack.read("/photos/a.jpg") == b"a-v2-longer"
+        assert pack.get_source_mtime("/photos/a.jpg") == 150.0
+        assert pack.read("/photos/b.jpg") is None
+        print(f"测试1: 通过，可回收 {pack.garbage_bytes} 字节")
+
+        # 测试2：另一个实例（模拟其他进程）追加的记录，读取时能扫描到
+        other = ThumbnailPack(pack_path)
+        other.append("/photos/c.jpg", b"c-v1", 300.0)
+        assert pack.read("/photos/c.jpg") == b"c-v1"
+
+        # 测试3：压缩后只保留最新记录，文件变小且数据不变
+        size_before = os.path.getsize(pack_path)
+        reclaimed = pack.compact(0.0)
+        assert reclaimed > 0 and os.path.getsize(pack_path) == size_before - reclaimed
+        assert pack.read("/photos/a.jpg") == b"a-v2-longer"
+        assert pack.read("/photos/c.jpg") == b"c-v1"
+        assert pack.garbage_bytes == 0
+        print(f"测试3: 通过，回收 {reclaimed} 字节")
+
+        # 测试4：压缩后旧实例检测到文件已替换，重新建立索引
+        assert other.read("/photos/a.jpg") == b"a-v2-longer"
+
+        # 测试5：从索引快照加载，只扫描快照之后追加的记录
+        pack.save_index()
+        pack.append("/photos/d.jpg", b"d-v1", 400.0)
+        pack.close()
+        reloaded = ThumbnailPack(pack_path)
+        assert reloaded.read("/photos/d.jpg") == b"d-v1"
+        assert reloaded.read("/photos/a.jpg") == b"a-v2-longer"
+        reloaded.close()
+        other.close()
+        print("测试5: 通过")
+
+        # 测试6：多个进程同时追加，同时反复压缩，记录不丢失也不交错
+        workers = [multiprocessing.Process(target=append_records, args=(pack_path, prefix, 200)) for prefix in "wxyz"]
+        for worker in workers:
+            worker.start()
+        compactor = ThumbnailPack(pack_path)
+        while any(worker.is_alive() for worker in workers):
+            compactor.compact(0.0)
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+        with open(pack_path, 'rb') as f:
+            data = f.read()
+        assert _parse_records(data, 0, pack_path)[1] == len(data)
+        for reader in (compactor, ThumbnailPack(pack_path)):
+            for prefix in "wxyz":
+                for k in range(20):
+                    assert reader.read(f"/photos/{prefix}{k}.jpg") == f"{prefix}-{180 + k}".encode() * 50
+        compactor.close()
+        print("测试6: 通过")
+
+        print("===== 所有测试通过 =====")
+    finally:
+        shutil.rmtree(test_root)
+
+if __name__ == "__main__":
+    test_thumbnail_pack()
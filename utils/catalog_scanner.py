@@ -0,0 +1,283 @@
+import os
+import threading
+import time
+from datetime import datetime
+from PIL import Image
+from data import photo_catalog
+from data.config_manager import config, photo_ratings, invalidate_cache_for_paths, cache_watch_state
+from utils.file_utils import walk_directory_tree, remove_derivatives
+
+# 每批写入目录库的照片数量
+SCAN_BATCH_SIZE = 500
+
+# EXIF 标签：Exif IFD 指针、拍摄时间、修改时间
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+# 按根目录加锁，避免同一目录被并发重复扫描
+_scan_locks = {}
+_scan_locks_guard = threading.Lock()
+
+
+def _get_scan_lock(directory):
+    """获取目录对应的扫描锁"""
+    key = photo_catalog.normalize_directory(directory)
+    with _scan_locks_guard:
+        if key not in _scan_locks:
+            _scan_locks[key] = threading.Lock()
+        return _scan_locks[key]
+
+
+def _format_exif_datetime(value):
+    """将EXIF日期（YYYY:MM:DD HH:MM:SS）转换为统一的日期格式"""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='ignore')
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+def read_image_header(file_path):
+    """只读取文件头，获取图片尺寸和拍摄日期（不解码像素数据）"""
+    width = height = capture_date = None
+    try:
+        with Image.open(file_path) as img:
+            width, height = img.size
+            exif = img.getexif()
+            if exif:
+                capture_date = _format_exif_datetime(exif.get_ifd(EXIF_IFD_POINTER).get(EXIF_DATETIME_ORIGINAL))
+                if not capture_date:
+                    capture_date = _format_exif_datetime(exif.get(EXIF_DATETIME))
+    except Exception as e:
+        print(f"[警告] 读取图片头信息 {file_path} 时出错: {str(e)}")
+    return width, height, capture_date
+
+
+def scan_directory(directory):
+    """扫描目录子树并同步到目录库（只为新增或变化的文件读取文件头），返回发生变化的文件路径"""
+    if not os.path.isdir(directory):
+        print(f"[错误] 目录不存在: {directory}")
+        return []
+
+    with _get_scan_lock(directory):
+        start_time = time.time()
+        print(f"[目录扫描] 开始扫描目录: {directory}")
+
+        known_files = photo_catalog.get_known_files(directory)
+        tree = walk_directory_tree(directory)
+        images, directories = tree['images'], tree['directories']
+
+        batch = []
+        added_paths = []
+        modified_paths = []
+        for image in images:
+            known = known_files.pop(image['path'], None)
+            if known is not None and known == (image['size'], image['mtime']):
+                continue
+            if known is None:
+                added_paths.append(image['path'])
+            else:
+                modified_paths.append(image['path'])
+            image['width'], image['height'], image['capture_date'] = read_image_header(image['path'])
+            image['rating'] = photo_ratings.get(image['path'], 0)
+            batch.append(image)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                photo_catalog.upsert_photos(batch)
+                batch = []
+        photo_catalog.upsert_photos(batch)
+
+        # 剩下的已记录文件在磁盘上已不存在
+        removed_paths = list(known_files)
+        photo_catalog.remove_photos(removed_paths)
+        photo_catalog.replace_directories(directory, directories)
+        photo_catalog.mark_directory_scanned(directory)
+
+        # 已变化或已删除的原图，其派生图片需要重新生成或清理
+        for file_path in modified_paths + removed_paths:
+            remove_derivatives(file_path)
+        changed_paths = added_paths + modified_paths + removed_paths
+        invalidate_cache_for_paths(changed_paths)
+
+        print(f"[目录扫描] 扫描完成: {directory}，共 {len(images)} 张图片，新增 {len(added_paths)} 张，更新 {len(modified_paths)} 张，删除 {len(removed_paths)} 张，耗时 {time.time() - start_time:.2f}秒")
+        return changed_paths
+
+
+def _refresh_directory_flags(directory):
+    """重新检查单个目录的标记（是否包含图片/子目录）并写入目录库"""
+    has_images = False
+    has_subdirectories = False
+    try:
+        # 修改时间在读取目录内容之前获取，读取期间发生的变化下次轮询时还能发现
+        mtime = os.stat(directory).st_mtime
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    has_subdirectories = True
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in config['supported_formats']:
+                    has_images = True
+                if has_images and has_subdirectories:
+                    break
+    except OSError:
+        return
+    photo_catalog.upsert_directory({
+        'path': directory,
+        'name': os.path.basename(directory),
+        'has_images': has_images,
+        'has_subdirectories': has_subdirectories,
+        'mtime': mtime
+    })
+
+
+def sync_paths(paths):
+    """将文件监控报告的路径变化同步到目录库，并精确失效相关缓存和派生图片"""
+    changed_paths = []
+    parent_dirs = set()
+    for path in paths:
+        parent_dirs.add(os.path.dirname(path))
+        if os.path.isdir(path):
+            # 新建或移入的目录，扫描整个子树
+            scan_directory(path)
+            changed_paths.append(path)
+            continue
+
+        if os.path.splitext(path)[1].lower() not in config['supported_formats']:
+            # 已删除的目录：从目录库中移除整个子树
+            if not os.path.exists(path) and photo_catalog.has_directory(path):
+                photo_catalog.remove_directory_tree(path)
+                changed_paths.append(path)
+            continue
+
+        known = photo_catalog.get_photo_stat(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+
+        if stat is None:
+            if known is not None:
+                photo_catalog.remove_photos([path])
+                remove_derivatives(path)
+                changed_paths.append(path)
+            continue
+
+        if known == (stat.st_size, stat.st_mtime):
+            continue
+        if known is not None:
+            remove_derivatives(path)
+        width, height, capture_date = read_image_header(path)
+        photo_catalog.upsert_photos([{
+            'path': path,
+            'name': os.path.basename(path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'rating': photo_ratings.get(path, 0),
+            'width': width,
+            'height': height,
+            'capture_date': capture_date
+        }])
+        changed_paths.append(path)
+
+    for directory in parent_dirs:
+        if photo_catalog.has_directory(directory):
+            _refresh_directory_flags(directory)
+
+    removed_count = invalidate_cache_for_paths(changed_paths)
+    if changed_paths:
+        print(f"[文件监控] 同步了 {len(changed_paths)} 个变化，清除了 {removed_count} 个相关缓存项")
+    return changed_paths
+
+
+def sync_directory(directory, known_directories):
+    """只同步单个目录的直接内容（轮询监控发现目录修改时间变化时调用），返回发生变化的路径
+
+    known_directories 为目录库中已记录的目录集合，用于找出新增和已删除的子目录；
+    已有子目录的内容不在这里检查，由各自的修改时间决定是否同步。
+    """
+    if not os.path.isdir(directory):
+        # 目录已删除：从目录库中移除整个子树
+        return sync_paths([directory])
+
+    known_files = photo_catalog.get_directory_files(directory)
+    # 已记录的直接子目录，遍历时出现的移除，剩下的已被删除
+    missing_dirs = {path for path in known_directories
+                    if path != directory and os.path.dirname(path) == directory}
+    paths = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if entry.path in missing_dirs:
+                            missing_dirs.discard(entry.path)
+                        else:
+                            paths.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in config['supported_formats']:
+                        stat = entry.stat()
+                        if known_files.pop(entry.path, None) != (stat.st_size, stat.st_mtime):
+                            paths.append(entry.path)
+                except OSError as e:
+                    print(f"[警告] 读取 {entry.path} 时出错: {str(e)}")
+    except OSError as e:
+        print(f"[错误] 遍历目录 {directory} 时出错: {str(e)}")
+        return []
+
+    # 剩下的已记录文件和子目录在磁盘上已不存在
+    paths.extend(known_files)
+    paths.extend(missing_dirs)
+    changed_paths = sync_paths(paths) if paths else []
+    # 记录新的修改时间
+    _refresh_directory_flags(directory)
+    return changed_paths
+
+
+def ensure_directory_scanned(directory):
+    """确保目录已在目录库中，未扫描过的目录立即同步扫描"""
+    if not photo_catalog.is_directory_scanned(directory):
+        scan_directory(directory)
+
+
+def scan_all_directories():
+    """扫描所有配置的照片目录"""
+    for directory in list(config["photo_directories"]):
+        try:
+            scan_directory(directory)
+        except Exception as e:
+            print(f"[错误] 扫描目录 {directory} 时出错: {str(e)}")
+
+
+def remove_directory_from_catalog(directory):
+    """从目录库中移除目录（仍被其他配置目录覆盖的部分保留）"""
+    for configured_dir in config["photo_directories"]:
+        if photo_catalog.is_in_directory(directory, configured_dir):
+            return
+    photo_catalog.remove_directory_tree(directory)
+
+
+def _get_rescan_interval():
+    """完整重新扫描的间隔：inotify监控运行时文件变化已由监控同步，完整扫描只作为兜底；
+    轮询监控发现不了原地修改的文件，按普通间隔扫描"""
+    if cache_watch_state["active"]:
+        return config.get('catalog_watch_rescan_interval', 86400)
+    return config.get('catalog_rescan_interval', 600)
+
+
+def catalog_scanner_loop():
+    """后台扫描线程：启动时扫描所有目录，之后按间隔定期重新扫描"""
+    while True:
+        scan_all_directories()
+        last_scan_time = time.time()
+        # 分段等待，目录监控启动或停止后按新的间隔计算
+        while time.time() - last_scan_time < _get_rescan_interval():
+            time.sleep(min(_get_rescan_interval(), 60))
+
+
+def start_catalog_scanner():
+    """启动后台目录库扫描线程"""
+    scanner_thread = threading.Thread(target=catalog_scanner_loop)
+    scanner_thread.daemon = True
+    scanner_thread.start()
+    return scanner_thread
@@ -0,0 +1,181 @@
+import math
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from PIL import Image
+from data.config_manager import config
+from utils.file_utils import get_deep_zoom_paths
+
+# 瓦片金字塔参数（DZI格式）：每个瓦片256像素，瓦片之间不重叠
+TILE_SIZE = 256
+TILE_OVERLAP = 0
+TILE_FORMAT = 'jpg'
+TILE_QUALITY = 85
+TILE_MIMETYPE = 'image/jpeg'
+
+DZI_NAMESPACE = 'http://schemas.microsoft.com/deepzoom/2008'
+
+# 按原图加锁，同一张照片的金字塔同时只生成一次：原图路径 -> [锁, 使用中的请求数]，没有请求使用时删除
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def is_deep_zoom_candidate(width, height):
+    """像素数超过配置的阈值时，查看器放大时使用瓦片金字塔，而不是下载整张原图"""
+    if not width or not height:
+        return False
+    return width * height >= config.get("deep_zoom_min_pixels", 40 * 1000 * 1000)
+
+
+def get_max_level(width, height):
+    """金字塔最高层级（原图尺寸），第0层为1x1像素"""
+    return max(math.ceil(math.log2(max(width, height))), 0)
+
+
+def get_level_size(width, height, level):
+    """指定层级的图片尺寸，每降低一级宽高减半（向上取整）"""
+    scale = 2 ** (get_max_level(width, height) - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def build_dzi_descriptor(width, height):
+    """生成DZI描述文件内容"""
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="{DZI_NAMESPACE}" TileSize="{TILE_SIZE}" Overlap="{TILE_OVERLAP}" Format="{TILE_FORMAT}">'
+            f'<Size Width="{width}" Height="{height}"/></Image>\n')
+
+
+def get_tile_path(file_path, level, col, row):
+    """瓦片文件路径"""
+    _, tiles_dir = get_deep_zoom_paths(file_path, create_dir=False)
+    return os.path.join(tiles_dir, str(level), f'{col}_{row}.{TILE_FORMAT}')
+
+
+def is_pyramid_fresh(file_path, source_mtime):
+    """金字塔已生成完成（描述文件最后写入）且不比原图旧"""
+    dzi_path, _ = get_deep_zoom_paths(file_path, create_dir=False)
+    try:
+        return os.path.getmtime(dzi_path) >= source_mtime
+    except OSError:
+        return False
+
+
+def get_image_size(file_path):
+    """只读取文件头获取原图尺寸"""
+    with Image.open(file_path) as img:
+        return img.size
+
+
+def is_tile_in_range(width, height, level, col, row):
+    """瓦片坐标是否在金字塔范围内"""
+    if level < 0 or level > get_max_level(width, height) or col < 0 or row < 0:
+        return False
+    level_width, level_height = get_level_size(width, height, level)
+    return col < math.ceil(level_width / TILE_SIZE) and row < math.ceil(level_height / TILE_SIZE)
+
+
+@contextmanager
+def _build_lock(file_path):
+    """持有原图的生成锁，最后一个使用者释放后删除锁，锁的数量不随浏览过的照片增长"""
+    with _build_locks_guard:
+        entry = _build_locks.get(file_path)
+        if entry is None:
+            entry = _build_locks[file_path] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _build_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _build_locks[file_path]
+
+
+def _save_level_tiles(level_image, level_dir):
+    """将一个层级切成瓦片保存"""
+    os.makedirs(level_dir, exist_ok=True)
+    width, height = level_image.size
+    for col in range(math.ceil(width / TILE_SIZE)):
+        for row in range(math.ceil(height / TILE_SIZE)):
+            left, top = col * TILE_SIZE, row * TILE_SIZE
+            tile = level_image.crop((left, top, min(left + TILE_SIZE, width), min(top + TILE_SIZE, height)))
+            tile.save(os.path.join(level_dir, f'{col}_{row}.{TILE_FORMAT}'), 'JPEG', quality=TILE_QUALITY)
+
+
+def _is_level_complete(file_path, width, height, level):
+    """层级的瓦片是否都已生成（部分瓦片可能已被缓存清理淘汰）"""
+    _, tiles_dir = get_deep_zoom_paths(file_path, create_dir=False)
+    level_width, level_height = get_level_size(width, height, level)
+    expected = math.ceil(level_width / TILE_SIZE) * math.ceil(level_height / TILE_SIZE)
+    try:
+        return len(os.listdir(os.path.join(tiles_dir, str(level)))) >= expected
+    except OSError:
+        return False
+
+
+def _replace_level(level_image, level_dir):
+    """层级的瓦片先写入临时目录再整体替换"""
+    temp_dir = f"{level_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    try:
+        _save_level_tiles(level_image, temp_dir)
+        shutil.rmtree(level_dir, ignore_errors=True)
+        os.replace(temp_dir, level_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _reset_pyramid(file_path, width, height):
+    """删除旧的瓦片并写入描述文件（描述文件不比原图旧时，已生成的层级有效），各层级之后按需生成"""
+    dzi_path, tiles_dir = get_deep_zoom_paths(file_path)
+    shutil.rmtree(tiles_dir, ignore_errors=True)
+    temp_dzi_path = f"{dzi_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_dzi_path, 'w', encoding='utf-8') as f:
+        f.write(build_dzi_descriptor(width, height))
+    os.replace(temp_dzi_path, dzi_path)
+
+
+def build_levels(file_path, level):
+    """生成指定层级以及缺少的更低层级的瓦片
+
+    只按该层级的尺寸解码原图：JPEG直接按1/2、1/4、1/8缩小解码（draft），浏览缩小的层级时
+    不需要把整张超大原图解码到内存中；更高的层级在放大查看到时才生成。
+    """
+    _, tiles_dir = get_deep_zoom_paths(file_path)
+    with Image.open(file_path) as img:
+        width, height = img.size
+        missing = [lower for lower in range(level) if not _is_level_complete(file_path, width, height, lower)]
+        lowest = min(missing, default=level)
+        level_size = get_level_size(width, height, level)
+        img.draft('RGB', level_size)
+        level_image = img.convert('RGB') if img.mode != 'RGB' else img
+        if level_image.size != level_size:
+            level_image = level_image.resize(level_size, Image.BOX)
+        for current in range(level, lowest - 1, -1):
+            if current == level or current in missing:
+                _replace_level(level_image, os.path.join(tiles_dir, str(current)))
+            if current > lowest:
+                # reduce 按2x2像素取平均，尺寸向上取整，与DZI各层级尺寸一致
+                level_image = level_image.reduce(2)
+
+
+def ensure_level(file_path, source_mtime, level):
+    """需要时生成瓦片金字塔的一个层级（第一次请求该层级的瓦片时生成并缓存到磁盘），成功时返回True
+
+    并发请求同一张照片的瓦片时只生成一次，其他请求等待生成完成。
+    """
+    with _build_lock(file_path):
+        try:
+            width, height = get_image_size(file_path)
+            if not is_pyramid_fresh(file_path, source_mtime):
+                _reset_pyramid(file_path, width, height)
+            if _is_level_complete(file_path, width, height, level):
+                return True
+            build_levels(file_path, level)
+            print(f"[瓦片] 已生成 {file_path} 的第 {level} 级瓦片（原图 {width}x{height}，共 {get_max_level(width, height) + 1} 级）")
+            return True
+        except Exception as e:
+            print(f"[错误] 生成 {file_path} 的第 {level} 级瓦片时出错: {str(e)}")
+            return False
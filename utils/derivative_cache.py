@@ -0,0 +1,264 @@
+import os
+import shutil
+import threading
+import time
+from data import photo_catalog
+from data.config_manager import config
+from utils.image_processor import get_derivative_specs
+from utils.file_utils import get_deep_zoom_paths, get_mirrored_directory
+from utils.thumbnail_store import (PACK_DIRECTORY, remove_orphan_packed_thumbnails, compact_thumbnail_packs,
+                                   save_thumbnail_pack_indexes)
+
+# 派生图片存储目录
+DERIVATIVE_DIRECTORIES = ('thumbnails', 'viewer_images', 'deep_zoom')
+# 瓦片金字塔存储目录（瓦片按所属金字塔判断是否孤立）
+DEEP_ZOOM_DIRECTORY = 'deep_zoom'
+
+# 刚生成不久的派生图片不做孤立清理（原图可能还在扫描入库中）
+ORPHAN_GRACE_SECONDS = 600
+# 写入中断留下的临时文件超过该时间后删除
+TEMP_FILE_MAX_AGE = 3600
+
+# 派生图片最近访问时间（内存中记录，清理时写入文件的访问时间，不依赖文件系统的atime设置）
+_access_times = {}
+_access_lock = threading.Lock()
+
+# 清理互斥，避免后台定期清理和移除目录时触发的清理同时进行
+_sweep_lock = threading.Lock()
+
+# 最近一次清理的结果
+last_sweep_report = {}
+
+
+def record_derivative_access(derivative_path):
+    """记录派生图片被访问（用于按最近访问时间淘汰）"""
+    with _access_lock:
+        _access_times[derivative_path] = time.time()
+
+
+def _flush_access_times():
+    """将内存中的访问时间写入文件的atime"""
+    with _access_lock:
+        access_times = dict(_access_times)
+        _access_times.clear()
+    for derivative_path, access_time in access_times.items():
+        try:
+            os.utime(derivative_path, (access_time, os.path.getmtime(derivative_path)))
+        except OSError:
+            pass
+
+
+def _list_derivative_files():
+    """列出所有派生图片文件：(路径, 大小, 最近访问时间, 修改时间)"""
+    files = []
+    pending = [directory for directory in DERIVATIVE_DIRECTORIES if os.path.isdir(directory)]
+    pack_directory = os.path.normcase(os.path.normpath(PACK_DIRECTORY))
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            # 打包文件单独管理
+                            if os.path.normcase(os.path.normpath(entry.path)) != pack_directory:
+                                pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            files.append((entry.path, stat.st_size, max(stat.st_atime, stat.st_mtime), stat.st_mtime))
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"[缓存清理] 无法读取目录 {directory}: {str(e)}")
+    return files
+
+
+def _get_directory_size(directory):
+    total = 0
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_file(file_path):
+    try:
+        os.remove(file_path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        print(f"[缓存清理] 删除 {file_path} 时出错: {str(e)}")
+        return False
+
+
+def _remove_empty_directories():
+    """删除派生图片存储目录下的空目录"""
+    for root_directory in DERIVATIVE_DIRECTORIES:
+        if not os.path.isdir(root_directory):
+            continue
+        # 自底向上遍历，子目录删除后父目录也可能变为空目录
+        for dirpath, _, _ in os.walk(root_directory, topdown=False):
+            if dirpath != root_directory:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+
+def _get_owner_path(file_path):
+    """判断孤立时使用的路径：瓦片（金字塔目录/层级/列_行.jpg）按所属的金字塔目录判断，其他文件按自身路径"""
+    if file_path.startswith(DEEP_ZOOM_DIRECTORY + os.path.sep) and not file_path.endswith('.dzi'):
+        return os.path.dirname(os.path.dirname(file_path))
+    return file_path
+
+
+def _get_mirrored_key(owner_path):
+    """派生图片（或瓦片金字塔目录）在存储目录下的相对目录，与原图目录的 get_mirrored_directory 对应"""
+    relative_path = owner_path.split(os.path.sep, 1)[1] if os.path.sep in owner_path else ''
+    return os.path.normcase(os.path.normpath(os.path.dirname(relative_path)))
+
+
+def _get_expected_derivatives(source_directories, file_specs):
+    """相对目录对应的原图目录中，目录库记录的照片应有的派生图片路径（当前启用的各编码格式，以及瓦片金字塔）"""
+    expected = set()
+    for directory in source_directories:
+        for photo_path in photo_catalog.get_directory_files(directory):
+            for spec in file_specs:
+                expected.add(os.path.normcase(spec["get_path"](photo_path, create_dir=False)))
+            expected.update(os.path.normcase(path) for path in get_deep_zoom_paths(photo_path, create_dir=False))
+    return expected
+
+
+def _all_roots_scanned():
+    return all(photo_catalog.is_directory_scanned(directory) for directory in config["photo_directories"])
+
+
+def sweep_derivative_cache():
+    """清理派生图片缓存，返回清理结果
+
+    1. 删除原图已不存在（已删除或所在目录已移除）的缩略图、浏览用大图和瓦片，以及写入中断留下的临时文件；
+    2. 总大小超过配额或磁盘剩余空间不足时，按最近访问时间从旧到新淘汰派生图片（之后访问时重新生成）。
+    孤立清理依赖目录库，所有配置的目录都扫描入库后才进行。
+    """
+    with _sweep_lock:
+        start_time = time.time()
+        report = {
+            "orphans_removed": 0,
+            "temp_files_removed": 0,
+            "evicted": 0,
+            "bytes_reclaimed": 0,
+            "total_bytes": 0,
+            "quota_bytes": config.get("derivative_cache_quota_mb", 0) * 1024 * 1024,
+            "orphan_check": False
+        }
+
+        _flush_access_times()
+        files = _list_derivative_files()
+        remaining = []
+
+        # 派生图片按所属原图目录逐个检查，每次只在内存中保留一个目录应有的派生图片
+        source_directories = None
+        if _all_roots_scanned():
+            report["orphan_check"] = True
+            # 当前启用的各编码格式的派生图片（停用的格式留下的文件作为孤立文件删除）
+            file_specs = [spec for spec in get_derivative_specs() if not spec["packed"]]
+            source_directories = {}
+            for directory in photo_catalog.get_photo_directories():
+                key = os.path.normcase(os.path.normpath(get_mirrored_directory(directory)))
+                source_directories.setdefault(key, []).append(directory)
+            # 同一原图目录的缩略图、浏览用大图和瓦片排在一起
+            files.sort(key=lambda item: _get_mirrored_key(_get_owner_path(item[0])))
+        expected_key, expected = None, set()
+
+        for file_path, size, last_access, mtime in files:
+            if file_path.endswith('.tmp'):
+                # 可能正在写入的临时文件不参与淘汰
+                if start_time - mtime > TEMP_FILE_MAX_AGE and _remove_file(file_path):
+                    report["temp_files_removed"] += 1
+                    report["bytes_reclaimed"] += size
+                continue
+            if source_directories is not None and start_time - mtime > ORPHAN_GRACE_SECONDS:
+                owner_path = _get_owner_path(file_path)
+                key = _get_mirrored_key(owner_path)
+                if key != expected_key:
+                    expected_key = key
+                    expected = _get_expected_derivatives(source_directories.get(key, ()), file_specs)
+                if os.path.normcase(owner_path) not in expected and _remove_file(file_path):
+                    report["orphans_removed"] += 1
+                    report["bytes_reclaimed"] += size
+                    continue
+            remaining.append((file_path, size, last_access))
+
+        # 打包存储的缩略图：删除原图不存在的记录，空间在压缩时回收
+        if source_directories is not None:
+            report["orphans_removed"] += remove_orphan_packed_thumbnails(photo_catalog.get_existing_paths)
+        pack_size_before = _get_directory_size(PACK_DIRECTORY)
+        compact_thumbnail_packs()
+        save_thumbnail_pack_indexes()
+        pack_size = _get_directory_size(PACK_DIRECTORY)
+        report["bytes_reclaimed"] += max(pack_size_before - pack_size, 0)
+
+        # 按配额和磁盘剩余空间淘汰最久未访问的派生图片
+        total_bytes = sum(size for _, size, _ in remaining) + pack_size
+        bytes_to_free = 0
+        if report["quota_bytes"] > 0:
+            bytes_to_free = total_bytes - report["quota_bytes"]
+        min_free_bytes = config.get("derivative_cache_min_free_mb", 0) * 1024 * 1024
+        if min_free_bytes > 0:
+            try:
+                free_bytes = shutil.disk_usage(DERIVATIVE_DIRECTORIES[0] if os.path.isdir(DERIVATIVE_DIRECTORIES[0]) else '.').free
+                bytes_to_free = max(bytes_to_free, min_free_bytes - free_bytes)
+            except OSError:
+                pass
+        if bytes_to_free > 0:
+            remaining.sort(key=lambda item: item[2])
+            for file_path, size, _ in remaining:
+                if bytes_to_free <= 0:
+                    break
+                if _remove_file(file_path):
+                    report["evicted"] += 1
+                    report["bytes_reclaimed"] += size
+                    total_bytes -= size
+                    bytes_to_free -= size
+
+        _remove_empty_directories()
+        report["total_bytes"] = total_bytes
+        report["finished_at"] = time.strftime('%Y-%m-%d %H:%M:%S')
+        report["duration"] = round(time.time() - start_time, 2)
+        last_sweep_report.clear()
+        last_sweep_report.update(report)
+
+        print(f"[缓存清理] 清理完成，删除孤立文件 {report['orphans_removed']} 个，淘汰 {report['evicted']} 个，"
+              f"回收 {report['bytes_reclaimed'] / 1024 / 1024:.2f}MB，当前占用 {total_bytes / 1024 / 1024:.2f}MB，"
+              f"耗时 {report['duration']}秒")
+        return report
+
+
+def sweep_in_background():
+    """在独立线程中清理（例如移除目录之后），不阻塞API响应"""
+    sweep_thread = threading.Thread(target=sweep_derivative_cache)
+    sweep_thread.daemon = True
+    sweep_thread.start()
+    return sweep_thread
+
+
+def derivative_cache_loop():
+    """后台清理线程：按配置的间隔定期清理派生图片缓存"""
+    while True:
+        time.sleep(config.get('derivative_cache_sweep_interval', 3600))
+        try:
+            sweep_derivative_cache()
+        except Exception as e:
+            print(f"[错误] 清理派生图片缓存时出错: {str(e)}")
+
+
+def start_derivative_cache_sweeper():
+    """启动后台派生图片缓存清理线程"""
+    sweeper_thread = threading.Thread(target=derivative_cache_loop)
+    sweeper_thread.daemon = True
+    sweeper_thread.start()
+    return sweeper_thread
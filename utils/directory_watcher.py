@@ -0,0 +1,277 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from data.config_manager import config, cache, cache_lock, cache_watch_state
+from data import photo_catalog
+from utils.catalog_scanner import scan_directory, sync_paths, sync_directory
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# inotify_event 结构体头部：wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+
+# 事件合并时间（秒）：批量复制文件时把一段时间内的变化合并成一次同步
+EVENT_DEBOUNCE_SECONDS = 1.0
+# 事件持续不断时，最长等待时间（秒）后强制同步
+EVENT_MAX_DELAY_SECONDS = 5.0
+
+
+def _load_libc():
+    """加载支持inotify的C库，不可用时返回None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class InotifyWatcher:
+    """基于Linux inotify的目录监控，每个子目录一个监控项"""
+
+    name = 'inotify'
+    # 能收到文件内容修改的事件，缓存可以只由事件失效
+    reports_file_changes = True
+
+    def __init__(self, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), '创建inotify实例失败')
+        self.lock = threading.Lock()
+        self.wd_to_path = {}
+        self.path_to_wd = {}
+
+    def _add_watch(self, directory):
+        """为单个目录添加监控"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'添加目录监控失败: {directory}')
+        with self.lock:
+            self.wd_to_path[wd] = directory
+            self.path_to_wd[directory] = wd
+
+    def add_root(self, root):
+        """监控根目录及其所有子目录"""
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            self._add_watch(dirpath)
+            count += 1
+        print(f"[文件监控] 使用inotify监控目录 {root}，共 {count} 个目录")
+
+    def remove_root(self, root):
+        """取消根目录子树的监控"""
+        norm_root = os.path.normpath(root)
+        prefix = norm_root.rstrip(os.path.sep) + os.path.sep
+        with self.lock:
+            for path, wd in list(self.path_to_wd.items()):
+                norm_path = os.path.normpath(path)
+                if norm_path == norm_root or norm_path.startswith(prefix):
+                    self.libc.inotify_rm_watch(self.fd, wd)
+                    del self.path_to_wd[path]
+                    self.wd_to_path.pop(wd, None)
+
+    def _read_events(self, pending):
+        """读取并解析inotify事件，将变化的路径加入待同步集合；队列溢出时返回True"""
+        data = os.read(self.fd, 64 * 1024)
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            with self.lock:
+                directory = self.wd_to_path.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                with self.lock:
+                    self.wd_to_path.pop(wd, None)
+                    self.path_to_wd.pop(directory, None)
+                continue
+
+            path = os.path.join(directory, name) if name else directory
+            # 新建或移入的子目录需要加入监控
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.add_root(path)
+                except OSError as e:
+                    print(f"[警告] {str(e)}，缓存恢复按过期时间失效")
+                    cache_watch_state["active"] = False
+            # 新建文件先等待写入完成（IN_CLOSE_WRITE）再同步
+            if mask & IN_CREATE and not mask & IN_ISDIR:
+                continue
+            pending.add(path)
+        return overflow
+
+    def run(self):
+        """监控线程主循环：合并一段时间内的事件后批量同步"""
+        pending = set()
+        first_pending_time = None
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], EVENT_DEBOUNCE_SECONDS)
+            if readable:
+                if self._read_events(pending):
+                    print(f"[文件监控] inotify事件队列溢出，重新扫描所有目录")
+                    pending.clear()
+                    first_pending_time = None
+                    for root in list(config["photo_directories"]):
+                        scan_directory(root)
+                    continue
+                if pending and first_pending_time is None:
+                    first_pending_time = time.time()
+                # 持续有事件时也要定期同步，避免长时间复制期间一直不更新
+                if first_pending_time is None or time.time() - first_pending_time < EVENT_MAX_DELAY_SECONDS:
+                    continue
+            if pending:
+                paths, pending = pending, set()
+                first_pending_time = None
+                try:
+                    sync_paths(sorted(paths))
+                except Exception as e:
+                    print(f"[错误] 同步文件变化时出错: {str(e)}")
+
+
+class PollingWatcher:
+    """轮询方式的目录监控（无法使用inotify时的后备方案，例如Windows和网络共享）
+
+    定期比较每个目录的修改时间与目录库中扫描时记录的修改时间，只重新同步发生变化的目录，
+    每次轮询每个目录只需一次stat，而不是遍历整个目录树。
+    目录的修改时间只在增删、重命名文件时变化，发现不了原地修改的文件，
+    因此轮询时照片列表缓存仍按过期时间失效，目录库按普通间隔定期完整扫描。
+    """
+
+    name = 'polling'
+    reports_file_changes = False
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.roots = []
+
+    def add_root(self, root):
+        with self.lock:
+            if root not in self.roots:
+                self.roots.append(root)
+        print(f"[文件监控] 使用轮询监控目录 {root}，间隔 {self.interval} 秒")
+
+    def remove_root(self, root):
+        with self.lock:
+            if root in self.roots:
+                self.roots.remove(root)
+
+    def poll_root(self, root):
+        """检查根目录子树下修改时间变化的目录并同步，返回同步的目录数量"""
+        # 还未扫描入库的目录由后台扫描线程处理
+        if not photo_catalog.is_directory_scanned(root):
+            return 0
+        known_directories = photo_catalog.get_directory_mtimes(root)
+        changed = []
+        for directory, mtime in known_directories.items():
+            try:
+                current_mtime = os.stat(directory).st_mtime
+            except OSError:
+                current_mtime = None
+            if current_mtime != mtime:
+                changed.append(directory)
+        # 父目录先同步，已删除目录的子目录随父目录一起移除
+        for directory in sorted(changed):
+            if photo_catalog.has_directory(directory):
+                sync_directory(directory, known_directories)
+        return len(changed)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                roots = list(self.roots)
+            for root in roots:
+                try:
+                    self.poll_root(root)
+                except Exception as e:
+                    print(f"[错误] 轮询目录 {root} 时出错: {str(e)}")
+
+
+# 当前运行的监控器
+_watcher = None
+
+
+def watch_directory(root):
+    """开始监控新添加的根目录"""
+    if _watcher is None:
+        return
+    try:
+        _watcher.add_root(root)
+    except OSError as e:
+        # inotify监控数量达到系统上限等情况，关闭监控模式，缓存恢复按过期时间失效
+        print(f"[警告] 无法监控目录 {root}: {str(e)}，缓存恢复按过期时间失效")
+        cache_watch_state["active"] = False
+
+
+def unwatch_directory(root):
+    """停止监控已移除的根目录"""
+    if _watcher is not None:
+        _watcher.remove_root(root)
+
+
+def start_directory_watcher():
+    """启动目录监控线程：优先使用inotify，不可用时回退为轮询"""
+    global _watcher
+    if not config.get('watch_directories', True):
+        return None
+
+    watcher = None
+    libc = _load_libc()
+    if libc is not None:
+        try:
+            watcher = InotifyWatcher(libc)
+        except OSError as e:
+            print(f"[警告] inotify不可用: {str(e)}，使用轮询监控")
+    if watcher is None:
+        watcher = PollingWatcher(config.get('watch_poll_interval', 30))
+
+    _watcher = watcher
+    # 只有inotify能发现原地修改的文件，轮询监控时缓存仍按过期时间失效
+    cache_watch_state["active"] = watcher.reports_file_changes
+    for root in list(config["photo_directories"]):
+        watch_directory(root)
+
+    watcher_thread = threading.Thread(target=watcher.run)
+    watcher_thread.daemon = True
+    watcher_thread.start()
+
+    # 监控启动前缓存的结果可能已过期
+    with cache_lock:
+        cache.clear()
+    print(f"[文件监控] 目录监控已启动（{watcher.name}）")
+    return watcher
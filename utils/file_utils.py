@@ -1,173 +1,223 @@
 import os
+import shutil
+import warnings
+from PIL import Image
 from data.config_manager import config
 
 # 支持的图片格式
 SUPPORTED_FORMATS = config['supported_formats']
 
+def apply_image_pixel_limit():
+    """按配置设置Pillow的解压炸弹阈值
 
-def get_thumbnail_path(file_path):
-    """获取缩略图存储路径（按照原目录结构组织）"""
+    Pillow默认超过约8900万像素时警告、超过约1.79亿像素时拒绝打开，全景拼接等超大照片无法读取尺寸和生成瓦片。
+    照片来自本地配置的目录（可信文件），按配置的上限拒绝解码（防止损坏的文件耗尽内存），0表示不限制。
+    """
+    limit = config.get("max_image_pixels", 1000 * 1000 * 1000)
+    # Pillow超过 MAX_IMAGE_PIXELS 时警告，超过两倍时拒绝
+    Image.MAX_IMAGE_PIXELS = limit // 2 if limit else None
+    warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+
+# 导入时设置（预生成工作进程同样导入本模块）
+apply_image_pixel_limit()
+
+# 派生图片的编码格式：格式名 -> (文件扩展名, MIME类型)
+FORMAT_JPEG = 'jpeg'
+FORMAT_WEBP = 'webp'
+FORMAT_AVIF = 'avif'
+DERIVATIVE_FORMATS = {
+    FORMAT_JPEG: ('.jpg', 'image/jpeg'),
+    FORMAT_WEBP: ('.webp', 'image/webp'),
+    FORMAT_AVIF: ('.avif', 'image/avif')
+}
+
+
+def _mirrored_directory(file_path):
+    """原图所在目录在派生图片存储目录下的相对路径（盘符冒号替换为下划线，去掉开头的分隔符）"""
+    # 绝对路径直接传给 os.path.join 会丢弃前面的存储目录，需要转换为相对路径
+    return os.path.dirname(file_path).replace(':', '_').lstrip(os.path.sep)
+
+def get_mirrored_directory(directory):
+    """原图目录在派生图片存储目录下对应的相对目录"""
+    return _mirrored_directory(os.path.join(directory, ''))
+
+def _size_suffix(size):
+    """尺寸阶梯中非默认尺寸的文件名后缀（默认尺寸不带后缀）"""
+    return f'_{size}' if size else ''
+
+def get_thumbnail_path(file_path, create_dir=True, fmt=FORMAT_JPEG, size=None):
+    """获取缩略图存储路径（按照原目录结构组织，不同编码格式和尺寸的缩略图并存）"""
     # 确保文件路径使用正确的分隔符
     file_path = file_path.replace('/', os.path.sep)
     
     # 创建缩略图存储目录（在应用程序目录下，保持原目录结构）
-    thumbnail_dir = os.path.join('thumbnails', os.path.dirname(file_path).replace(':', '_'))
-    os.makedirs(thumbnail_dir, exist_ok=True)
+    thumbnail_dir = os.path.join('thumbnails', _mirrored_directory(file_path))
+    if create_dir:
+        os.makedirs(thumbnail_dir, exist_ok=True)
     
     # 缩略图文件路径
     filename = os.path.basename(file_path)
     name_without_ext, ext = os.path.splitext(filename)
-    thumbnail_path = os.path.join(thumbnail_dir, f'{name_without_ext}_thumbnail.jpg')
+    thumbnail_path = os.path.join(thumbnail_dir, f'{name_without_ext}_thumbnail{_size_suffix(size)}{DERIVATIVE_FORMATS[fmt][0]}')
     
     return thumbnail_path
 
-def get_viewer_image_path(file_path):
-    """获取浏览用大图存储路径（按照原目录结构组织）"""
+def get_viewer_image_path(file_path, create_dir=True, fmt=FORMAT_JPEG, size=None):
+    """获取浏览用大图存储路径（按照原目录结构组织，不同编码格式和尺寸的大图并存）"""
     # 确保文件路径使用正确的分隔符
     file_path = file_path.replace('/', os.path.sep)
     
     # 创建浏览用大图存储目录
-    viewer_dir = os.path.join('viewer_images', os.path.dirname(file_path).replace(':', '_'))
-    os.makedirs(viewer_dir, exist_ok=True)
+    viewer_dir = os.path.join('viewer_images', _mirrored_directory(file_path))
+    if create_dir:
+        os.makedirs(viewer_dir, exist_ok=True)
     
     # 浏览用大图文件路径
     filename = os.path.basename(file_path)
     name_without_ext, ext = os.path.splitext(filename)
-    viewer_image_path = os.path.join(viewer_dir, f'{name_without_ext}_viewer.jpg')
+    viewer_image_path = os.path.join(viewer_dir, f'{name_without_ext}_viewer{_size_suffix(size)}{DERIVATIVE_FORMATS[fmt][0]}')
     
     return viewer_image_path
 
-def get_all_images_recursive(directory):
-    """递归获取目录及其所有子目录中的图片文件"""
-    image_files = []
+def get_deep_zoom_paths(file_path, create_dir=True):
+    """获取瓦片金字塔的存储路径（DZI格式）：返回 (描述文件路径, 瓦片目录)，瓦片为 瓦片目录/层级/列_行.jpg"""
+    # 确保文件路径使用正确的分隔符
+    file_path = file_path.replace('/', os.path.sep)
+    
+    deep_zoom_dir = os.path.join('deep_zoom', _mirrored_directory(file_path))
+    if create_dir:
+        os.makedirs(deep_zoom_dir, exist_ok=True)
+    
+    name_without_ext, ext = os.path.splitext(os.path.basename(file_path))
+    return os.path.join(deep_zoom_dir, f'{name_without_ext}.dzi'), os.path.join(deep_zoom_dir, f'{name_without_ext}_files')
+
+def remove_derivatives(file_path):
+    """删除原图对应的缩略图和浏览用大图，使其在下次访问或预生成时重新生成"""
+    removed = 0
+    derivative_paths = []
+    for fmt in DERIVATIVE_FORMATS:
+        for size in [None] + list(config.get("derivative_size_ladder", [])):
+            derivative_paths.append(get_thumbnail_path(file_path, create_dir=False, fmt=fmt, size=size))
+            derivative_paths.append(get_viewer_image_path(file_path, create_dir=False, fmt=fmt, size=size))
+    for derivative_path in derivative_paths:
+        try:
+            os.remove(derivative_path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[警告] 删除派生图片 {derivative_path} 时出错: {str(e)}")
+    # 瓦片金字塔（先删除描述文件，使其视为未生成）
+    dzi_path, tiles_dir = get_deep_zoom_paths(file_path, create_dir=False)
+    if os.path.exists(dzi_path):
+        try:
+            os.remove(dzi_path)
+            shutil.rmtree(tiles_dir, ignore_errors=True)
+            removed += 1
+        except OSError as e:
+            print(f"[警告] 删除瓦片金字塔 {dzi_path} 时出错: {str(e)}")
+    # 打包存储和内存中缓存的缩略图（thumbnail_store 依赖本模块，在函数内导入）
+    from utils.thumbnail_store import remove_packed_thumbnail, discard_memory_thumbnail
+    discard_memory_thumbnail(file_path)
+    try:
+        if remove_packed_thumbnail(file_path):
+            removed += 1
+    except OSError as e:
+        print(f"[警告] 删除打包缩略图 {file_path} 时出错: {str(e)}")
+    return removed
+
+def walk_directory_tree(directory):
+    """单次遍历目录树（迭代式 os.scandir），同时返回图片文件、子目录树和每个目录的标记
+    
+    每个目录只读取一次，文件大小和修改时间直接取自 DirEntry 的 stat 结果；
+    通过记录已访问目录的 (st_dev, st_ino) 防止符号链接造成的循环，且不受递归深度限制。
+    返回 {'images': [...], 'directories': [...]}，directories 包含根目录本身。
+    """
+    images = []
+    directories = []
+    
     try:
-        if not os.path.isdir(directory):
-            print(f"[错误] 目录不存在: {directory}")
-            return []
-            
-        items = os.listdir(directory)
+        root_stat = os.stat(directory)
+    except OSError as e:
+        print(f"[错误] 目录不存在: {directory} ({str(e)})")
+        return {'images': images, 'directories': directories}
+    
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    # 栈中保存 (目录路径, 目录修改时间)，修改时间在读取目录内容之前获取，供轮询监控比较
+    stack = [(directory, root_stat.st_mtime)]
+    while stack:
+        current_dir, current_mtime = stack.pop()
+        has_images = False
+        has_subdirectories = False
+        child_dirs = []
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            has_subdirectories = True
+                            dir_stat = entry.stat()
+                            key = (dir_stat.st_dev, dir_stat.st_ino)
+                            if key in visited:
+                                print(f"[警告] 跳过已访问的目录（符号链接循环）: {entry.path}")
+                                continue
+                            visited.add(key)
+                            child_dirs.append((entry.path, dir_stat.st_mtime))
+                        elif entry.is_file():
+                            if os.path.splitext(entry.name)[1].lower() not in SUPPORTED_FORMATS:
+                                continue
+                            file_stat = entry.stat()
+                            has_images = True
+                            images.append({
+                                'path': entry.path,
+                                'name': entry.name,
+                                'size': file_stat.st_size,
+                                'mtime': file_stat.st_mtime
+                            })
+                    except OSError as e:
+                        print(f"[警告] 读取 {entry.path} 时出错: {str(e)}")
+        except OSError as e:
+            print(f"[错误] 遍历目录 {current_dir} 时出错: {str(e)}")
         
-        for item in items:
-            item_path = os.path.join(directory, item)
-            if os.path.isfile(item_path):
-                # 检查文件是否为支持的图片格式
-                file_ext = os.path.splitext(item)[1].lower()
-                if file_ext in SUPPORTED_FORMATS:
-                    image_files.append(item_path)
-            elif os.path.isdir(item_path):
-                # 递归处理子目录
-                subdir_images = get_all_images_recursive(item_path)
-                print(f"[调试] 从子目录 {item} 中找到 {len(subdir_images)} 张图片")
-                image_files.extend(subdir_images)
-    except Exception as e:
-        print(f"[错误] 递归获取图片时出错: {str(e)}")
+        directories.append({
+            'path': current_dir,
+            'name': os.path.basename(current_dir),
+            'has_images': has_images,
+            'has_subdirectories': has_subdirectories,
+            'mtime': current_mtime
+        })
+        # 逆序入栈，保证按目录列出的顺序深度优先遍历
+        stack.extend(reversed(child_dirs))
+    
+    return {'images': images, 'directories': directories}
+
+def get_all_images_recursive(directory):
+    """递归获取目录及其所有子目录中的图片文件"""
+    if not os.path.isdir(directory):
+        print(f"[错误] 目录不存在: {directory}")
+        return []
+    
+    image_files = [image['path'] for image in walk_directory_tree(directory)['images']]
     print(f"[调试] 离开 get_all_images_recursive，目录 {directory} 共找到 {len(image_files)} 张图片")
     return image_files
 
 def get_subdirectories_without_images(directory):
     """递归获取目录下所有不含图片的子目录，包括多层深度"""
-    print(f"[调试] 进入 get_subdirectories_without_images，检查目录: {directory}")
     subdirs = []
-    try:
-        # 先检查当前目录是否包含图片
-        has_images = False
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
-            if os.path.isfile(item_path) and os.path.splitext(item)[1].lower() in SUPPORTED_FORMATS:
-                has_images = True
-                print(f"[调试] 目录 {directory} 包含图片: {item}")
-                break
-        
-        # 检查当前目录是否包含子目录
-        has_subdirectories = False
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
-            if os.path.isdir(item_path):
-                has_subdirectories = True
-                break
-        
-        # 如果当前目录不包含图片但包含子目录，将其添加到列表（除了顶层目录）
-        if not has_images:
-            print(f"[调试] 目录 {directory} 不包含图片")
-            # 只有当目录既没有图片也没有子目录时才被视为真正的空目录
-            is_empty_directory = not has_images and not has_subdirectories
-            
-            # 非空目录或顶层目录不添加到空目录列表
-            if directory not in config["photo_directories"] and not is_empty_directory:
-                print(f"[调试] 目录 {directory} 不是顶层配置目录，且包含子目录，添加到不含图片但非空的子目录列表")
-                # 获取目录的基本名称作为显示名称
-                dir_name = os.path.basename(directory)
-                subdirs.append({
-                    'path': directory,
-                    'name': dir_name,
-                    'has_images': has_images,
-                    'has_subdirectories': has_subdirectories
-                })
-            elif is_empty_directory:
-                print(f"[调试] 目录 {directory} 是空目录（既没有图片也没有子目录），不添加到列表")
-            else:
-                print(f"[调试] 目录 {directory} 是顶层配置目录，不添加到不含图片的子目录列表")
-        
-        # 递归检查所有子目录
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
-            if os.path.isdir(item_path):
-                print(f"[调试] 在目录 {directory} 中找到子目录: {item}")
-                # 递归获取子目录中的不含图片目录
-                child_subdirs = get_subdirectories_without_images(item_path)
-                if child_subdirs:
-                    print(f"[调试] 从子目录 {item} 中找到 {len(child_subdirs)} 个不含图片的目录")
-                else:
-                    print(f"[调试] 子目录 {item} 中没有找到不含图片的目录")
-                subdirs.extend(child_subdirs)
-    except Exception as e:
-        print(f"[错误] 获取子目录时出错: {str(e)}")
+    for subdir in walk_directory_tree(directory)['directories']:
+        # 只有既没有图片也没有子目录的目录才被视为真正的空目录，空目录和顶层配置目录不添加到列表
+        if subdir['has_images'] or not subdir['has_subdirectories']:
+            continue
+        if subdir['path'] in config["photo_directories"]:
+            continue
+        subdirs.append(subdir)
     print(f"[调试] 离开 get_subdirectories_without_images，目录 {directory} 找到 {len(subdirs)} 个不含图片的子目录")
     return subdirs
 
 def get_all_subdirectories(directory):
     """递归获取目录下的所有子目录，包括包含图片的子目录"""
-    print(f"[调试] 进入 get_all_subdirectories，检查目录: {directory}")
-    subdirs = []
-    try:
-        # 检查所有子目录
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
-            if os.path.isdir(item_path):
-                print(f"[调试] 在目录 {directory} 中找到子目录: {item}")
-                # 添加当前子目录到列表（除了顶层配置目录）
-                if directory not in config["photo_directories"] or item_path not in config["photo_directories"]:
-                    dir_name = os.path.basename(item_path)
-                    # 检查子目录是否包含图片
-                    has_images = False
-                    for subitem in os.listdir(item_path):
-                        subitem_path = os.path.join(item_path, subitem)
-                        if os.path.isfile(subitem_path) and os.path.splitext(subitem)[1].lower() in SUPPORTED_FORMATS:
-                            has_images = True
-                            break
-                    
-                    # 检查子目录是否包含其他子目录
-                    has_subdirectories = False
-                    for subitem in os.listdir(item_path):
-                        subitem_path = os.path.join(item_path, subitem)
-                        if os.path.isdir(subitem_path):
-                            has_subdirectories = True
-                            break
-                    
-                    subdirs.append({
-                        'path': item_path,
-                        'name': dir_name,
-                        'has_images': has_images,
-                        'has_subdirectories': has_subdirectories
-                    })
-                
-                # 递归获取子目录的子目录
-                child_subdirs = get_all_subdirectories(item_path)
-                if child_subdirs:
-                    print(f"[调试] 从子目录 {item} 中找到 {len(child_subdirs)} 个子目录")
-                subdirs.extend(child_subdirs)
-    except Exception as e:
-        print(f"[错误] 获取所有子目录时出错: {str(e)}")
+    # 第一项是目录本身
+    subdirs = walk_directory_tree(directory)['directories'][1:]
     print(f"[调试] 离开 get_all_subdirectories，目录 {directory} 找到 {len(subdirs)} 个子目录")
     return subdirs
 
@@ -0,0 +1,172 @@
+import hashlib
+import mimetypes
+import os
+import urllib.parse
+from datetime import datetime, timezone
+from flask import request, make_response, send_file
+from werkzeug.http import is_resource_modified
+from data.config_manager import config
+from utils.file_utils import DERIVATIVE_FORMATS, FORMAT_JPEG, FORMAT_WEBP, FORMAT_AVIF
+from utils.image_processor import (get_derivative_version_signature, get_derivative_formats, get_size_steps,
+                                   snap_to_size_step)
+
+# 浏览器支持时优先选择的派生图片格式（按压缩率从高到低）
+PREFERRED_FORMATS = (FORMAT_AVIF, FORMAT_WEBP)
+
+
+def get_cache_control(endpoint):
+    """获取接口配置的Cache-Control策略（thumbnail / viewer_image / photo），未配置时每次使用前校验"""
+    return config.get(f"{endpoint}_cache_control", "private, no-cache")
+
+
+def build_etag(file_path, size, mtime, signature=''):
+    """根据原图路径、大小、修改时间和派生图片参数生成ETag（不需要读取文件内容）"""
+    key = f"{file_path}|{size}|{mtime!r}|{signature}"
+    return hashlib.sha1(key.encode('utf-8', errors='surrogateescape')).hexdigest()[:20]
+
+
+def get_photo_version(file_path, size, mtime):
+    """照片内容版本号：原图或任一派生图片参数变化时随之变化"""
+    return build_etag(file_path, size, mtime, get_derivative_version_signature())
+
+
+def _build_srcset(base_url, base_kind):
+    """尺寸阶梯对应的srcset（按默认尺寸的倍数描述，适用于高分辨率屏幕）"""
+    steps = get_size_steps(base_kind)
+    base_size = next(size for size, step in steps if step is None)
+    candidates = []
+    for size, step in steps:
+        if size < base_size:
+            continue
+        url = base_url if step is None else f"{base_url}&w={size}"
+        candidates.append(f"{url} {size / base_size:g}x")
+    return ", ".join(candidates)
+
+
+def get_versioned_urls(file_path, version):
+    """带版本号的图片URL，内容变化后URL随之变化，浏览器可以长期缓存"""
+    quoted_path = urllib.parse.quote(file_path, safe='')
+    thumbnail_url = f"/api/thumbnail/{quoted_path}?v={version}"
+    return {
+        "thumbnail": thumbnail_url,
+        "thumbnail_srcset": _build_srcset(thumbnail_url, "thumbnail"),
+        "viewer_image": f"/api/viewer_image/{quoted_path}?v={version}",
+        "url": f"/api/photo/{quoted_path}?v={version}"
+    }
+
+
+def get_deep_zoom_url(file_path, version):
+    """带版本号的瓦片金字塔描述文件URL，瓦片URL为 去掉.dzi后的路径 + _files/层级/列_行.jpg"""
+    return f"/api/deep_zoom/{urllib.parse.quote(file_path, safe='')}.dzi?v={version}"
+
+
+def get_requested_size_step(base_kind, width=None, dpr=None):
+    """根据请求的宽度（w，像素）或设备像素比（dpr）选择尺寸阶梯中的一级，都未指定时使用默认尺寸（返回None）
+    
+    width / dpr 未传入时从URL参数读取。
+    """
+    if not isinstance(width, (int, float)):
+        width = request.args.get('w', type=int)
+    if not isinstance(dpr, (int, float)):
+        dpr = request.args.get('dpr', type=float)
+    if width and width > 0:
+        return snap_to_size_step(base_kind, width)
+    if dpr and dpr > 0:
+        base_size = next(size for size, step in get_size_steps(base_kind) if step is None)
+        return snap_to_size_step(base_kind, base_size * dpr)
+    return None
+
+
+def get_response_cache_control(endpoint, file_path, source_stat):
+    """请求URL中的版本号与当前内容一致时，响应可作为不可变内容长期缓存；否则使用接口配置的缓存策略"""
+    version = request.args.get('v')
+    if version and version == get_photo_version(file_path, source_stat.st_size, source_stat.st_mtime):
+        return config.get("versioned_cache_control", "private, max-age=31536000, immutable")
+    return get_cache_control(endpoint)
+
+
+def get_last_modified(source_stat):
+    """原图修改时间（HTTP日期只精确到秒）"""
+    return datetime.fromtimestamp(int(source_stat.st_mtime), tz=timezone.utc)
+
+
+def _apply_cache_headers(response, etag, last_modified, cache_control):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def not_modified_response(etag, last_modified, cache_control):
+    """请求的 If-None-Match / If-Modified-Since 与当前版本一致时返回304响应，否则返回None
+
+    在生成派生图片和读取文件之前调用，浏览器缓存有效时不做任何图片处理。
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return _apply_cache_headers(make_response('', 304), etag, last_modified, cache_control)
+
+
+def apply_cache_headers(response, etag, last_modified, cache_control):
+    """为完整响应设置校验信息和缓存策略"""
+    if response.status_code in (200, 206, 304):
+        _apply_cache_headers(response, etag, last_modified, cache_control)
+    return response
+
+
+def negotiate_image_format():
+    """根据请求的Accept头选择派生图片的编码格式
+    
+    只选择浏览器明确声明支持（不含 */* 通配）且已启用的格式，否则使用JPEG。
+    """
+    formats = get_derivative_formats()
+    accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+    for fmt in PREFERRED_FORMATS:
+        if fmt in formats and DERIVATIVE_FORMATS[fmt][1] in accepted:
+            return fmt
+    return FORMAT_JPEG
+
+
+def vary_on_accept(response):
+    """启用了多种编码格式时，响应内容随Accept头变化，共享缓存需按Accept区分"""
+    if len(get_derivative_formats()) > 1:
+        response.vary.add('Accept')
+    return response
+
+
+def _offload_header(file_path):
+    """原图交给反向代理发送时的响应头，未开启时返回None"""
+    mode = config.get("photo_offload", "none")
+    abs_path = os.path.abspath(file_path)
+    if mode == "x-accel-redirect":
+        # nginx内部location，例如 location /protected_photos/ { internal; alias /; }
+        prefix = config.get("photo_offload_prefix", "/protected_photos").rstrip('/')
+        internal_path = abs_path.replace(os.path.sep, '/').lstrip('/')
+        return "X-Accel-Redirect", f"{prefix}/{urllib.parse.quote(internal_path)}"
+    if mode == "x-sendfile":
+        # mod_xsendfile 按原始字节使用响应头中的路径，不做URL解码；响应头只能是latin-1编码，
+        # 包含中文等非ASCII字符（或控制字符）的路径无法原样传给Apache，由Flask发送
+        if not (abs_path.isascii() and abs_path.isprintable()):
+            print(f"[调试] 路径包含非ASCII字符，不使用X-Sendfile: {abs_path}")
+            return None
+        return "X-Sendfile", abs_path
+    return None
+
+
+def send_photo_file(file_path, etag, last_modified, cache_control):
+    """发送原图文件
+
+    开启反向代理发送（X-Accel-Redirect / X-Sendfile）时只返回响应头，由nginx等服务器发送文件内容和处理Range请求，
+    不占用Python工作线程；否则由Flask发送，支持Range/206断点续传，WSGI服务器支持wsgi.file_wrapper时使用sendfile零拷贝发送。
+    """
+    offload = _offload_header(file_path)
+    if offload is not None:
+        response = make_response('')
+        response.headers[offload[0]] = offload[1]
+        response.mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        return apply_cache_headers(response, etag, last_modified, cache_control)
+    
+    response = send_file(file_path, etag=etag, last_modified=last_modified, conditional=True)
+    return apply_cache_headers(response, etag, last_modified, cache_control)
@@ -1,198 +1,687 @@
+import math
 import os
+import threading
 from PIL import Image, ImageFile
 import io
-from utils.file_utils import get_thumbnail_path, get_viewer_image_path
+import piexif
+import functools
+from utils.file_utils import get_thumbnail_path, get_viewer_image_path, DERIVATIVE_FORMATS, FORMAT_JPEG, FORMAT_WEBP, FORMAT_AVIF
+from utils.thumbnail_store import is_packed_format, is_thumbnail_fresh, store_packed_thumbnail
 from data.config_manager import config
 
-# 统计数据字典
+# 统计数据字典（多个线程同时生成图片，读写需加锁）
 image_processing_stats = {
     "total_files": 0,
     "generated_thumbnails": 0,
     "skipped_thumbnails": 0,
     "generated_viewer_images": 0,
     "skipped_viewer_images": 0,
+    "waited_in_flight": 0,
     "errors": 0
 }
+stats_lock = threading.Lock()
+
+# 派生图片生成结果
+RESULT_GENERATED = 'generated'
+RESULT_SKIPPED = 'skipped'
+RESULT_ERROR = 'error'
+
+def increment_stat(key, amount=1):
+    """线程安全地增加统计计数"""
+    with stats_lock:
+        image_processing_stats[key] += amount
+
+def reset_image_processing_stats():
+    """重置统计计数器"""
+    with stats_lock:
+        for key in image_processing_stats:
+            image_processing_stats[key] = 0
+
+def get_image_processing_stats():
+    """获取统计数据的快照"""
+    with stats_lock:
+        return dict(image_processing_stats)
+
+def record_pregeneration_result(result):
+    """记录一个文件的预生成结果（由工作进程返回，在主进程中汇总统计）"""
+    specs = get_derivative_specs()
+    with stats_lock:
+        image_processing_stats["total_files"] += 1
+        for spec in specs:
+            status = result.get(spec["kind"])
+            if status == RESULT_GENERATED:
+                image_processing_stats[f"generated_{spec['stat']}"] += 1
+            elif status == RESULT_SKIPPED:
+                image_processing_stats[f"skipped_{spec['stat']}"] += 1
+            elif status == RESULT_ERROR:
+                image_processing_stats["errors"] += 1
+
+# 正在生成的派生图片：{(类型, 原图路径): 生成任务}，同一派生图片同时只生成一次
+_inflight_derivatives = {}
+_inflight_lock = threading.Lock()
+
+class _InflightDerivative:
+    """一个正在生成的派生图片，其他请求等待它完成并共享结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = RESULT_ERROR
+
+def claim_derivatives(file_path, kinds):
+    """登记即将生成的派生图片，返回由调用方负责生成的类型（已在生成中的类型不返回）"""
+    claimed = []
+    with _inflight_lock:
+        for kind in kinds:
+            key = (kind, file_path)
+            if key not in _inflight_derivatives:
+                _inflight_derivatives[key] = _InflightDerivative()
+                claimed.append(kind)
+    return claimed
+
+def release_derivatives(file_path, kinds, results):
+    """生成结束，记录结果并唤醒等待同一派生图片的请求"""
+    with _inflight_lock:
+        tasks = [(_inflight_derivatives.pop((kind, file_path), None), results.get(kind, RESULT_ERROR)) for kind in kinds]
+    for task, result in tasks:
+        if task is not None:
+            task.result = result
+            task.done.set()
+
+def is_derivative_in_flight(file_path, kind):
+    """派生图片是否正在生成"""
+    with _inflight_lock:
+        return (kind, file_path) in _inflight_derivatives
+
+def generate_derivative_once(file_path, kind):
+    """生成单个派生图片；已有请求或预生成任务在生成同一派生图片时，等待其完成并返回相同结果"""
+    if claim_derivatives(file_path, [kind]):
+        results = {}
+        try:
+            results = generate_derivatives(file_path, [kind])
+        finally:
+            release_derivatives(file_path, [kind], results)
+        return results[kind]
+    
+    with _inflight_lock:
+        task = _inflight_derivatives.get((kind, file_path))
+    if task is None:
+        # 刚刚生成完成，重新检查（派生图片已是最新时会直接跳过）
+        return generate_derivative_once(file_path, kind)
+    increment_stat("waited_in_flight")
+    task.done.wait()
+    return task.result
 
 # 配置PIL以更好地处理大图片
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 ImageFile.MAXBLOCK = 2**25  # 增加缓存块大小
 
-def generate_and_save_thumbnail(file_path):
-    """生成并保存指定图片的缩略图到本地（正方形裁剪，优化版）"""
+# 派生图片编码格式对应的Pillow格式名和编码参数
+PIL_SAVE_FORMATS = {FORMAT_JPEG: 'JPEG', FORMAT_WEBP: 'WEBP', FORMAT_AVIF: 'AVIF'}
+ENCODER_OPTIONS = {
+    FORMAT_JPEG: {},
+    FORMAT_WEBP: {"method": 4},
+    FORMAT_AVIF: {"speed": 6}
+}
+
+# 缩放时先按整数倍快速缩小（reduce），剩余部分再用LANCZOS重采样，兼顾速度和质量
+REDUCING_GAP = 3.0
+
+# EXIF 相机型号标签
+EXIF_MODEL = 272
+
+# 缩略图生成方式：full 解码原图；embedded 优先使用原图内嵌的预览图，不够大时再解码原图
+THUMBNAIL_MODE_FULL = 'full'
+THUMBNAIL_MODE_EMBEDDED = 'embedded'
+
+# MPF（多图格式）索引标签，相机的大尺寸预览图以附加图像的形式存放
+MPF_ENTRY_TAG = 0xB002
+# 内嵌预览图与原图宽高比允许的误差（避免使用带黑边的预览图）
+PREVIEW_ASPECT_TOLERANCE = 0.02
+
+# 每像素字节数与JPEG质量的经验对应关系（用于估算第一次编码的质量）
+BYTES_PER_PIXEL_QUALITY = [
+    (1.6, 90),
+    (1.2, 85),
+    (0.9, 80),
+    (0.7, 75),
+    (0.55, 70),
+    (0.45, 65),
+    (0.35, 60),
+    (0.28, 55)
+]
+
+# 按相机型号（或目录）记录最近一次满足大小限制的质量，后续照片通常一次编码即可
+_quality_hints = {}
+# 记录的质量满足限制时再尝试高出的质量档数，避免一张难压缩的照片把同一来源的质量永久拉低
+QUALITY_PROBE_STEP = 5
+_quality_hints_lock = threading.Lock()
+
+def _estimate_quality(pixel_count, max_bytes, min_quality, max_quality):
+    """根据允许的每像素字节数估算JPEG质量"""
+    bytes_per_pixel = max_bytes / max(pixel_count, 1)
+    for threshold, quality in BYTES_PER_PIXEL_QUALITY:
+        if bytes_per_pixel >= threshold:
+            return max(min_quality, min(max_quality, quality))
+    return min_quality
+
+def _encode_image(img, quality, fmt=FORMAT_JPEG, **options):
+    buffer = io.BytesIO()
+    img.save(buffer, PIL_SAVE_FORMATS[fmt], quality=quality, **ENCODER_OPTIONS[fmt], **options)
+    return buffer.getvalue()
+
+def encode_image_to_size(img, max_bytes, hint_key=None, min_quality=50, max_quality=90, fmt=FORMAT_JPEG):
+    """以不超过 max_bytes 的最高质量编码图片（JPEG/WebP/AVIF），返回编码后的字节
+    
+    第一次编码使用同一相机/目录上次成功的质量（没有记录时按每像素字节数估算）；
+    符合大小限制时再试高一档的质量，高一档超过限制则直接采用，否则在剩余质量区间内二分查找。
+    任何质量都超过限制时返回最低质量的编码结果。
+    """
+    # 不同编码格式相同质量下的文件大小不同，分别记录
+    if hint_key is not None:
+        hint_key = (fmt, hint_key)
+    with _quality_hints_lock:
+        guess = _quality_hints.get(hint_key) if hint_key is not None else None
+    from_hint = guess is not None
+    if guess is None:
+        guess = _estimate_quality(img.size[0] * img.size[1], max_bytes, min_quality, max_quality)
+    
+    best_quality, best_data = None, None
+    encoded = {}
+    low, high = min_quality, max_quality
+    quality = guess
+    probing = False
+    while low <= high:
+        data = encoded[quality] = _encode_image(img, quality, fmt)
+        if len(data) <= max_bytes:
+            best_quality, best_data = quality, data
+            low = quality + 1
+            if from_hint:
+                # 上次成功的质量仍然适用，再试高一档
+                from_hint = False
+                probing = True
+                quality = min(quality + QUALITY_PROBE_STEP, high)
+                continue
+        else:
+            high = quality - 1
+            # 高一档超过限制，上次成功的质量已接近最高可用质量，直接采用
+            if probing:
+                break
+        from_hint = False
+        probing = False
+        quality = (low + high) // 2
+    
+    if best_data is None:
+        best_quality = min_quality
+        best_data = encoded.get(min_quality) or _encode_image(img, min_quality, fmt)
+    
+    if hint_key is not None:
+        with _quality_hints_lock:
+            _quality_hints[hint_key] = best_quality
+    return best_data
+
+def _encode_thumbnail(img, source_info, spec):
+    """编码缩略图，优化质量设置"""
+    fmt = spec["format"]
+    if fmt == FORMAT_JPEG:
+        return _encode_image(img, 90, fmt, optimize=True, progressive=True)
+    return _encode_image(img, 80, fmt)
+
+def _encode_viewer_image(img, source_info, spec):
+    """编码浏览用大图，控制文件大小在规格的上限以内"""
+    # 不同尺寸的质量与文件大小关系不同，分别记录
+    hint_key = source_info.get("quality_hint_key")
+    if hint_key is not None and spec["step"] is not None:
+        hint_key = (spec["step"], hint_key)
+    return encode_image_to_size(img, spec["max_file_size"], hint_key=hint_key, fmt=spec["format"])
+
+def _is_derivative_fresh(spec, file_path, file_mtime):
+    """派生图片已存在且不比原图旧"""
+    if spec["packed"]:
+        return is_thumbnail_fresh(file_path, file_mtime)
     try:
-        # 增加文件计数
-        image_processing_stats["total_files"] += 1
+        return os.path.getmtime(spec["get_path"](file_path, create_dir=False)) >= file_mtime
+    except OSError:
+        return False
+
+def _save_derivative(spec, img, file_path, file_mtime, source_info):
+    """编码并保存派生图片
+    
+    打包存储的缩略图追加写入打包文件；其他派生图片先写入临时文件再原子替换，读取方不会看到写了一半的文件。
+    """
+    data = spec["encode"](img, source_info, spec)
+    if spec["packed"]:
+        store_packed_thumbnail(file_path, data, file_mtime)
+        return
+    derivative_path = spec["get_path"](file_path)
+    temp_path = f"{derivative_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, derivative_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def is_format_supported(fmt):
+    """当前Pillow是否支持编码该格式（AVIF需要Pillow 11.2+ 或 pillow-avif-plugin）"""
+    if fmt not in DERIVATIVE_FORMATS:
+        return False
+    Image.init()
+    return PIL_SAVE_FORMATS[fmt] in Image.SAVE
+
+def get_derivative_formats():
+    """需要生成的派生图片编码格式（JPEG始终生成，其他格式按配置启用且当前环境支持时生成）"""
+    formats = [FORMAT_JPEG]
+    for fmt in config.get("derivative_formats", []):
+        if fmt not in formats and is_format_supported(fmt):
+            formats.append(fmt)
+    return formats
+
+def get_derivative_kind(base_kind, fmt=FORMAT_JPEG, size=None):
+    """派生图片类型名：默认尺寸的JPEG为基本类型（thumbnail / viewer_image），
+    尺寸阶梯中的其他尺寸追加尺寸，其他格式追加格式名，例如 thumbnail_webp、viewer_image_1600_avif
+    """
+    kind = base_kind if not size else f"{base_kind}_{size}"
+    return kind if fmt == FORMAT_JPEG else f"{kind}_{fmt}"
+
+def get_size_steps(base_kind):
+    """派生图片的尺寸阶梯（从小到大）：[(尺寸, 阶梯尺寸)]，默认尺寸的阶梯尺寸为None
+    
+    缩略图在默认尺寸和浏览用大图尺寸之间取阶梯中的尺寸（高分辨率屏幕的缩略图），
+    浏览用大图取阶梯中大于缩略图的尺寸（手机屏幕更小的尺寸、4K屏幕更大的尺寸）。
+    """
+    thumbnail_size = max(config["thumbnail_size"])
+    viewer_max_size = config.get("viewer_image_max_size", 1024)
+    ladder = config.get("derivative_size_ladder", [])
+    if base_kind == "thumbnail":
+        steps = [(thumbnail_size, None)] + [(size, size) for size in ladder if thumbnail_size < size < viewer_max_size]
+    else:
+        steps = [(viewer_max_size, None)] + [(size, size) for size in ladder
+                                             if size > thumbnail_size and size != viewer_max_size]
+    return sorted(set(steps), key=lambda step: step[0])
+
+def snap_to_size_step(base_kind, target_size):
+    """将请求的像素尺寸对应到尺寸阶梯：选择不小于请求尺寸的最小一级（避免放大显示模糊），超过最大一级时使用最大一级
+    
+    返回阶梯尺寸（默认尺寸时为None）。
+    """
+    steps = get_size_steps(base_kind)
+    for size, step in steps:
+        if size >= target_size:
+            return step
+    return steps[-1][1]
+
+# 派生图片规格及参数签名的缓存，影响规格的配置变化时重新生成（照片列表每张照片计算版本号时都会用到）
+_specs_cache = {}
+_specs_cache_lock = threading.Lock()
+
+def _get_specs_config_key():
+    """影响派生图片规格的配置项"""
+    return (tuple(config["thumbnail_size"]),
+            config.get("viewer_image_max_size", 1024),
+            config.get("viewer_image_max_file_size", 1 * 1024 * 1024),
+            tuple(config.get("derivative_formats", [])),
+            tuple(config.get("derivative_size_ladder", [])),
+            config.get("thumbnail_mode", THUMBNAIL_MODE_FULL),
+            config.get("thumbnail_storage"))
+
+def _get_cached_specs():
+    """获取缓存的派生图片规格和参数签名，配置变化后重新生成"""
+    global _specs_cache
+    key = _get_specs_config_key()
+    with _specs_cache_lock:
+        if _specs_cache.get("key") != key:
+            specs = _build_derivative_specs()
+            signatures = {spec["kind"]: f"{spec['kind']}:{spec['params']}" for spec in specs}
+            _specs_cache = {
+                "key": key,
+                "specs": specs,
+                "signatures": signatures,
+                "version_signature": '|'.join(signatures[spec["kind"]] for spec in specs)
+            }
+        return _specs_cache
+
+def get_derivative_specs():
+    """获取派生图片规格，按尺寸从大到小排列（小尺寸从已生成的大尺寸缩小得到）
+    
+    每种启用的编码格式、尺寸阶梯中的每一级各有一份规格。默认尺寸随预生成一起生成，
+    阶梯中的其他尺寸在请求时按需生成（从已生成的更大一级缩小得到）。
+    规格在配置不变时复用，调用方不应修改返回的规格。
+    """
+    return list(_get_cached_specs()["specs"])
+
+def _build_derivative_specs():
+    viewer_max_size = config.get("viewer_image_max_size", 1024)
+    viewer_max_file_size = config.get("viewer_image_max_file_size", 1 * 1024 * 1024)
+    specs = []
+    for fmt in get_derivative_formats():
+        for size, step in get_size_steps("viewer_image"):
+            # 阶梯中其他尺寸的文件大小上限按面积缩放
+            max_file_size = viewer_max_file_size if step is None else int(viewer_max_file_size * (size / viewer_max_size) ** 2)
+            specs.append({
+                "kind": get_derivative_kind("viewer_image", fmt, step),
+                "base_kind": "viewer_image",
+                "format": fmt,
+                "step": step,
+                "pregenerate": step is None,
+                "stat": "viewer_images",
+                "size": (size, size),
+                "square": False,
+                "get_path": functools.partial(get_viewer_image_path, fmt=fmt, size=step),
+                "encode": _encode_viewer_image,
+                "max_file_size": max_file_size,
+                "packed": False,
+                # 影响输出内容的参数，变化后派生图片内容随之变化
+                "params": (size, max_file_size)
+            })
+        for size, step in get_size_steps("thumbnail"):
+            specs.append({
+                "kind": get_derivative_kind("thumbnail", fmt, step),
+                "base_kind": "thumbnail",
+                "format": fmt,
+                "step": step,
+                "pregenerate": step is None,
+                "stat": "thumbnails",
+                "size": tuple(config["thumbnail_size"]) if step is None else (size, size),
+                "square": True,
+                "get_path": functools.partial(get_thumbnail_path, fmt=fmt, size=step),
+                "encode": _encode_thumbnail,
+                "packed": is_packed_format(fmt, step),
+                "params": (tuple(config["thumbnail_size"]) if step is None else (size, size),
+                           config.get("thumbnail_mode", THUMBNAIL_MODE_FULL))
+            })
+    specs.sort(key=lambda spec: max(spec["size"]), reverse=True)
+    return specs
+
+def get_derivative_signature(kind):
+    """派生图片参数签名，用于HTTP缓存校验（参数变化后浏览器缓存失效）"""
+    signature = _get_cached_specs()["signatures"].get(kind)
+    if signature is None:
+        raise ValueError(f"未知的派生图片类型: {kind}")
+    return signature
+
+def get_derivative_version_signature():
+    """所有派生图片参数的组合签名，任一派生图片参数变化时随之变化（用于照片版本号）"""
+    return _get_cached_specs()["version_signature"]
+
+def _get_camera_model(img):
+    """从EXIF中读取相机型号，读取失败时返回None"""
+    try:
+        model = img.getexif().get(EXIF_MODEL)
+    except Exception:
+        return None
+    if isinstance(model, bytes):
+        model = model.decode('ascii', errors='ignore')
+    return model.strip('\x00 ') if model else None
+
+def _open_embedded_preview(img):
+    """读取原图内嵌的预览图（只读取文件头中的数据，不解码原图），返回按尺寸从大到小排列的列表"""
+    previews = []
+    
+    # MPF大尺寸预览图（部分相机在JPEG中附带的VGA/全高清预览）
+    if img.format == 'MPO' and getattr(img, 'n_frames', 1) > 1:
+        try:
+            for index, entry in enumerate(img.mpinfo.get(MPF_ENTRY_TAG, [])):
+                if index > 0 and 'Large Thumbnail' in entry.get('Attribute', {}).get('MPType', ''):
+                    img.seek(index)
+                    previews.append(img.copy())
+        except Exception as e:
+            print(f"[警告] 读取MPF预览图时出错: {str(e)}")
+        finally:
+            img.seek(0)
+    
+    # EXIF缩略图（IFD1中的JPEG数据，通常约160像素）
+    exif_bytes = img.info.get('exif')
+    if exif_bytes:
+        try:
+            thumbnail_data = piexif.load(exif_bytes).get('thumbnail')
+            if thumbnail_data:
+                with Image.open(io.BytesIO(thumbnail_data)) as thumbnail:
+                    thumbnail.load()
+                    previews.append(thumbnail.copy())
+        except Exception as e:
+            print(f"[警告] 读取EXIF缩略图时出错: {str(e)}")
+    
+    previews.sort(key=lambda preview: preview.size[0] * preview.size[1], reverse=True)
+    return previews
+
+def _find_embedded_preview(img, spec):
+    """查找足够大且画面与原图一致的内嵌预览图，没有时返回None"""
+    width, height = img.size
+    for preview in _open_embedded_preview(img):
+        preview_width, preview_height = preview.size
+        if abs(preview_width / preview_height - width / height) > PREVIEW_ASPECT_TOLERANCE * (width / height):
+            continue
+        if not _is_large_enough(preview, spec):
+            continue
+        return preview.convert('RGB') if preview.mode != 'RGB' else preview
+    return None
+
+def _is_large_enough(img, spec):
+    """检查图片是否足够大，可以作为生成该规格派生图片的来源"""
+    if spec["square"]:
+        return min(img.size) >= max(spec["size"])
+    return max(img.size) >= max(spec["size"])
+
+def _get_draft_size(image_size, specs):
+    """计算生成所有派生图片所需的最小解码尺寸，原图不需要缩小时返回None"""
+    width, height = image_size
+    if not width or not height:
+        return None
+    # 所有派生图片中要求最高的缩放比例
+    scale = 0
+    for spec in specs:
+        target = max(spec["size"])
+        reference = min(width, height) if spec["square"] else max(width, height)
+        scale = max(scale, target / reference)
+    if scale >= 1:
+        return None
+    return (math.ceil(width * scale), math.ceil(height * scale))
+
+def _render_derivative(img, spec):
+    """按规格从已解码的图片生成派生图片"""
+    if spec["square"]:
+        # 计算正方形裁剪区域（居中裁剪）
+        width, height = img.size
+        min_dim = min(width, height)
+        left = (width - min_dim) // 2
+        top = (height - min_dim) // 2
+        img = img.crop((left, top, left + min_dim, top + min_dim))
+        # 调整到目标尺寸
+        img.thumbnail(spec["size"], Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        return img
+    
+    # 按比例缩小，使其不超过最大尺寸
+    width, height = img.size
+    max_width, max_height = spec["size"]
+    if width > max_width or height > max_height:
+        ratio = min(max_width / width, max_height / height)
+        # reducing_gap 先用整数倍快速缩小，再用LANCZOS精确缩放
+        img = img.resize((int(width * ratio), int(height * ratio)), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img
+
+def _generate_from_embedded_preview(img, file_path, file_mtime, pending_specs, results):
+    """用内嵌预览图生成缩略图，返回仍需解码原图生成的规格"""
+    remaining_specs = []
+    for spec in pending_specs:
+        preview = _find_embedded_preview(img, spec) if spec["base_kind"] == "thumbnail" else None
+        if preview is None:
+            remaining_specs.append(spec)
+            continue
+        try:
+            _save_derivative(spec, _render_derivative(preview, spec), file_path, file_mtime, {})
+            increment_stat(f"generated_{spec['stat']}")
+            results[spec["kind"]] = RESULT_GENERATED
+        except Exception as e:
+            print(f"[警告] 使用内嵌预览图生成 {file_path} 的缩略图失败，改为解码原图: {str(e)}")
+            remaining_specs.append(spec)
+    return remaining_specs
+
+def _find_larger_step(spec, file_path, file_mtime):
+    """查找可以作为来源的已生成的更大一级派生图片（文件存储、不比原图旧），返回已打开的图片，没有时返回None
+    
+    缩略图也可以从浏览用大图生成（居中裁剪），优先选择尺寸最小的一级，同一尺寸优先JPEG（解码最快）。
+    """
+    candidates = [candidate for candidate in get_derivative_specs()
+                  if not candidate["packed"] and max(candidate["size"]) > max(spec["size"])
+                  and (candidate["base_kind"] == spec["base_kind"] or candidate["base_kind"] == "viewer_image")]
+    candidates.sort(key=lambda candidate: (max(candidate["size"]), candidate["format"] != FORMAT_JPEG))
+    for candidate in candidates:
+        if not _is_derivative_fresh(candidate, file_path, file_mtime):
+            continue
+        try:
+            source = Image.open(candidate["get_path"](file_path, create_dir=False))
+            source.load()
+        except Exception:
+            continue
+        if _is_large_enough(source, spec):
+            return source.convert('RGB') if source.mode != 'RGB' else source
+        source.close()
+    return None
+
+def _generate_from_larger_steps(file_path, file_mtime, pending_specs, results):
+    """尺寸阶梯中按需生成的尺寸从已生成的更大一级缩小得到，返回仍需解码原图生成的规格
+    
+    待生成规格按尺寸从大到小排列，先生成的较大一级可以作为后面较小一级的来源。
+    """
+    remaining_specs = []
+    for spec in pending_specs:
+        source = _find_larger_step(spec, file_path, file_mtime) if not spec["pregenerate"] else None
+        if source is None:
+            remaining_specs.append(spec)
+            continue
+        try:
+            _save_derivative(spec, _render_derivative(source, spec), file_path, file_mtime, {})
+            increment_stat(f"generated_{spec['stat']}")
+            results[spec["kind"]] = RESULT_GENERATED
+        except Exception as e:
+            print(f"[警告] 从更大尺寸生成 {file_path} 的{spec['kind']}失败，改为解码原图: {str(e)}")
+            remaining_specs.append(spec)
+        finally:
+            source.close()
+    return remaining_specs
+
+def get_missing_derivative_kinds(file_path, file_mtime=None):
+    """返回不存在或比原图旧、需要重新生成的派生图片类型（只包括预生成的默认尺寸）"""
+    if file_mtime is None:
+        file_mtime = os.path.getmtime(file_path)
+    return [spec["kind"] for spec in get_derivative_specs()
+            if spec["pregenerate"] and not _is_derivative_fresh(spec, file_path, file_mtime)]
+
+def generate_derivatives(file_path, kinds=None):
+    """一次解码原图，生成所需的全部派生图片（缩略图、浏览用大图等）
+    
+    已是最新的派生图片会跳过；需要生成的派生图片按尺寸从大到小依次生成，
+    较小的派生图片从已生成的较大中间图缩小得到，而不是再次处理原图。
+    返回 {派生图片类型: 生成结果}。
+    """
+    results = {}
+    # 未指定类型时只生成默认尺寸（尺寸阶梯中的其他尺寸按需生成）
+    specs = [spec for spec in get_derivative_specs() if (spec["pregenerate"] if kinds is None else spec["kind"] in kinds)]
+    
+    # 增加文件计数
+    increment_stat("total_files")
+    
+    try:
+        file_mtime = os.path.getmtime(file_path)
+        pending_specs = []
+        for spec in specs:
+            # 派生图片已存在且不比原图旧，不需要重新生成
+            if _is_derivative_fresh(spec, file_path, file_mtime):
+                increment_stat(f"skipped_{spec['stat']}")
+                results[spec["kind"]] = RESULT_SKIPPED
+            else:
+                pending_specs.append(spec)
         
-        # 获取缩略图存储路径（按照原目录结构组织）
-        thumbnail_path = get_thumbnail_path(file_path)
+        if not pending_specs:
+            return results
         
-        # 检查缩略图是否已存在
-        if os.path.exists(thumbnail_path):
-            # 检查缩略图是否比原图旧
-            thumbnail_mtime = os.path.getmtime(thumbnail_path)
-            file_mtime = os.path.getmtime(file_path)
-            
-            if thumbnail_mtime >= file_mtime:
-                # 缩略图是最新的，不需要重新生成
-                image_processing_stats["skipped_thumbnails"] += 1
-                return
-            else:
-                # 缩略图需要更新
-                image_processing_stats["generated_thumbnails"] += 1
-        else:
-            # 缩略图不存在，需要创建
-            image_processing_stats["generated_thumbnails"] += 1
+        # 尺寸阶梯中按需生成的尺寸，优先从已生成的更大一级派生图片缩小得到，不需要解码原图
+        pending_specs = _generate_from_larger_steps(file_path, file_mtime, pending_specs, results)
+        if not pending_specs:
+            return results
         
-        # 生成缩略图
         with Image.open(file_path) as img:
-            # 转换为RGB模式（处理透明度）
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # 获取原图尺寸
-            width, height = img.size
-            
-            # 针对超大图（超过4000x4000像素），先进行一次快速缩小，减少内存占用
-            if width > 4000 or height > 4000:
-                # 先按比例缩小到4000像素
-                scale_factor = 4000 / max(width, height)
-                new_size = (int(width * scale_factor), int(height * scale_factor))
-                # 使用LANCZOS重采样方法，平衡质量和速度
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-                width, height = new_size
-            
-            # 计算正方形裁剪区域（居中裁剪）
-            min_dim = min(width, height)
-            left = (width - min_dim) // 2
-            top = (height - min_dim) // 2
-            right = left + min_dim
-            bottom = top + min_dim
-            
-            # 裁剪成正方形
-            img = img.crop((left, top, right, bottom))
-            
-            # 调整到目标尺寸，使用更高效的重采样方法
-            img.thumbnail(config["thumbnail_size"], Image.Resampling.LANCZOS)
+            # 内嵌预览图模式：预览图足够大时直接生成缩略图，不需要解码原图
+            if config.get("thumbnail_mode", THUMBNAIL_MODE_FULL) == THUMBNAIL_MODE_EMBEDDED:
+                pending_specs = _generate_from_embedded_preview(img, file_path, file_mtime, pending_specs, results)
+                if not pending_specs:
+                    return results
             
-            # 保存到本地文件，优化质量设置
-            img.save(thumbnail_path, 'JPEG', quality=90, optimize=True, progressive=True)
+            # JPEG按所需的最小尺寸进行DCT缩放解码（1/2、1/4、1/8），大幅减少解码时间和内存占用
+            draft_size = _get_draft_size(img.size, pending_specs)
+            if draft_size is not None:
+                img.draft('RGB', draft_size)
             
-    except Exception as e:
-        image_processing_stats["errors"] += 1
-        print(f"[错误] 生成缩略图 {file_path} 时出错: {str(e)}")
-
-def generate_and_save_viewer_image(file_path):
-    """生成并保存指定图片的浏览用大图到本地（控制在1MB以内）"""
-    try:
-        # 获取浏览用大图存储路径（按照原目录结构组织）
-        viewer_image_path = get_viewer_image_path(file_path)
-        
-        # 检查浏览用大图是否已存在
-        if os.path.exists(viewer_image_path):
-            # 检查浏览用大图是否比原图旧
-            viewer_image_mtime = os.path.getmtime(viewer_image_path)
-            file_mtime = os.path.getmtime(file_path)
+            # 同一相机（没有相机信息时同一目录）的照片编码特性相近，共享质量记录
+            source_info = {"quality_hint_key": _get_camera_model(img) or os.path.dirname(file_path)}
             
-            if viewer_image_mtime >= file_mtime:
-                # 浏览用大图是最新的，不需要重新生成
-                image_processing_stats["skipped_viewer_images"] += 1
-                return
-            else:
-                # 浏览用大图需要更新
-                image_processing_stats["generated_viewer_images"] += 1
-        else:
-            # 浏览用大图不存在，需要创建
-            image_processing_stats["generated_viewer_images"] += 1
-        
-        # 生成浏览用大图
-        with Image.open(file_path) as img:
             # 转换为RGB模式（处理透明度）
             if img.mode != 'RGB':
                 img = img.convert('RGB')
             
-            # 获取原图尺寸
-            width, height = img.size
-            
-            # 调整图片尺寸，使其不超过最大尺寸
-            max_size = config.get("viewer_image_max_size", 1024)
-            if width > max_size or height > max_size:
-                # 计算缩放比例
-                ratio = min(max_size / width, max_size / height)
-                new_width = int(width * ratio)
-                new_height = int(height * ratio)
-                # 调整尺寸
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # 保存到本地文件，控制文件大小在1MB以内
-            max_file_size = config.get("viewer_image_max_file_size", 1 * 1024 * 1024)
-            
-            # 尝试不同的质量值，直到文件大小符合要求
-            quality = 90
-            while quality > 50:
-                # 先保存到内存中，检查大小
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, 'JPEG', quality=quality)
-                img_byte_arr.seek(0)
-                
-                # 检查文件大小
-                if len(img_byte_arr.getvalue()) <= max_file_size:
-                    # 文件大小符合要求，保存到磁盘
-                    with open(viewer_image_path, 'wb') as f:
-                        f.write(img_byte_arr.getvalue())
-                    break
-                
-                # 文件大小超过限制，降低质量
-                quality -= 5
-            else:
-                # 如果质量降到50以下还是超过大小限制，就直接保存当前质量
-                img.save(viewer_image_path, 'JPEG', quality=50)
-            
+            # 已生成的完整画面中间图（从大到小），用于生成更小的派生图片
+            intermediates = [img]
+            for spec in pending_specs:
+                try:
+                    # 选择足够大的最小中间图作为来源
+                    source = next((candidate for candidate in reversed(intermediates) if _is_large_enough(candidate, spec)), img)
+                    derivative = _render_derivative(source, spec)
+                    _save_derivative(spec, derivative, file_path, file_mtime, source_info)
+                    if not spec["square"]:
+                        intermediates.append(derivative)
+                    increment_stat(f"generated_{spec['stat']}")
+                    results[spec["kind"]] = RESULT_GENERATED
+                except Exception as e:
+                    increment_stat("errors")
+                    print(f"[错误] 生成{spec['kind']} {file_path} 时出错: {str(e)}")
+                    results[spec["kind"]] = RESULT_ERROR
     except Exception as e:
-        image_processing_stats["errors"] += 1
-        print(f"[错误] 生成浏览用大图 {file_path} 时出错: {str(e)}")
+        print(f"[错误] 处理图片 {file_path} 时出错: {str(e)}")
+        for spec in specs:
+            if spec["kind"] not in results:
+                increment_stat("errors")
+                results[spec["kind"]] = RESULT_ERROR
+    
+    return results
+
+def generate_and_save_thumbnail(file_path, fmt=FORMAT_JPEG, size=None):
+    """生成并保存指定图片的缩略图到本地（正方形裁剪），并发请求同一缩略图时只生成一次"""
+    return generate_derivative_once(file_path, get_derivative_kind("thumbnail", fmt, size))
+
+def generate_and_save_viewer_image(file_path, fmt=FORMAT_JPEG, size=None):
+    """生成并保存指定图片的浏览用大图到本地（控制在1MB以内），并发请求同一大图时只生成一次"""
+    return generate_derivative_once(file_path, get_derivative_kind("viewer_image", fmt, size))
+
+def pregenerate_file(file_path, kinds=None):
+    """为单个文件生成缩略图和浏览用大图（在预生成工作进程中执行），返回各派生图片的生成结果"""
+    results = generate_derivatives(file_path, kinds)
+    results["path"] = file_path
+    return results
+
+def print_pregeneration_stats(prefix):
+    """输出预生成统计信息"""
+    stats = get_image_processing_stats()
+    print(f"[{prefix}] 图片预生成完成，共处理 {stats['total_files']} 个文件")
+    print(f"[统计信息] 生成缩略图: {stats['generated_thumbnails']}, 跳过缩略图: {stats['skipped_thumbnails']}")
+    print(f"[统计信息] 生成浏览图: {stats['generated_viewer_images']}, 跳过浏览图: {stats['skipped_viewer_images']}")
+    if stats['errors'] > 0:
+        print(f"[统计信息] 处理错误: {stats['errors']}")
 
 def pregenerate_images():
-    """服务端启动时预生成所有照片的缩略图和浏览用大图并保存到本地"""
+    """服务端启动时预生成所有照片的缩略图和浏览用大图并保存到本地（多进程并行）"""
+    from utils.pregeneration import get_pregeneration_engine, PRIORITY_SWEEP
     print(f"[服务启动] 开始预生成图片...")
     
     # 重置统计计数器
-    image_processing_stats.update({
-        "total_files": 0,
-        "generated_thumbnails": 0,
-        "skipped_thumbnails": 0,
-        "generated_viewer_images": 0,
-        "skipped_viewer_images": 0,
-        "errors": 0
-    })
-    
-    # 使用集合来跟踪已经处理过的文件路径，避免重复处理
-    processed_files = set()
-    
-    # 遍历所有配置的目录
-    for directory in config["photo_directories"]:
-        if not os.path.isdir(directory):
-            continue
-            
-        try:
-            # 获取目录中的所有图片文件
-            for filename in os.listdir(directory):
-                file_path = os.path.join(directory, filename)
-                if os.path.isfile(file_path) and os.path.splitext(filename)[1].lower() in config['supported_formats']:
-                    # 检查文件是否已经处理过
-                    if file_path not in processed_files:
-                        # 添加到已处理集合
-                        processed_files.add(file_path)
-                        # 生成并保存缩略图
-                        generate_and_save_thumbnail(file_path)
-                        # 生成并保存浏览用大图
-                        generate_and_save_viewer_image(file_path)
-        except Exception as e:
-            print(f"[错误] 处理目录 {directory} 时出错: {str(e)}")
+    reset_image_processing_stats()
+    
+    engine = get_pregeneration_engine()
+    file_paths = []
+    for directory in list(config["photo_directories"]):
+        file_paths.extend(engine.submit_directory(directory, PRIORITY_SWEEP))
+    engine.wait_until_idle(file_paths)
     
     # 输出统计信息
-    print(f"[服务启动] 图片预生成完成，共处理 {len(processed_files)} 个文件")
-    print(f"[统计信息] 生成缩略图: {image_processing_stats['generated_thumbnails']}, 跳过缩略图: {image_processing_stats['skipped_thumbnails']}")
-    print(f"[统计信息] 生成浏览图: {image_processing_stats['generated_viewer_images']}, 跳过浏览图: {image_processing_stats['skipped_viewer_images']}")
-    if image_processing_stats['errors'] > 0:
-        print(f"[统计信息] 处理错误: {image_processing_stats['errors']}")
\ No newline at end of file
+    print_pregeneration_stats("服务启动")
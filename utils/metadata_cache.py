@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import piexif
+from data.config_manager import config
+
+# 支持读取EXIF的文件格式
+EXIF_FORMATS = ('.jpg', '.jpeg', '.tiff', '.tif')
+
+# 需要格式化的EXIF分组：(返回结果中的键, piexif.load结果中的IFD名称, TAGS中的分组)
+EXIF_GROUPS = (
+    ('image', '0th', 'Image'),
+    ('exif', 'Exif', 'Exif'),
+    ('gps', 'GPS', 'GPS')
+)
+
+# 解析后的元数据（最近使用的在末尾）：原图路径 -> (文件大小, 修改时间, 元数据)
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+metadata_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _format_value(value):
+    # 转换字节类型的值为字符串
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8', errors='replace')
+        except Exception:
+            return str(value)
+    return value
+
+
+def _format_exif(exif_data):
+    """把EXIF标签编号转换为标签名"""
+    formatted_exif = {}
+    for key, ifd, tag_group in EXIF_GROUPS:
+        values = exif_data.get(ifd)
+        if not values:
+            continue
+        tags = piexif.TAGS[tag_group]
+        formatted_exif[key] = {
+            (tags[tag]['name'] if tag in tags else str(tag)): _format_value(value)
+            for tag, value in values.items()
+        }
+    return formatted_exif
+
+
+def read_photo_metadata(file_path, file_stats):
+    """读取照片的文件信息和EXIF数据（不含星级，星级随时可能修改，返回时再添加）"""
+    metadata = {
+        "basic": {
+            "name": os.path.basename(file_path),
+            "path": file_path,
+            "size": file_stats.st_size,
+            "created": datetime.fromtimestamp(file_stats.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
+            "modified": datetime.fromtimestamp(file_stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            "accessed": datetime.fromtimestamp(file_stats.st_atime).strftime('%Y-%m-%d %H:%M:%S')
+        },
+        "exif": {}
+    }
+
+    # 先检查文件是否为JPEG或TIFF格式，只有这些格式支持EXIF
+    if os.path.splitext(file_path)[1].lower() in EXIF_FORMATS:
+        try:
+            metadata['exif'] = _format_exif(piexif.load(file_path))
+        except Exception as e:
+            print(f"[错误] 读取 {file_path} 的EXIF数据时出错: {str(e)}")
+            metadata['exif_error'] = str(e)
+    return metadata
+
+
+def get_cached_metadata(file_path, file_stats=None):
+    """获取照片元数据，文件大小和修改时间未变化时直接使用缓存的解析结果
+
+    调用方已经stat过文件时传入 file_stats，避免重复访问文件系统。
+    缓存按最近使用淘汰，条目数上限由 metadata_cache_entries 配置。
+    """
+    if file_stats is None:
+        file_stats = os.stat(file_path)
+    with _metadata_cache_lock:
+        entry = _metadata_cache.get(file_path)
+        if entry is not None and entry[0] == file_stats.st_size and entry[1] == file_stats.st_mtime:
+            _metadata_cache.move_to_end(file_path)
+            metadata_cache_stats["hits"] += 1
+            return entry[2]
+        metadata_cache_stats["misses"] += 1
+
+    metadata = read_photo_metadata(file_path, file_stats)
+
+    max_entries = config.get("metadata_cache_entries", 2000)
+    if max_entries > 0:
+        with _metadata_cache_lock:
+            _metadata_cache[file_path] = (file_stats.st_size, file_stats.st_mtime, metadata)
+            _metadata_cache.move_to_end(file_path)
+            while len(_metadata_cache) > max_entries:
+                _metadata_cache.popitem(last=False)
+                metadata_cache_stats["evictions"] += 1
+    return metadata
+
+
+def get_metadata_cache_status():
+    """元数据缓存的命中统计"""
+    with _metadata_cache_lock:
+        status = dict(metadata_cache_stats)
+        status["entries"] = len(_metadata_cache)
+    lookups = status["hits"] + status["misses"]
+    status["hit_rate"] = round(status["hits"] / lookups, 4) if lookups else 0.0
+    status["max_entries"] = config.get("metadata_cache_entries", 2000)
+    return status
@@ -0,0 +1,341 @@
+import atexit
+import heapq
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from data import photo_catalog
+from data.config_manager import config
+from utils.catalog_scanner import ensure_directory_scanned
+from utils.image_processor import (pregenerate_file, record_pregeneration_result, get_image_processing_stats,
+                                   get_derivative_specs, get_missing_derivative_kinds,
+                                   claim_derivatives, release_derivatives,
+                                   RESULT_ERROR, RESULT_SKIPPED)
+
+
+# 任务优先级（数值越小越优先）
+PRIORITY_INTERACTIVE = 0   # 页面正在等待的派生图片
+PRIORITY_VIEWPORT = 1      # 当前浏览目录中缺少派生图片的照片
+PRIORITY_NEW_DIRECTORY = 2 # 新添加的目录
+PRIORITY_SWEEP = 3         # 全部目录的后台预生成
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_VIEWPORT: "viewport",
+    PRIORITY_NEW_DIRECTORY: "new_directory",
+    PRIORITY_SWEEP: "sweep"
+}
+
+
+class PregenerationEngine:
+    """多进程预生成引擎：按优先级排序的有界工作队列 + 进程池，单个文件出错不影响其他文件
+
+    后台任务（新目录、全部目录预生成）在有页面请求正在生成图片时暂停分发，
+    同一文件以更高优先级重新提交时会提前处理。
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or config.get('pregeneration_workers') or os.cpu_count() or 1
+        self.queue_size = queue_size or config.get('pregeneration_queue_size', 256)
+        # 同时提交给进程池的任务数量上限，避免进程池内部队列无限增长
+        self.slots = threading.BoundedSemaphore(self.workers * 2)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        # 工作队列有新任务、有空位或页面请求结束时通知
+        self.changed = threading.Condition(self.lock)
+        # 优先级堆：(优先级, 提交序号, 文件路径)；文件提高优先级后旧的条目作废
+        self.heap = []
+        self.sequence = 0
+        # 已排队或正在处理的文件 -> 当前优先级，避免重复处理
+        self.pending = {}
+        # 已提交给进程池的文件
+        self.running = set()
+        # 正在生成图片的页面请求数量
+        self.interactive_requests = 0
+        self.completed = 0
+        self.failed = 0
+        # 等待指定文件处理完成的调用：{标记: 尚未处理完的文件集合}
+        self.waiting = {}
+        self.executor = None
+        self.dispatcher = None
+        # 进程退出时停止分发，不再向进程池提交任务
+        self.stopped = False
+
+    def _ensure_started(self):
+        """首次提交任务时启动分发线程"""
+        with self.lock:
+            if self.dispatcher is None:
+                self.dispatcher = threading.Thread(target=self._dispatch_loop)
+                self.dispatcher.daemon = True
+                self.dispatcher.start()
+                atexit.register(self.shutdown)
+                print(f"[预生成] 预生成引擎已启动，工作进程数: {self.workers}")
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def _reset_executor(self):
+        """进程池损坏（如工作进程崩溃）时丢弃，下次提交时重新创建"""
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _queued_count(self):
+        return len(self.pending) - len(self.running)
+
+    def _drop_lowest_priority(self, priority):
+        """队列已满时丢弃一个排队中的文件，为当前浏览的照片腾出位置，成功时返回True
+
+        优先丢弃比新任务优先级低的文件中最后提交的；没有时丢弃最早提交的同优先级文件（用户已经翻过的页面）。
+        被丢弃的后台任务之后由页面请求按需生成。
+        """
+        lower = None
+        oldest_same = None
+        for entry in self.heap:
+            entry_priority, sequence, file_path = entry
+            if self.pending.get(file_path) != entry_priority or file_path in self.running:
+                continue
+            if entry_priority > priority:
+                if lower is None or entry[:2] > lower[:2]:
+                    lower = entry
+            elif entry_priority == priority and (oldest_same is None or sequence < oldest_same[1]):
+                oldest_same = entry
+        victim = lower or oldest_same
+        if victim is None:
+            return False
+        # 堆中的条目在取出时因与pending不一致而被丢弃
+        del self.pending[victim[2]]
+        self._discard_waiting(victim[2])
+        return True
+
+    def _discard_waiting(self, file_path):
+        """文件处理完成或被丢弃，唤醒等待它的调用（调用方持有锁）"""
+        if self.waiting:
+            for remaining in self.waiting.values():
+                remaining.discard(file_path)
+            self.idle.notify_all()
+
+    def _compact_heap(self):
+        """作废的条目（已提高优先级或被丢弃的文件）过多时重建堆，保证堆的大小有界"""
+        if len(self.heap) > 2 * (self.queue_size + len(self.running)):
+            self.heap = [entry for entry in self.heap
+                         if self.pending.get(entry[2]) == entry[0] and entry[2] not in self.running]
+            heapq.heapify(self.heap)
+
+    def submit_files(self, file_paths, priority=PRIORITY_SWEEP):
+        """按优先级提交文件到工作队列
+
+        后台任务在队列已满时阻塞；当前浏览的照片在队列已满时丢弃优先级最低的排队文件，保证队列长度有界；
+        页面正在等待的任务不受限制。已排队的文件以更高优先级提交时提前处理。
+        """
+        self._ensure_started()
+        submitted = 0
+        with self.changed:
+            for file_path in file_paths:
+                if self.stopped:
+                    break
+                current = self.pending.get(file_path)
+                if current is not None and (current <= priority or file_path in self.running):
+                    continue
+                if current is None and priority >= PRIORITY_NEW_DIRECTORY:
+                    while self._queued_count() >= self.queue_size and not self.stopped:
+                        self.changed.wait()
+                    # 等待期间可能已被其他请求提交，或进程正在退出
+                    if file_path in self.pending or self.stopped:
+                        continue
+                elif current is None and priority == PRIORITY_VIEWPORT:
+                    if self._queued_count() >= self.queue_size and not self._drop_lowest_priority(priority):
+                        continue
+                self.pending[file_path] = priority
+                self.sequence += 1
+                heapq.heappush(self.heap, (priority, self.sequence, file_path))
+                submitted += 1
+                self.changed.notify_all()
+            self._compact_heap()
+        return submitted
+
+    def submit_directory(self, directory, priority=PRIORITY_SWEEP):
+        """提交目录及其所有子目录中的图片，返回目录中的文件路径（用于等待这些文件处理完成）"""
+        if not os.path.isdir(directory):
+            print(f"[错误] 目录不存在: {directory}")
+            return []
+        ensure_directory_scanned(directory)
+        file_paths = [row['path'] for row in photo_catalog.query_photos(directory)]
+        submitted = self.submit_files(file_paths, priority)
+        print(f"[预生成] 目录 {directory} 提交了 {submitted} 个文件（优先级: {PRIORITY_NAMES[priority]}）")
+        return file_paths
+
+    def prioritize_photos(self, photos):
+        """将缺少派生图片的照片提到队列前面（照片信息包含path，目录库记录还包含mtime）
+
+        调用方只传入当前页面的照片，队列已满时丢弃优先级最低的排队文件。
+        """
+        file_paths = []
+        for photo in photos:
+            try:
+                if get_missing_derivative_kinds(photo['path'], photo.get('mtime')):
+                    file_paths.append(photo['path'])
+            except OSError:
+                continue
+        if not file_paths:
+            return 0
+        return self.submit_files(file_paths, PRIORITY_VIEWPORT)
+
+    @contextmanager
+    def interactive(self):
+        """标记页面请求正在生成图片，期间后台任务暂停分发"""
+        with self.changed:
+            self.interactive_requests += 1
+        try:
+            yield
+        finally:
+            with self.changed:
+                self.interactive_requests -= 1
+                self.changed.notify_all()
+
+    def _next_file(self):
+        """取出优先级最高的文件；有页面请求正在生成图片时，后台任务等待。引擎已停止时返回None"""
+        with self.changed:
+            while True:
+                if self.stopped:
+                    return None
+                # 丢弃作废的条目（已提高优先级、已被丢弃或同一文件重复提交后已在处理中）
+                while self.heap and (self.pending.get(self.heap[0][2]) != self.heap[0][0]
+                                     or self.heap[0][2] in self.running):
+                    heapq.heappop(self.heap)
+                if self.heap:
+                    priority, _, file_path = self.heap[0]
+                    if priority < PRIORITY_NEW_DIRECTORY or self.interactive_requests == 0:
+                        heapq.heappop(self.heap)
+                        self.running.add(file_path)
+                        self.changed.notify_all()
+                        return file_path
+                self.changed.wait()
+
+    def _dispatch_loop(self):
+        """分发线程：进程池有空位时，取出优先级最高的文件提交给进程池"""
+        while True:
+            # 先等待空位再取任务，保证取出的总是此刻优先级最高的文件
+            self.slots.acquire()
+            file_path = self._next_file()
+            if file_path is None:
+                self.slots.release()
+                return
+            # 跳过正在由页面请求生成的派生图片，其余的登记为生成中
+            all_kinds = [spec["kind"] for spec in get_derivative_specs() if spec["pregenerate"]]
+            kinds = claim_derivatives(file_path, all_kinds)
+            if not kinds:
+                self._finish(file_path, kinds, {"path": file_path, **{kind: RESULT_SKIPPED for kind in all_kinds}}, None)
+                continue
+            try:
+                future = self._get_executor().submit(pregenerate_file, file_path, kinds)
+            except (BrokenProcessPool, RuntimeError) as e:
+                print(f"[警告] 预生成进程池不可用，重新创建: {str(e)}")
+                self._reset_executor()
+                try:
+                    future = self._get_executor().submit(pregenerate_file, file_path, kinds)
+                except Exception as retry_error:
+                    self._finish(file_path, kinds, None, retry_error)
+                    # 新建的进程池也无法提交（进程正在退出），停止分发，避免对排队的文件逐个重建进程池
+                    print(f"[预生成] 无法创建预生成进程池，停止预生成")
+                    self.shutdown()
+                    return
+            future.add_done_callback(lambda f, path=file_path, kinds=kinds: self._on_done(path, kinds, f))
+
+    def _on_done(self, file_path, kinds, future):
+        try:
+            result = future.result()
+            error = None
+        except BrokenProcessPool as e:
+            result, error = None, e
+            self._reset_executor()
+        except Exception as e:
+            result, error = None, e
+        self._finish(file_path, kinds, result, error)
+
+    def _finish(self, file_path, kinds, result, error):
+        """记录单个文件的处理结果，并唤醒等待这些派生图片的页面请求"""
+        if error is not None:
+            print(f"[错误] 预生成 {file_path} 时出错: {str(error)}")
+            result = {"path": file_path, "thumbnail": RESULT_ERROR}
+        release_derivatives(file_path, kinds, result)
+        record_pregeneration_result(result)
+        with self.lock:
+            self.pending.pop(file_path, None)
+            self.running.discard(file_path)
+            self.completed += 1
+            if error is not None or RESULT_ERROR in (result.get(kind) for kind in kinds):
+                self.failed += 1
+            self._discard_waiting(file_path)
+            if not self.pending:
+                self.idle.notify_all()
+            self.changed.notify_all()
+        self.slots.release()
+
+    def wait_until_idle(self, file_paths=None):
+        """等待文件处理完成：指定文件时只等待这些文件，不受其他任务提交的文件影响；不指定时等待所有已提交的文件
+
+        被当前浏览的照片挤出队列的文件不再等待（之后由页面请求按需生成），引擎停止时立即返回。
+        """
+        with self.idle:
+            if file_paths is None:
+                while self.pending and not self.stopped:
+                    self.idle.wait()
+                return
+            remaining = {file_path for file_path in file_paths if file_path in self.pending}
+            token = object()
+            self.waiting[token] = remaining
+            try:
+                while remaining and not self.stopped:
+                    self.idle.wait()
+            finally:
+                del self.waiting[token]
+
+    def shutdown(self):
+        """停止分发并关闭进程池（进程退出时调用），排队中的文件不再处理"""
+        with self.changed:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.changed.notify_all()
+            self.idle.notify_all()
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_status(self):
+        """获取引擎状态和统计数据"""
+        with self.lock:
+            queued_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+            for file_path, priority in self.pending.items():
+                if file_path not in self.running:
+                    queued_by_priority[PRIORITY_NAMES[priority]] += 1
+            status = {
+                "workers": self.workers,
+                "queued": self._queued_count(),
+                "queued_by_priority": queued_by_priority,
+                "running": len(self.running),
+                "interactive_requests": self.interactive_requests,
+                "pending": len(self.pending),
+                "completed": self.completed,
+                "failed": self.failed
+            }
+        status["stats"] = get_image_processing_stats()
+        return status
+
+
+# 全局预生成引擎（首次使用时创建）
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_pregeneration_engine():
+    """获取全局预生成引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PregenerationEngine()
+        return _engine
@@ -0,0 +1,208 @@
+import atexit
+import os
+import re
+import threading
+import time
+import piexif
+from data.config_manager import config
+
+# 支持将星级写入EXIF的文件格式
+EXIF_RATING_FORMATS = ('.jpg', '.jpeg', '.tiff', '.tif')
+
+# 写回方式：exif 写入原图的EXIF；xmp 写入同名的XMP附属文件（不改写原图）；none 不写回
+WRITEBACK_MODES = ('exif', 'xmp', 'none')
+
+# Windows资源管理器使用的星级百分比
+RATING_PERCENT = {0: 0, 1: 1, 2: 25, 3: 50, 4: 75, 5: 99}
+
+XMP_SIDECAR_TEMPLATE = '''<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmp:Rating="{rating}"/>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>
+'''
+XMP_NAMESPACE = 'http://ns.adobe.com/xap/1.0/'
+XMP_RATING_ATTRIBUTE = re.compile(r'xmp:Rating\s*=\s*(?:"[^"]*"|\'[^\']*\')')
+XMP_RATING_ELEMENT = re.compile(r'<xmp:Rating>[^<]*</xmp:Rating>')
+# rdf:Description 开始标签：标签名和其余属性
+XMP_DESCRIPTION = re.compile(r'(<rdf:Description)\b([^>]*)')
+XMP_NAMESPACE_DECLARATION = re.compile(r'\sxmlns:xmp\s*=')
+
+# 等待写回的评分：路径 -> (星级, 写回时间)；同一文件在等待期间再次修改时只保留最后一次并重新计时
+_pending = {}
+_pending_condition = threading.Condition()
+_writer_thread = None
+
+# 写回状态（与等待队列使用同一把锁读写）
+writeback_status = {
+    "written": 0,
+    "coalesced": 0,
+    "failed": 0,
+    "last_written": None,
+    "recent_errors": []
+}
+MAX_RECENT_ERRORS = 20
+
+
+def get_writeback_mode():
+    mode = config.get("rating_writeback_mode", "exif")
+    return mode if mode in WRITEBACK_MODES else "exif"
+
+
+def supports_exif_rating(file_path):
+    return os.path.splitext(file_path)[1].lower() in EXIF_RATING_FORMATS
+
+
+def get_xmp_sidecar_path(file_path):
+    """XMP附属文件路径（与原图同名，扩展名为.xmp，与Lightroom等软件的约定一致）"""
+    return os.path.splitext(file_path)[0] + '.xmp'
+
+
+def write_rating_to_exif(file_path, rating):
+    """将星级写入照片的EXIF数据（Rating是0-5的整数值，直接对应我们的评分系统）"""
+    # 读取当前EXIF数据
+    exif_dict = piexif.load(file_path)
+
+    # 设置星级评分（Rating和RatingPercent标签位于第0个IFD）
+    exif_dict['0th'][piexif.ImageIFD.Rating] = rating
+    exif_dict['0th'][piexif.ImageIFD.RatingPercent] = RATING_PERCENT[rating]
+
+    # 将更新后的EXIF数据写入文件
+    exif_bytes = piexif.dump(exif_dict)
+    piexif.insert(exif_bytes, file_path)
+
+
+def write_rating_to_xmp(file_path, rating):
+    """将星级写入XMP附属文件：已有附属文件时只替换其中的星级，否则新建（几百字节，不改写原图）"""
+    sidecar_path = get_xmp_sidecar_path(file_path)
+    content = None
+    if os.path.exists(sidecar_path):
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if XMP_RATING_ATTRIBUTE.search(content):
+            content = XMP_RATING_ATTRIBUTE.sub(f'xmp:Rating="{rating}"', content, count=1)
+        elif XMP_RATING_ELEMENT.search(content):
+            content = XMP_RATING_ELEMENT.sub(f'<xmp:Rating>{rating}</xmp:Rating>', content, count=1)
+        else:
+            # 没有星级时加在第一个 rdf:Description 上；Lightroom等软件写入的描述通常已经声明了xmp命名空间，不能重复声明
+            match = XMP_DESCRIPTION.search(content)
+            if match:
+                attributes = f' xmp:Rating="{rating}"'
+                if not XMP_NAMESPACE_DECLARATION.search(match.group(2)):
+                    attributes = f' xmlns:xmp="{XMP_NAMESPACE}"' + attributes
+                content = content[:match.end(1)] + attributes + content[match.end(1):]
+            else:
+                content = None
+    if content is None:
+        content = XMP_SIDECAR_TEMPLATE.format(rating=rating)
+
+    # 先写入临时文件再替换，避免写入中断留下不完整的附属文件
+    temp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temp_path, sidecar_path)
+
+
+def write_rating(file_path, rating, mode=None):
+    """按写回方式写入星级，返回是否写入"""
+    mode = mode or get_writeback_mode()
+    if mode == 'xmp':
+        write_rating_to_xmp(file_path, rating)
+        return True
+    if mode == 'exif' and supports_exif_rating(file_path):
+        write_rating_to_exif(file_path, rating)
+        return True
+    return False
+
+
+def _record_error(file_path, rating, error):
+    with _pending_condition:
+        writeback_status["failed"] += 1
+        recent_errors = writeback_status["recent_errors"]
+        recent_errors.append({
+            "file_path": file_path,
+            "rating": rating,
+            "error": str(error),
+            "time": time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        del recent_errors[:-MAX_RECENT_ERRORS]
+
+
+def _write_pending(file_path, rating):
+    """写入一个评分（在锁外写文件，只在更新状态时加锁）"""
+    try:
+        if write_rating(file_path, rating):
+            with _pending_condition:
+                writeback_status["written"] += 1
+                writeback_status["last_written"] = time.strftime('%Y-%m-%d %H:%M:%S')
+    except Exception as e:
+        print(f"[警告] 写回 {file_path} 的评分时出错: {str(e)}")
+        _record_error(file_path, rating, e)
+
+
+def _writeback_loop():
+    """后台写回线程：评分修改后等待一段时间没有再次修改时才写入文件（连续点击只写一次）"""
+    while True:
+        with _pending_condition:
+            while True:
+                now = time.time()
+                due = [(file_path, rating) for file_path, (rating, due_time) in _pending.items() if due_time <= now]
+                if due:
+                    for file_path, _ in due:
+                        del _pending[file_path]
+                    break
+                timeout = min(due_time for _, due_time in _pending.values()) - now if _pending else None
+                _pending_condition.wait(timeout)
+        for file_path, rating in due:
+            _write_pending(file_path, rating)
+
+
+def flush_rating_writeback():
+    """立即写回所有等待中的评分（进程退出时调用）"""
+    with _pending_condition:
+        pending = [(file_path, rating) for file_path, (rating, _) in _pending.items()]
+        _pending.clear()
+    for file_path, rating in pending:
+        _write_pending(file_path, rating)
+    return len(pending)
+
+
+def queue_rating_writeback(ratings):
+    """批量加入评分写回队列（ratings为 路径 -> 星级），返回加入队列的数量"""
+    global _writer_thread
+    mode = get_writeback_mode()
+    if mode == 'none':
+        return 0
+    queued = {file_path: rating for file_path, rating in ratings.items()
+              if mode == 'xmp' or supports_exif_rating(file_path)}
+    if not queued:
+        return 0
+    due_time = time.time() + config.get("rating_writeback_delay", 5)
+    with _pending_condition:
+        for file_path, rating in queued.items():
+            if file_path in _pending:
+                writeback_status["coalesced"] += 1
+            _pending[file_path] = (rating, due_time)
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writeback_loop)
+            _writer_thread.daemon = True
+            _writer_thread.start()
+            atexit.register(flush_rating_writeback)
+        _pending_condition.notify()
+    return len(queued)
+
+
+def get_writeback_status():
+    """评分写回状态"""
+    with _pending_condition:
+        pending = len(_pending)
+        next_due = min((due_time for _, due_time in _pending.values()), default=None)
+        status = dict(writeback_status)
+        status["recent_errors"] = list(writeback_status["recent_errors"])
+    status["mode"] = get_writeback_mode()
+    status["delay"] = config.get("rating_writeback_delay", 5)
+    status["pending"] = pending
+    status["next_write_in"] = round(max(next_due - time.time(), 0), 2) if next_due is not None else None
+    return status
@@ -63,31 +63,21 @@ def test_folder_penetration():
     print("===== 文件夹穿透功能测试结束 =====\n")
 
 def pregenerate_images_for_directory(directory):
-    """为指定目录及其所有子目录预生成照片的缩略图和浏览用大图"""
+    """为指定目录及其所有子目录预生成照片的缩略图和浏览用大图（多进程并行）"""
+    from utils.pregeneration import get_pregeneration_engine, PRIORITY_NEW_DIRECTORY
+    from utils.image_processor import print_pregeneration_stats
     if not os.path.isdir(directory):
         print(f"[错误] 目录不存在: {directory}")
         return
         
     print(f"[目录添加] 开始为新目录生成图片: {directory}")
     
-    # 使用集合来跟踪已经处理过的文件路径，避免重复处理
-    processed_files = set()
-    
     try:
-        # 递归获取目录及其所有子目录中的图片文件
-        all_image_files = get_all_images_recursive(directory)
-        
-        # 为每个图片文件生成缩略图和浏览用大图
-        for file_path in all_image_files:
-            # 检查文件是否已经处理过
-            if file_path not in processed_files:
-                # 添加到已处理集合
-                processed_files.add(file_path)
-                # 生成并保存缩略图
-                from utils.image_processor import generate_and_save_thumbnail, generate_and_save_viewer_image
-                generate_and_save_thumbnail(file_path)
-                generate_and_save_viewer_image(file_path)
+        engine = get_pregeneration_engine()
+        # 只等待本目录的文件，不等待其他目录的后台预生成
+        file_paths = engine.submit_directory(directory, PRIORITY_NEW_DIRECTORY)
+        engine.wait_until_idle(file_paths)
     except Exception as e:
         print(f"[错误] 处理目录 {directory} 时出错: {str(e)}")
     
-    print(f"[目录添加] 图片生成完成，共处理 {len(processed_files)} 个文件")
\ No newline at end of file
+    print_pregeneration_stats("目录添加")
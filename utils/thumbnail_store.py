@@ -0,0 +1,506 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from data.config_manager import config
+from utils.file_utils import get_thumbnail_path, FORMAT_JPEG
+
+# 缩略图存储方式：files 每张缩略图一个文件；pack 同一目录的缩略图追加写入一个打包文件
+THUMBNAIL_STORAGE_FILES = 'files'
+THUMBNAIL_STORAGE_PACK = 'pack'
+
+# 打包文件存放目录
+PACK_DIRECTORY = os.path.join('thumbnails', 'packs')
+
+# 打包文件中每条记录的头部：标识、路径长度、原图修改时间、数据长度，之后依次为路径（UTF-8）和JPEG数据
+# 数据长度为0的记录表示该原图的缩略图已删除
+RECORD_MAGIC = b'THPK'
+RECORD_HEADER = struct.Struct('<4sHdI')
+
+# 同时打开（内存映射）的打包文件数量上限
+MAX_OPEN_PACKS = 128
+
+
+def is_pack_storage():
+    """是否使用打包文件存储缩略图"""
+    return config.get("thumbnail_storage", THUMBNAIL_STORAGE_FILES) == THUMBNAIL_STORAGE_PACK
+
+
+def is_packed_format(fmt, size=None):
+    """该编码格式和尺寸的缩略图是否写入打包文件（打包文件只存放默认尺寸的JPEG缩略图，其他格式和尺寸仍按文件存储）"""
+    return fmt == FORMAT_JPEG and size is None and is_pack_storage()
+
+
+def _record_size(path, data_length):
+    return RECORD_HEADER.size + len(path.encode('utf-8', errors='surrogateescape')) + data_length
+
+
+def _parse_records(data, base_offset, pack_path):
+    """解析一段记录，返回 (记录列表, 完整解析的字节数)
+
+    末尾不完整的记录可能仍在被其他进程写入，下次再解析。
+    记录为 (原图路径, 数据在打包文件中的偏移, 数据长度, 原图修改时间)。
+    """
+    records = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        magic, path_length, source_mtime, data_length = RECORD_HEADER.unpack_from(data, offset)
+        if magic != RECORD_MAGIC:
+            print(f"[警告] 缩略图打包文件 {pack_path} 在偏移 {base_offset + offset} 处损坏，之后的记录将被忽略")
+            break
+        path_start = offset + RECORD_HEADER.size
+        record_end = path_start + path_length + data_length
+        if record_end > len(data):
+            break
+        path = data[path_start:path_start + path_length].decode('utf-8', errors='surrogateescape')
+        records.append((path, base_offset + path_start + path_length, data_length, source_mtime))
+        offset = record_end
+    return records, offset
+
+
+def _apply_records(entries, records):
+    """将记录加入索引，返回被覆盖或删除的旧记录占用的字节数"""
+    garbage_bytes = 0
+    for path, data_offset, data_length, source_mtime in records:
+        previous = entries.pop(path, None)
+        if previous is not None:
+            garbage_bytes += _record_size(path, previous[1])
+        if data_length:
+            entries[path] = (data_offset, data_length, source_mtime)
+        else:
+            garbage_bytes += _record_size(path, 0)
+    return garbage_bytes
+
+
+@contextmanager
+def _locked_file(lock_path):
+    """跨进程的文件锁（锁定单独的锁文件，锁文件一直保留）：POSIX使用flock，Windows使用msvcrt.locking"""
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            # LK_LOCK 重试约10秒后仍未取得锁时抛出异常，继续等待
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+class ThumbnailPack:
+    """一个目录的缩略图打包文件：只追加写入，通过内存映射读取
+
+    多个进程（页面请求和预生成工作进程）都会追加记录，追加和压缩都持有打包文件的锁文件（.lock），
+    不依赖各平台 O_APPEND 的原子性（Windows上不保证），压缩期间其他进程的追加等待压缩完成。
+    读取时发现文件变大就扫描新增的记录。索引快照保存在 .idx 文件中，启动时只需扫描快照之后追加的部分。
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.index_path = pack_path + '.idx'
+        self.lock_path = pack_path + '.lock'
+        self.lock = threading.Lock()
+        # 原图路径 -> (数据偏移, 数据长度, 原图修改时间)
+        self.entries = {}
+        self.indexed_size = 0
+        # 已建立索引的打包文件（压缩后文件被替换，需要重新建立索引）
+        self.pack_ino = None
+        # 已被覆盖或删除的记录占用的字节数，压缩时回收
+        self.garbage_bytes = 0
+        self.dirty = False
+        self.mm = None
+        self._load_index()
+
+    def _load_index(self):
+        """读取索引快照（快照比打包文件新或属于另一个文件时说明打包文件已被替换，忽略快照）"""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            pack_stat = os.stat(self.pack_path)
+        except (OSError, ValueError):
+            return
+        # 快照属于其他进程压缩前的旧文件时忽略
+        if snapshot.get('ino') != pack_stat.st_ino or snapshot.get('size', 0) > pack_stat.st_size:
+            return
+        self.pack_ino = pack_stat.st_ino
+        self.entries = {path: tuple(entry) for path, entry in snapshot.get('entries', {}).items()}
+        self.indexed_size = snapshot['size']
+        self.garbage_bytes = snapshot.get('garbage_bytes', 0)
+
+    def _reset(self):
+        self._close_map()
+        self.entries = {}
+        self.indexed_size = 0
+        self.garbage_bytes = 0
+        self.dirty = True
+
+    def _close_map(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def _apply_records(self, records):
+        self.garbage_bytes += _apply_records(self.entries, records)
+        self.dirty = True
+
+    def _refresh(self):
+        """扫描其他进程新追加的记录；打包文件被替换或删除时重新建立索引"""
+        try:
+            pack_stat = os.stat(self.pack_path)
+        except OSError:
+            if self.indexed_size:
+                self._reset()
+            return
+        if pack_stat.st_ino != self.pack_ino or pack_stat.st_size < self.indexed_size:
+            self._reset()
+            self.pack_ino = pack_stat.st_ino
+        pack_size = pack_stat.st_size
+        if pack_size == self.indexed_size:
+            return
+        with open(self.pack_path, 'rb') as f:
+            f.seek(self.indexed_size)
+            data = f.read(pack_size - self.indexed_size)
+        records, parsed_size = _parse_records(data, self.indexed_size, self.pack_path)
+        self._apply_records(records)
+        self.indexed_size += parsed_size
+
+    def get_source_mtime(self, file_path):
+        """缩略图生成时原图的修改时间，没有缩略图时返回None"""
+        with self.lock:
+            self._refresh()
+            entry = self.entries.get(file_path)
+            return entry[2] if entry else None
+
+    def read(self, file_path):
+        """从内存映射中读取缩略图数据，没有时返回None"""
+        with self.lock:
+            self._refresh()
+            entry = self.entries.get(file_path)
+            if entry is None:
+                return None
+            data_offset, data_length, _ = entry
+            # 打包文件变大后重新映射
+            if self.mm is None or len(self.mm) < data_offset + data_length:
+                self._close_map()
+                with open(self.pack_path, 'rb') as f:
+                    self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.mm[data_offset:data_offset + data_length]
+
+    def append(self, file_path, data, source_mtime):
+        """追加一条记录（data为空表示删除）"""
+        encoded_path = file_path.encode('utf-8', errors='surrogateescape')
+        record = RECORD_HEADER.pack(RECORD_MAGIC, len(encoded_path), source_mtime, len(data)) + encoded_path + data
+        with self.lock, _locked_file(self.lock_path):
+            # 持有锁时其他进程不会追加，先扫描已追加的记录，新记录紧接在已建立索引的部分之后
+            self._refresh()
+            fd = os.open(self.pack_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+            try:
+                pack_stat = os.fstat(fd)
+                written = os.write(fd, record)
+                if written != len(record):
+                    # 去掉写入不完整的记录，之后追加的记录仍能解析
+                    os.ftruncate(fd, pack_stat.st_size)
+                    raise OSError(f"写入缩略图打包文件不完整: {self.pack_path}")
+            finally:
+                os.close(fd)
+            if self.pack_ino != pack_stat.st_ino:
+                # 新建的打包文件
+                self._reset()
+                self.pack_ino = pack_stat.st_ino
+            self._apply_records([(file_path, pack_stat.st_size + len(record) - len(data), len(data), source_mtime)])
+            self.indexed_size = pack_stat.st_size + len(record)
+
+    def paths(self):
+        """打包文件中所有有效缩略图对应的原图路径"""
+        with self.lock:
+            self._refresh()
+            return list(self.entries)
+
+    def save_index(self):
+        """保存索引快照"""
+        with self.lock:
+            if not self.dirty:
+                return
+            snapshot = {"ino": self.pack_ino, "size": self.indexed_size, "garbage_bytes": self.garbage_bytes,
+                        "entries": self.entries}
+            # 多个进程可能同时保存快照，各自使用不同的临时文件
+            temp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(temp_path, self.index_path)
+            self.dirty = False
+
+    def compact(self, min_garbage_ratio):
+        """可回收空间超过比例时重写打包文件，只保留每张原图最新的缩略图，返回回收的字节数
+
+        重写期间持有打包文件的锁，其他进程的追加等待替换完成后写入新文件，不会丢失记录。
+        """
+        with self.lock, _locked_file(self.lock_path):
+            self._refresh()
+            if not self.indexed_size or self.garbage_bytes < self.indexed_size * min_garbage_ratio:
+                return 0
+            temp_path = self.pack_path + '.compact'
+            compacted = {}
+            with open(self.pack_path, 'rb') as source, open(temp_path, 'wb') as target:
+                for path, (data_offset, data_length, source_mtime) in self.entries.items():
+                    source.seek(data_offset)
+                    data = source.read(data_length)
+                    encoded_path = path.encode('utf-8', errors='surrogateescape')
+                    target.write(RECORD_HEADER.pack(RECORD_MAGIC, len(encoded_path), source_mtime, data_length) + encoded_path)
+                    compacted[path] = (target.tell(), data_length, source_mtime)
+                    target.write(data)
+                compacted_size = target.tell()
+
+            reclaimed = self.indexed_size - compacted_size
+            self._close_map()
+            os.replace(temp_path, self.pack_path)
+            self.pack_ino = os.stat(self.pack_path).st_ino
+            self.entries = compacted
+            self.indexed_size = compacted_size
+            self.garbage_bytes = 0
+            self.dirty = True
+        self.save_index()
+        return reclaimed
+
+    def close(self):
+        self.save_index()
+        with self.lock:
+            self._close_map()
+
+
+# 已打开的打包文件（最近使用的在末尾），超过上限时关闭最久未使用的
+_open_packs = OrderedDict()
+_open_packs_lock = threading.Lock()
+
+
+def _reset_open_packs_in_child():
+    """预生成工作进程由fork创建时，不继承父进程的打包文件对象（其中的锁可能正被其他线程持有）"""
+    global _open_packs, _open_packs_lock
+    _open_packs = OrderedDict()
+    _open_packs_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_open_packs_in_child)
+
+
+def _get_pack_path(file_path):
+    """原图所在目录对应的打包文件路径"""
+    directory = os.path.normcase(os.path.normpath(os.path.dirname(file_path)))
+    digest = hashlib.sha1(directory.encode('utf-8', errors='surrogateescape')).hexdigest()[:20]
+    return os.path.join(PACK_DIRECTORY, f'{digest}.pack')
+
+
+def _open_pack(pack_path):
+    with _open_packs_lock:
+        pack = _open_packs.pop(pack_path, None)
+        if pack is None:
+            pack = ThumbnailPack(pack_path)
+        _open_packs[pack_path] = pack
+        evicted = []
+        while len(_open_packs) > MAX_OPEN_PACKS:
+            evicted.append(_open_packs.popitem(last=False)[1])
+    for old_pack in evicted:
+        old_pack.close()
+    return pack
+
+
+def _get_pack(file_path):
+    return _open_pack(_get_pack_path(file_path.replace('/', os.path.sep)))
+
+
+def is_thumbnail_fresh(file_path, source_mtime, fmt=FORMAT_JPEG, size=None):
+    """缩略图是否存在且不比原图旧"""
+    if is_packed_format(fmt, size):
+        packed_mtime = _get_pack(file_path).get_source_mtime(file_path)
+        return packed_mtime is not None and packed_mtime >= source_mtime
+    try:
+        return os.path.getmtime(get_thumbnail_path(file_path, create_dir=False, fmt=fmt, size=size)) >= source_mtime
+    except OSError:
+        return False
+
+
+def read_thumbnail(file_path, fmt=FORMAT_JPEG, size=None):
+    """读取缩略图数据，没有时返回None"""
+    if is_packed_format(fmt, size):
+        return _get_pack(file_path).read(file_path)
+    try:
+        with open(get_thumbnail_path(file_path, create_dir=False, fmt=fmt, size=size), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def store_packed_thumbnail(file_path, data, source_mtime):
+    """将缩略图追加写入打包文件"""
+    _get_pack(file_path).append(file_path, data, source_mtime)
+
+
+def remove_packed_thumbnail(file_path):
+    """从打包文件中删除缩略图（追加删除记录，空间在压缩时回收）"""
+    pack_path = _get_pack_path(file_path)
+    if not os.path.exists(pack_path):
+        return False
+    pack = _open_pack(pack_path)
+    if pack.get_source_mtime(file_path) is None:
+        return False
+    pack.append(file_path, b'', 0.0)
+    return True
+
+
+def remove_orphan_packed_thumbnails(get_existing_paths):
+    """删除原图已不存在的打包缩略图，返回删除的数量（整个打包文件都失效时直接删除文件，否则在压缩时回收空间）
+
+    get_existing_paths 接收一个打包文件中的原图路径列表，返回其中仍然存在的路径集合。
+    """
+    if not os.path.isdir(PACK_DIRECTORY):
+        return 0
+    removed = 0
+    for name in os.listdir(PACK_DIRECTORY):
+        if not name.endswith('.pack'):
+            continue
+        pack_path = os.path.join(PACK_DIRECTORY, name)
+        pack = _open_pack(pack_path)
+        paths = pack.paths()
+        existing = get_existing_paths(paths)
+        orphans = [path for path in paths if path not in existing]
+        if not orphans:
+            continue
+        if len(orphans) == len(paths):
+            with _open_packs_lock:
+                _open_packs.pop(pack_path, None)
+            pack.close()
+            # 持有锁删除，其他进程之后的追加写入新建的打包文件（锁文件保留）
+            with _locked_file(pack.lock_path):
+                for file_path in (pack_path, pack.index_path):
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+        else:
+            for path in orphans:
+                pack.append(path, b'', 0.0)
+        removed += len(orphans)
+    return removed
+
+
+def save_thumbnail_pack_indexes():
+    """保存所有已打开打包文件的索引快照"""
+    with _open_packs_lock:
+        packs = list(_open_packs.values())
+    for pack in packs:
+        try:
+            pack.save_index()
+        except OSError as e:
+            print(f"[警告] 保存缩略图打包文件索引 {pack.index_path} 时出错: {str(e)}")
+
+
+def compact_thumbnail_packs(min_garbage_ratio=None):
+    """压缩可回收空间超过比例的打包文件，返回回收的总字节数"""
+    if min_garbage_ratio is None:
+        min_garbage_ratio = config.get("thumbnail_pack_compact_ratio", 0.3)
+    if not os.path.isdir(PACK_DIRECTORY):
+        return 0
+    reclaimed = 0
+    for name in os.listdir(PACK_DIRECTORY):
+        if not name.endswith('.pack'):
+            continue
+        try:
+            reclaimed += _open_pack(os.path.join(PACK_DIRECTORY, name)).compact(min_garbage_ratio)
+        except OSError as e:
+            print(f"[警告] 压缩缩略图打包文件 {name} 时出错: {str(e)}")
+    if reclaimed:
+        print(f"[缩略图打包] 压缩完成，回收 {reclaimed / 1024 / 1024:.2f}MB")
+    return reclaimed
+
+
+# 内存中的热门缩略图数据（最近使用的在末尾）：(原图路径, 派生图片类型) -> (原图修改时间, 缩略图参数签名, 数据)
+# 派生图片类型区分编码格式和尺寸，例如 thumbnail、thumbnail_webp、thumbnail_400
+_memory_thumbnails = OrderedDict()
+# 原图路径 -> 已缓存的派生图片类型，用于移除一张照片的所有缓存
+_memory_kinds = {}
+_memory_thumbnails_lock = threading.Lock()
+memory_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def _get_memory_budget():
+    return int(config.get("thumbnail_memory_cache_mb", 64) * 1024 * 1024)
+
+
+def _pop_memory_entry(key):
+    entry = _memory_thumbnails.pop(key, None)
+    if entry is not None:
+        memory_cache_stats["bytes"] -= len(entry[2])
+        kinds = _memory_kinds.get(key[0])
+        if kinds is not None:
+            kinds.discard(key[1])
+            if not kinds:
+                del _memory_kinds[key[0]]
+    return entry
+
+
+def get_memory_thumbnail(file_path, source_mtime, signature, kind="thumbnail"):
+    """从内存缓存中获取缩略图数据，原图修改时间或缩略图参数变化时视为未命中，返回None"""
+    key = (file_path, kind)
+    with _memory_thumbnails_lock:
+        entry = _memory_thumbnails.get(key)
+        if entry is None or entry[0] != source_mtime or entry[1] != signature:
+            memory_cache_stats["misses"] += 1
+            return None
+        _memory_thumbnails.move_to_end(key)
+        memory_cache_stats["hits"] += 1
+        return entry[2]
+
+
+def put_memory_thumbnail(file_path, source_mtime, signature, data, kind="thumbnail"):
+    """将缩略图数据加入内存缓存，超过内存预算时淘汰最久未使用的"""
+    budget = _get_memory_budget()
+    if not data or len(data) > budget:
+        return
+    key = (file_path, kind)
+    with _memory_thumbnails_lock:
+        _pop_memory_entry(key)
+        _memory_thumbnails[key] = (source_mtime, signature, data)
+        _memory_kinds.setdefault(file_path, set()).add(kind)
+        memory_cache_stats["bytes"] += len(data)
+        while memory_cache_stats["bytes"] > budget:
+            _pop_memory_entry(next(iter(_memory_thumbnails)))
+            memory_cache_stats["evictions"] += 1
+
+
+def discard_memory_thumbnail(file_path):
+    """从内存缓存中移除缩略图（所有编码格式和尺寸）"""
+    with _memory_thumbnails_lock:
+        for kind in list(_memory_kinds.get(file_path, ())):
+            _pop_memory_entry((file_path, kind))
+
+
+def get_memory_cache_status():
+    """内存缓存的命中统计"""
+    with _memory_thumbnails_lock:
+        status = dict(memory_cache_stats)
+        status["entries"] = len(_memory_thumbnails)
+    lookups = status["hits"] + status["misses"]
+    status["hit_rate"] = round(status["hits"] / lookups, 4) if lookups else 0.0
+    status["budget_bytes"] = _get_memory_budget()
+    return status